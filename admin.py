@@ -1,18 +1,23 @@
 import logging
+import os
+import re
 from flask_admin.contrib.sqla import ModelView
-from flask import request, redirect, url_for
+from flask_admin.contrib.sqla.filters import BaseSQLAFilter
+from flask import g, request, redirect, url_for
 from flask_admin import BaseView, expose
 from flask_admin.contrib.sqla.fields import QuerySelectField
 from flask_admin.form import Select2Widget
 from flask_admin.model import InlineFormAdmin
 from flask_login import current_user
-from sqlalchemy import select
-from sqlalchemy.orm import scoped_session, Session
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.orm import joinedload, scoped_session, Session
 from wtforms import BooleanField, SelectField
 from database import SessionLocal
 
-from api.openai.trancription import AssistanceHandlerOpenAI, client
-from models import Assistant, db, Prompts
+from api.openai.trancription import ASSISTANT_ENGINES, ENGINE_COMPLETION, AssistanceHandlerOpenAI, client
+from api.webhook.functions.gating import invalidate_gating_policy
+from api.webhook.functions.lookups import invalidate_assistant_config, invalidate_integrations, invalidate_managers
+from models import SEARCH_CONFIG, Analyzes, Assistant, db, Leads, Prompts
 
 
 class SecureModelView(ModelView):
@@ -23,6 +28,174 @@ class SecureModelView(ModelView):
         return redirect(url_for('login', next=request.url))
 
 
+def fulltext_match(column, search):
+    """``column @@ tsquery`` matching every word of ``search`` as a prefix, or None when it has no words."""
+    words = re.findall(r"\w+", search or "")
+    if not words:
+        return None
+    # The words are plain \w+, so joining them cannot inject tsquery operators.
+    return column.op("@@")(func.to_tsquery(SEARCH_CONFIG, " & ".join(f"{word}:*" for word in words)))
+
+
+class FullTextSearchFilter(BaseSQLAFilter):
+    def apply(self, query, value, alias=None):
+        clause = fulltext_match(self.get_column(alias), value)
+        return query if clause is None else query.filter(clause)
+
+    def operation(self):
+        return 'matches'
+
+
+class FullTextSearchMixin:
+    """Runs the list search box against the model's GIN-indexed ``search_vector`` instead of ILIKE scans."""
+    column_fulltext_search = 'search_vector'
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        clause = fulltext_match(getattr(self.model, self.column_fulltext_search), search)
+        if clause is None:
+            return query, count_query, joins, count_joins
+        query = query.filter(clause)
+        if count_query is not None:
+            count_query = count_query.filter(clause)
+        return query, count_query, joins, count_joins
+
+
+# Above this many rows list pages show an estimate instead of running COUNT(*).
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", 100000))
+KEYSET_ARGS = ('after', 'before')
+
+
+class EstimatedCount(int):
+    """Row count rendered as approximate (``~1,234,567``) or as a lower bound (``100,000+``)."""
+
+    def __new__(cls, value, lower_bound=False):
+        count = super().__new__(cls, value)
+        count.lower_bound = lower_bound
+        return count
+
+    def __str__(self):
+        return f"{int(self):,}+" if self.lower_bound else f"~{int(self):,}"
+
+
+class KeysetPaginationMixin:
+    """List pages seek past the previous page's last ``column_keyset`` value instead of using OFFSET,
+    so a deep page costs the same as the first one.
+
+    Keyset paging applies while the list is sorted by ``column_keyset``; other sort orders fall back to
+    OFFSET. Non-unique keys such as ``created_at`` are paired with ``id`` and need a matching index.
+    """
+    column_keyset = 'id'
+    column_default_sort = ('id', True)
+    list_template = 'admin/model/keyset_list.html'
+
+    def _keyset_columns(self):
+        columns = [getattr(self.model, self.column_keyset)]
+        if self.column_keyset != 'id':
+            columns.append(self.model.id)
+        return columns
+
+    def _keyset_desc(self, sort_column, sort_desc):
+        """Sort direction if the list is ordered by the keyset column, otherwise None."""
+        if sort_column is None:
+            default = self.column_default_sort
+            if isinstance(default, tuple) and default[0] == self.column_keyset:
+                return bool(default[1])
+            return None
+        return bool(sort_desc) if sort_column == self.column_keyset else None
+
+    def _encode_cursor(self, row):
+        values = (getattr(row, column.key) for column in self._keyset_columns())
+        return '|'.join(value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in values)
+
+    def _decode_cursor(self, cursor):
+        parts = cursor.split('|')
+        columns = self._keyset_columns()
+        if len(parts) != len(columns):
+            return None
+        try:
+            return [
+                column.type.python_type.fromisoformat(part) if hasattr(column.type.python_type, 'fromisoformat')
+                else column.type.python_type(part)
+                for column, part in zip(columns, parts)
+            ]
+        except (TypeError, ValueError):
+            return None
+
+    def _count(self, query, filtered):
+        if not filtered:
+            estimate = self.session.execute(
+                text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+                {"table": self.model.__table__.name},
+            ).scalar()
+            # reltuples is -1 until the table is first analysed.
+            if estimate is not None and estimate > ADMIN_EXACT_COUNT_LIMIT:
+                return EstimatedCount(estimate)
+            return self.get_count_query().scalar()
+
+        # Searches and filters can't use the statistics, so count at most one row past the limit.
+        limited = query.with_entities(self.model.id).limit(ADMIN_EXACT_COUNT_LIMIT + 1).subquery()
+        count = self.session.query(func.count()).select_from(limited).scalar()
+        return EstimatedCount(ADMIN_EXACT_COUNT_LIMIT, lower_bound=True) if count > ADMIN_EXACT_COUNT_LIMIT else count
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        joins = {}
+        query = self.get_query()
+
+        if self._search_supported and search:
+            query, _, joins, _ = self._apply_search(query, None, joins, {}, search)
+        if filters and self._filters:
+            query, _, joins, _ = self._apply_filters(query, None, joins, {}, filters)
+
+        count = None if self.simple_list_pager else self._count(query, bool(search or filters))
+
+        for join in self._auto_joins:
+            query = query.options(joinedload(join))
+
+        if page_size is None:
+            page_size = self.page_size
+        keyset_desc = self._keyset_desc(sort_column, sort_desc)
+        direction, cursor = next(
+            ((arg, request.args[arg]) for arg in KEYSET_ARGS if request.args.get(arg)), (None, None)
+        )
+        values = self._decode_cursor(cursor) if cursor and page and execute else None
+
+        if keyset_desc is None or values is None or not page_size:
+            # First page, another sort order or a bare page number: the regular OFFSET query.
+            query, joins = self._apply_sorting(query, joins, sort_column, sort_desc)
+            query = self._apply_pagination(query, page, page_size)
+            if not execute:
+                return count, query
+            data = query.all()
+        else:
+            columns = self._keyset_columns()
+            key = columns[0] if len(columns) == 1 else tuple_(*columns)
+            bound = values[0] if len(columns) == 1 else tuple_(*values)
+            # "before" walks back towards the first page, so it reads in the opposite order.
+            descending = keyset_desc != (direction == 'before')
+            query = query.filter(key < bound if descending else key > bound)
+            query = query.order_by(*(column.desc() if descending else column.asc() for column in columns))
+            data = query.limit(page_size).all()
+            if direction == 'before':
+                data.reverse()
+
+        if keyset_desc is not None and data:
+            g.keyset_page = (page, self._encode_cursor(data[0]), self._encode_cursor(data[-1]))
+        return count, data
+
+    def _get_list_url(self, view_args):
+        view_args = view_args.clone(
+            extra_args={k: v for k, v in view_args.extra_args.items() if k not in KEYSET_ARGS}
+        )
+        current = g.get('keyset_page')
+        if current and view_args.page:
+            page, first, last = current
+            if view_args.page == page + 1:
+                view_args.extra_args['after'] = last
+            elif view_args.page == page - 1:
+                view_args.extra_args['before'] = first
+        return super()._get_list_url(view_args)
+
+
 class UserAdminView(SecureModelView):
     column_list = ('id', 'username')
 
@@ -32,33 +205,73 @@ class IntegrationsAdminView(SecureModelView):
     column_searchable_list = ('subdomain', 'link')
     form_columns = ('subdomain', 'link')
 
+    def after_model_change(self, form, model, is_created):
+        invalidate_integrations()
+
+    def after_model_delete(self, model):
+        invalidate_integrations()
+
 
 class ManagerAdminView(SecureModelView):
     column_list = ('id', 'crm_user_id', 'username', 'type', 'is_permissions')
     column_searchable_list = ('username', 'crm_user_id')
     form_columns = ('crm_user_id', 'username', 'type', 'is_permissions')
 
+    def after_model_change(self, form, model, is_created):
+        invalidate_managers()
 
-class LeadsAdminView(SecureModelView):
+    def after_model_delete(self, model):
+        invalidate_managers()
+
+
+class LeadsAdminView(FullTextSearchMixin, KeysetPaginationMixin, SecureModelView):
     column_list = (
         'id', 'owner_id', 'account_id', 'element_id', 'element_type', 'manager_id', 'integration_id', 'text_message',
         'timestamp_x', 'created_at', 'updated_at', 'lead_status')
-    column_searchable_list = ('owner_id', 'text_message', 'manager.username')
+    # Searches text_message through search_vector; owner and manager moved to filters.
+    column_searchable_list = ('text_message',)
     form_columns = (
         'owner_id', 'account_id', 'element_id', 'element_type', 'manager_id', 'integration_id', 'text_message')
-    column_filters = ('lead_status',)
+    column_filters = (
+        'lead_status', 'owner_id', 'manager.username',
+        FullTextSearchFilter(Leads.search_vector, 'Text message'),
+    )
 
 
-class PhonetAdminView(SecureModelView):
+class GatingPolicyAdminView(SecureModelView):
+    column_list = (
+        'id', 'name', 'min_transcribe_seconds', 'min_analyse_seconds', 'metadata_only_statuses',
+        'metadata_only_results', 'transcribe_only_statuses', 'is_active', 'updated_at')
+    form_columns = (
+        'name', 'min_transcribe_seconds', 'min_analyse_seconds', 'metadata_only_statuses', 'metadata_only_results',
+        'transcribe_only_statuses', 'is_active')
+    column_descriptions = {
+        'min_transcribe_seconds': 'Shorter calls are stored without audio',
+        'min_analyse_seconds': 'Shorter calls are transcribed but not analysed',
+        'metadata_only_statuses': 'Comma-separated call_status codes stored without audio',
+        'metadata_only_results': 'Comma-separated call_result values stored without audio',
+        'transcribe_only_statuses': 'Comma-separated call_status codes transcribed but not analysed',
+        'is_active': 'The first active policy is applied',
+    }
+
+    def after_model_change(self, form, model, is_created):
+        invalidate_gating_policy()
+
+    def after_model_delete(self, model):
+        invalidate_gating_policy()
+
+
+class PhonetAdminView(KeysetPaginationMixin, SecureModelView):
     column_list = ('id', 'unique_uuid', 'audio_mp3', 'phone_number', 'duration', 'call_status', 'call_result')
     column_searchable_list = ('phone_number', 'call_result')
     form_columns = ('audio_mp3', 'phone_number', 'duration', 'call_status', 'call_result')
 
 
-class AnalysesAdminView(ModelView):
+class AnalysesAdminView(FullTextSearchMixin, KeysetPaginationMixin, ModelView):
     column_list = ('id', 'lead_element_id', 'audio_text', 'analysed_text', 'is_analysed', 'created_at')
     column_labels = {'lead_element_id': 'Lead Element ID'}
     column_searchable_list = ('audio_text', 'analysed_text')
+    column_filters = (FullTextSearchFilter(Analyzes.search_vector, 'Transcript or analysis'),)
     form_columns = ('lead_id', 'audio_text', 'analysed_text', 'is_analysed')
 
     def _lead_element_id_formatter(self, context, model, name):
@@ -66,20 +279,27 @@ class AnalysesAdminView(ModelView):
         return model.lead
 
 
-class PhonetLeadsAdminView(SecureModelView):
+class PhonetLeadsAdminView(KeysetPaginationMixin, SecureModelView):
     column_list = ('id', 'phonet_id', 'leads_id', 'last_update')
     column_searchable_list = ('phonet_id', 'leads_id')
     form_columns = ('phonet_id', 'leads_id', 'last_update')
 
 
 class AssistantAdminView(ModelView):
-    column_list = ["id", "assistant_name", "model", "description", "message_prompt", "is_active"]
-    form_columns = ["assistant_name", "model", "description", "message_prompt", "is_active"]
+    column_list = ["id", "assistant_name", "model", "engine", "description", "message_prompt", "is_active"]
+    form_columns = ["assistant_name", "model", "engine", "description", "message_prompt", "is_active"]
     form_overrides = {"is_active": BooleanField}  # Використовуємо BooleanField для is_active#
+    form_choices = {"engine": [(engine, engine) for engine in ASSISTANT_ENGINES]}
+    column_descriptions = {
+        "engine": "assistants: OpenAI thread and run per call; completion: one chat completion request",
+    }
 
     def on_model_change(self, form, model, is_created):
         try:
-            if is_created:
+            if model.engine == ENGINE_COMPLETION:
+                # Completion assistants are stateless; there is nothing to sync with OpenAI.
+                pass
+            elif is_created:
                 handler = AssistanceHandlerOpenAI(
                     assistant=None,
                     instructions=None,
@@ -114,6 +334,12 @@ class AssistantAdminView(ModelView):
         finally:
             super().on_model_change(form, model, is_created)
 
+    def after_model_change(self, form, model, is_created):
+        invalidate_assistant_config()
+
+    def after_model_delete(self, model):
+        invalidate_assistant_config()
+
     def on_model_delete(self, model):
         if model.assistant_id:
             handler = AssistanceHandlerOpenAI(
@@ -167,5 +393,11 @@ class PromptsAdmin(ModelView):
 
         print(f"Assigned assistant_id {assistant_id} to model.")
 
+    def after_model_change(self, form, model, is_created):
+        invalidate_assistant_config()
+
+    def after_model_delete(self, model):
+        invalidate_assistant_config()
+
     def __init__(self, *args, **kwargs):
         super(PromptsAdmin, self).__init__(*args, **kwargs)
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import random
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Set
+
+from openai import AsyncOpenAI, RateLimitError
+
+from api.openai.trancription import assistant_analyse_async, transcriptions_async
+from api.webhook.functions import openai_queue
+from api.webhook.functions.checkpoint import complete_stage, is_done, load_call, mark_stage, record_failure, reset_stage
+from api.webhook.functions.source import AudioManager
+from api.webhook.pipeline import DEFER_JITTER, defer_delay, defer_reason, resume_pipeline, save_transcript
+from http_client import openai_async_http_client
+from metrics import metrics
+from rate_limit import RateLimited
+from resilience import RETRY_POLICIES, CircuitOpen, breakers, is_out_of_quota, is_transient, may_park
+
+logger = logging.getLogger(__name__)
+
+# Calls in flight per process; each one waiting on OpenAI costs a coroutine, not a thread.
+OPENAI_ASYNC_CONCURRENCY = int(os.getenv("OPENAI_ASYNC_CONCURRENCY", 64))
+# Threads for database work and chunked transcriptions; keep within the DB pool (DB_POOL_ROLE=worker-threads).
+OPENAI_ASYNC_THREADS = int(os.getenv("OPENAI_ASYNC_THREADS", 12))
+OPENAI_ASYNC_POLL_INTERVAL = float(os.getenv("OPENAI_ASYNC_POLL_INTERVAL", 1))
+
+TASK_NAME = "openai_async"
+
+
+class AsyncStageWorker:
+    """Runs the transcribe and analyze stages of queued calls on one AsyncOpenAI client.
+
+    A semaphore of ``concurrency`` slots bounds the calls in flight; a call is claimed from
+    openai_queue only when a slot is free. Once its OpenAI stages are done, the rest of the
+    call's chain goes back to Celery through resume_pipeline.
+    """
+
+    def __init__(self, concurrency: int = OPENAI_ASYNC_CONCURRENCY, client: Optional[AsyncOpenAI] = None) -> None:
+        self.__concurrency = concurrency
+        self.__inflight: Set[asyncio.Task] = set()
+        self.__slots = asyncio.Semaphore(concurrency)
+        self.__stopping = asyncio.Event()
+        self.__client = client
+
+    def stop(self) -> None:
+        self.__stopping.set()
+
+    async def serve(self) -> None:
+        if self.__client is None:
+            self.__client = AsyncOpenAI(
+                api_key=os.environ["OPENAI_API_KEY"],
+                http_client=openai_async_http_client(self.__concurrency),
+            )
+        try:
+            while not self.__stopping.is_set():
+                await self.__slots.acquire()
+                claimed = openai_queue.claim(1)
+                if not claimed:
+                    self.__slots.release()
+                    await self.__idle()
+                    continue
+
+                task = asyncio.create_task(self.__process(claimed[0]))
+                self.__inflight.add(task)
+                task.add_done_callback(self.__finished)
+                metrics.set_gauge("openai_async_inflight", len(self.__inflight))
+            # Calls still in flight finish; anything claimed later is left to its lease.
+            await asyncio.gather(*self.__inflight, return_exceptions=True)
+        finally:
+            await self.__client.close()
+
+    async def __idle(self) -> None:
+        try:
+            await asyncio.wait_for(self.__stopping.wait(), OPENAI_ASYNC_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+    def __finished(self, task: asyncio.Task) -> None:
+        self.__inflight.discard(task)
+        self.__slots.release()
+        metrics.set_gauge("openai_async_inflight", len(self.__inflight))
+
+    async def __process(self, call_key: str) -> None:
+        try:
+            resume = await self.__run_stages(call_key)
+        except (RateLimited, RateLimitError, CircuitOpen) as e:
+            await self.__defer(call_key, e)
+            return
+        except Exception as e:
+            await self.__fail(call_key, e)
+            return
+
+        # Acked first: a resumed chain that starts at download_audio submits the call again.
+        openai_queue.ack(call_key)
+        if not resume:
+            return
+        try:
+            await asyncio.to_thread(_resume, call_key)
+        except Exception:
+            logger.error(
+                f"Could not resume the chain of call {call_key}",
+                exc_info=True,
+                extra={
+                    "status_code": "500",
+                    "status_message": "Chain resume error",
+                    "operation_type": "WEBHOOK",
+                    "service": "FLASK",
+                },
+            )
+            # Its finished stages are skipped when it comes round again.
+            openai_queue.requeue(call_key, OPENAI_ASYNC_POLL_INTERVAL * 10)
+
+    async def __run_stages(self, call_key: str) -> bool:
+        """Run the call's unfinished OpenAI stages; True when the rest of its chain should follow."""
+        record = await asyncio.to_thread(load_call, call_key)
+        if record is None:
+            return False
+
+        if not is_done(record, "transcribed"):
+            if record.audio_path and not Path(record.audio_path).exists():
+                # The file was lost since the download checkpoint, e.g. on another host;
+                # download_audio fetches it again and hands the call back.
+                await asyncio.to_thread(reset_stage, call_key, "downloaded")
+                return True
+            await self.__transcribe(call_key, record)
+            record = await asyncio.to_thread(load_call, call_key)
+
+        if not is_done(record, "analysed"):
+            return await self.__analyse(call_key, record)
+        return True
+
+    async def __transcribe(self, call_key: str, record) -> None:
+        if not record.audio_path:
+            await asyncio.to_thread(complete_stage, call_key, "transcribed", transcript="")
+            return
+
+        with breakers["openai"].guard():
+            transcript = await transcriptions_async(self.__client, record.audio_path) or ""
+        await asyncio.to_thread(save_transcript, call_key, record, transcript)
+        await asyncio.to_thread(AudioManager().delete, Path(record.audio_path))
+
+    async def __analyse(self, call_key: str, record) -> bool:
+        with breakers["openai"].guard():
+            # The Analyzes row and the checkpoint commit together, as in analyze_transcript.
+            analysis = await assistant_analyse_async(
+                self.__client,
+                transcrip_text=record.transcript or "",
+                crm_data_json={"lead_id": record.lead_id},
+                on_saved=lambda db, analysed: mark_stage(
+                    db, call_key, "analysed", analysed_text=analysed.analysed_text
+                ),
+            )
+        return analysis is not None
+
+    async def __defer(self, call_key: str, error: Exception) -> None:
+        if is_out_of_quota(error) or not may_park(call_key, TASK_NAME, defer_reason(error)):
+            await self.__fail(call_key, error)
+            return
+
+        retry_after = defer_delay(error)
+        logger.warning(
+            f"Call {call_key} deferred for {retry_after:.1f}s: {error}",
+            extra={
+                "status_code": "429",
+                "status_message": "Dependency unavailable",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        # Jitter keeps deferred calls from coming back as one burst.
+        openai_queue.requeue(call_key, retry_after + random.uniform(0, DEFER_JITTER))
+        metrics.incr("pipeline_parked_total", task=TASK_NAME, reason=defer_reason(error))
+
+    async def __fail(self, call_key: str, error: Exception) -> None:
+        logger.error(
+            f"OpenAI stage failed for call {call_key}",
+            exc_info=error,
+            extra={
+                "status_code": "500",
+                "status_message": "Async OpenAI stage error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        await asyncio.to_thread(_record_failure, call_key, error)
+
+        policy = RETRY_POLICIES["openai"]
+        if is_transient(error):
+            retries = openai_queue.count_retry(call_key) - 1
+            if retries < policy.max_retries:
+                metrics.incr("pipeline_retries_total", task=TASK_NAME, dependency="openai")
+                openai_queue.requeue(call_key, policy.countdown(retries))
+                return
+        openai_queue.ack(call_key)
+
+
+def _record_failure(call_key: str, error: Exception) -> None:
+    record = load_call(call_key)
+    if record is not None:
+        record_failure(call_key, "analysed" if is_done(record, "transcribed") else "transcribed", error)
+
+
+def _resume(call_key: str) -> None:
+    pipeline = resume_pipeline(call_key)
+    if pipeline is not None:
+        pipeline.apply_async()
+
+
+def run(concurrency: int = OPENAI_ASYNC_CONCURRENCY) -> None:
+    async def main() -> None:
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(OPENAI_ASYNC_THREADS))
+        worker = AsyncStageWorker(concurrency)
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signum, worker.stop)
+        logger.info(
+            f"Async OpenAI worker started with {concurrency} slots",
+            extra={
+                "status_code": "100",
+                "status_message": "Async worker started",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        await worker.serve()
+
+    asyncio.run(main())
@@ -5,6 +5,8 @@ from typing import Optional
 from flask import Response
 
 from api.webhook.functions.database_orm import save_analyse_data_to_database
+from api.webhook.functions.lookups import manager_permissions
+from local_cache import MISSING
 from models import Manager
 
 logger = logging.getLogger(__name__)
@@ -57,13 +59,18 @@ def has_permission(func):
 
 
 def check_user_permission(manager_id: Optional[int]) -> bool:
+    cached = manager_permissions.get(manager_id)
+    if cached is not MISSING:
+        return cached
+
     try:
-        manager_permission = (
+        manager_permission = bool(
             Manager.query.with_entities(Manager.is_permissions)
             .filter_by(id=manager_id)
             .scalar()
         )
-        return bool(manager_permission)
+        manager_permissions.set(manager_id, manager_permission)
+        return manager_permission
     except Exception:
         logger.error(
             f"Error checking permission for manager {manager_id}",
@@ -0,0 +1,161 @@
+import logging
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", 300))
+CHUNK_OVERLAP_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_OVERLAP", 1.5))
+CHUNK_WORKERS = int(os.getenv("TRANSCRIBE_CHUNK_WORKERS", 4))
+# Silences within this distance of a target boundary are preferred over a hard cut.
+SILENCE_SEARCH_SECONDS = float(os.getenv("TRANSCRIBE_SILENCE_SEARCH", 30))
+SILENCE_NOISE = os.getenv("TRANSCRIBE_SILENCE_NOISE", "-35dB")
+SILENCE_MIN_SECONDS = float(os.getenv("TRANSCRIBE_SILENCE_MIN", 0.4))
+STITCH_MAX_WORDS = 40
+
+_SILENCE_PATTERN = re.compile(r"silence_(start|end): (-?[\d.]+)")
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def probe_duration(path: str) -> Optional[float]:
+    try:
+        result = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return float(result.stdout.strip())
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        logger.warning(
+            "Could not probe audio duration",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "ffprobe error",
+                "operation_type": "TRANSCRIPTION",
+                "service": "FLASK",
+            },
+        )
+        return None
+
+
+def detect_silences(path: str) -> List[Tuple[float, float]]:
+    result = subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-nostats", "-i", path,
+            "-af", f"silencedetect=noise={SILENCE_NOISE}:d={SILENCE_MIN_SECONDS}",
+            "-f", "null", "-",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    silences, start = [], None
+    for kind, value in _SILENCE_PATTERN.findall(result.stderr):
+        if kind == "start":
+            start = max(float(value), 0.0)
+        elif start is not None:
+            silences.append((start, float(value)))
+            start = None
+    return silences
+
+
+def split_points(duration: float, silences: Sequence[Tuple[float, float]]) -> List[Tuple[float, bool]]:
+    """Pick a cut near every CHUNK_SECONDS mark, at the middle of the closest silence when there is one.
+
+    Returns (offset, at_silence) pairs; cuts made in speech get an overlap so no word is lost.
+    """
+    points, last = [], 0.0
+    target = CHUNK_SECONDS
+    while duration - last > CHUNK_SECONDS * 1.2:
+        candidates = [
+            (start + end) / 2
+            for start, end in silences
+            if abs((start + end) / 2 - target) <= SILENCE_SEARCH_SECONDS and (start + end) / 2 > last
+        ]
+        if candidates:
+            cut, at_silence = min(candidates, key=lambda point: abs(point - target)), True
+        else:
+            cut, at_silence = target, False
+        points.append((cut, at_silence))
+        last = cut
+        target = cut + CHUNK_SECONDS
+    return points
+
+
+def split_audio(path: str, duration: float, points: Sequence[Tuple[float, bool]], out_dir: str) -> List[str]:
+    bounds = [(0.0, True), *points]
+    chunks = []
+    for index, (start, at_silence) in enumerate(bounds):
+        end = bounds[index + 1][0] if index + 1 < len(bounds) else duration
+        if not at_silence:
+            start = max(start - CHUNK_OVERLAP_SECONDS, 0.0)
+        chunk_path = str(Path(out_dir) / f"chunk_{index:03d}{Path(path).suffix}")
+        subprocess.run(
+            [
+                "ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+                "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}", "-i", path,
+                "-c", "copy", chunk_path,
+            ],
+            check=True,
+        )
+        chunks.append(chunk_path)
+    return chunks
+
+
+def _normalise(words: Sequence[str]) -> List[str]:
+    return [word.lower() for word in words]
+
+
+def stitch(texts: Sequence[str], overlapped: Optional[Sequence[bool]] = None) -> str:
+    """Join chunk transcripts, dropping words repeated across an overlapping boundary.
+
+    ``overlapped[i]`` tells whether chunk ``i + 1`` starts inside chunk ``i``; defaults to all boundaries.
+    """
+    stitched: List[str] = []
+    for index, text in enumerate(texts):
+        words = text.split()
+        if stitched and words and (overlapped is None or overlapped[index - 1]):
+            tail = _normalise(_WORD_PATTERN.findall(" ".join(stitched[-STITCH_MAX_WORDS:])))
+            overlap = 0
+            for size in range(min(len(tail), len(words), STITCH_MAX_WORDS), 0, -1):
+                head = _normalise(_WORD_PATTERN.findall(" ".join(words[:size])))
+                if head and tail[-len(head):] == head:
+                    overlap = size
+                    break
+            words = words[overlap:]
+        stitched.extend(words)
+    return " ".join(stitched)
+
+
+def transcribe_chunked(
+    path: str,
+    duration: float,
+    transcribe: Callable[[str], str],
+    max_workers: int = CHUNK_WORKERS,
+) -> str:
+    points = split_points(duration, detect_silences(path))
+    if not points:
+        return transcribe(path)
+
+    with tempfile.TemporaryDirectory(prefix="chunks-") as out_dir:
+        chunks = split_audio(path, duration, points, out_dir)
+        logger.info(
+            f"Transcribing {len(chunks)} chunks of {path}",
+            extra={
+                "status_code": "100",
+                "status_message": "Chunked transcription started",
+                "operation_type": "TRANSCRIPTION",
+                "service": "FLASK",
+            },
+        )
+        # map keeps the chunk order regardless of which request finishes first.
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcribe-chunk") as pool:
+            texts = list(pool.map(transcribe, chunks))
+    return stitch(texts, [not at_silence for _, at_silence in points])
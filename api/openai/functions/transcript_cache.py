@@ -0,0 +1,97 @@
+import hashlib
+import json
+import logging
+import os
+from typing import NamedTuple, Optional
+
+from sqlalchemy.dialects.postgresql import insert
+
+from database import SessionLocal
+from metrics import metrics
+from models import TranscriptionCache
+from redis_config import redis_client
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_CACHE_TTL = int(os.getenv("TRANSCRIPT_CACHE_TTL", 7 * 24 * 3600))
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class CachedTranscript(NamedTuple):
+    text: str
+    duration: Optional[float]
+
+
+def content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _redis_key(digest: str, model: str) -> str:
+    return f"transcript:{model}:{digest}"
+
+
+def _redis_get(digest: str, model: str) -> Optional[CachedTranscript]:
+    try:
+        cached = redis_client.get(_redis_key(digest, model))
+    except Exception:
+        logger.warning(
+            "Transcript cache read from Redis failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Transcript cache Redis error",
+                "operation_type": "CACHE",
+                "service": "FLASK",
+            },
+        )
+        return None
+    return CachedTranscript(**json.loads(cached)) if cached else None
+
+
+def _redis_set(digest: str, model: str, transcript: CachedTranscript) -> None:
+    try:
+        redis_client.set(_redis_key(digest, model), json.dumps(transcript._asdict()), ex=TRANSCRIPT_CACHE_TTL)
+    except Exception:
+        logger.warning(
+            "Transcript cache write to Redis failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Transcript cache Redis error",
+                "operation_type": "CACHE",
+                "service": "FLASK",
+            },
+        )
+
+
+def lookup(digest: str, model: str) -> Optional[CachedTranscript]:
+    transcript, tier = _redis_get(digest, model), "redis"
+    if transcript is None:
+        with SessionLocal() as db:
+            row = db.query(TranscriptionCache.text, TranscriptionCache.duration).filter_by(
+                content_hash=digest, model=model
+            ).first()
+        if row is None:
+            metrics.incr("transcription_cache_total", result="miss", model=model)
+            return None
+        transcript, tier = CachedTranscript(row.text, row.duration), "postgres"
+        _redis_set(digest, model, transcript)
+
+    metrics.incr("transcription_cache_total", result="hit", tier=tier, model=model)
+    if transcript.duration:
+        metrics.incr("transcription_cache_saved_audio_seconds_total", transcript.duration, model=model)
+    return transcript
+
+
+def store(digest: str, model: str, text: str, duration: Optional[float]) -> None:
+    with SessionLocal() as db, db.begin():
+        db.execute(
+            insert(TranscriptionCache)
+            .values(content_hash=digest, model=model, text=text, duration=duration)
+            .on_conflict_do_nothing(constraint="uq_transcription_cache_hash_model")
+        )
+    _redis_set(digest, model, CachedTranscript(text, duration))
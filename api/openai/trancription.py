@@ -1,24 +1,45 @@
+import asyncio
 import os
 import logging
-from typing import Optional
+from typing import Optional, Tuple
 from functools import wraps
 
 from flask import Response
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI, RateLimitError
 from openai.types.beta import thread
 from openai import AssistantEventHandler
 from dotenv import load_dotenv
 
 from api.openai.decorators import has_permission
+from api.openai.functions import chunking, transcript_cache
 from api.openai.placeholders import Thread, Message
+from http_client import openai_http_client
 from api.webhook.functions.database_orm import save_analyse_data_to_database
+from api.webhook.functions.lookups import ASSISTANT_CONFIG, assistant_config
+from local_cache import MISSING
 from database import SessionLocal
 from models import Manager, Assistant, Prompts
+from rate_limit import RateLimited, openai_limiter
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
-client = OpenAI(api_key=os.environ['OPENAI_API_KEY'])
+TRANSCRIPTION_MODEL = os.getenv("TRANSCRIPTION_MODEL", "whisper-1")
+TRANSCRIBE_CHUNKED = os.getenv("TRANSCRIBE_CHUNKED", "true").lower() == "true"
+TRANSCRIBE_CHUNK_THRESHOLD = float(os.getenv("TRANSCRIBE_CHUNK_THRESHOLD", 600))
+# Whisper rejects uploads over 25 MB.
+WHISPER_MAX_UPLOAD_BYTES = 24 * 1024 * 1024
+# Used to estimate audio seconds before the upload; Phonet records at 128 kbit/s.
+MP3_BYTES_PER_SECOND = 16000
+# Output budget reserved from the tokens-per-minute bucket until the real usage is known.
+COMPLETION_TOKEN_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_TOKEN_ESTIMATE", 1000))
+
+ENGINE_ASSISTANTS = "assistants"
+ENGINE_COMPLETION = "completion"
+ASSISTANT_ENGINES = (ENGINE_ASSISTANTS, ENGINE_COMPLETION)
+DEFAULT_ANALYSIS_MODEL = "gpt-4o-mini"
+
+client = OpenAI(api_key=os.environ['OPENAI_API_KEY'], http_client=openai_http_client())
 
 
 class AssistanceHandlerOpenAI(AssistantEventHandler):
@@ -111,39 +132,128 @@ class AssistanceHandlerOpenAI(AssistantEventHandler):
             return stream
 
 
-def get_first_active_assistant():
+def _load_active_assistant() -> Optional[dict]:
     with SessionLocal() as db:
         result = (
-            db.query(Assistant.assistant_id, Assistant.message_prompt)
+            db.query(Assistant.id, Assistant.assistant_id, Assistant.message_prompt, Assistant.model, Assistant.engine)
             .filter(Assistant.is_active == True)
             .first()
         )
-        if result:
-            logger.info(
-                "Active assistant found",
-                extra={
-                    "status_code": "200",
-                    "status_message": "Assistant loaded",
-                    "operation_type": "ASSISTANT",
-                    "service": "FLASK",
-                },
-            )
-            return {"assistant_id": result[0], "message_promt": result[1]}
+        if not result:
+            return None
 
-        logger.warning(
-            "No active assistant found",
+        prompts = (
+            db.query(Prompts.prompt_type, Prompts.content)
+            .filter(Prompts.assistant_id == result.id, Prompts.is_active == True)
+            .all()
+        )
+        return {
+            "assistant_id": result.assistant_id,
+            "message_promt": result.message_prompt,
+            "model": result.model,
+            "engine": result.engine or ENGINE_ASSISTANTS,
+            # Cached with the assistant, but not sent: the instructions are message_prompt alone, as before.
+            "prompts": tuple((prompt.prompt_type, prompt.content) for prompt in prompts),
+        }
+
+
+def get_first_active_assistant():
+    # Served from the per-worker cache; the admin views publish an invalidation on every edit.
+    config = assistant_config.get(ASSISTANT_CONFIG)
+    if config is MISSING:
+        config = _load_active_assistant()
+        assistant_config.set(ASSISTANT_CONFIG, config)
+
+    if config:
+        logger.info(
+            "Active assistant found",
             extra={
-                "status_code": "400",
-                "status_message": "No assistant found",
+                "status_code": "200",
+                "status_message": "Assistant loaded",
                 "operation_type": "ASSISTANT",
                 "service": "FLASK",
             },
         )
-        return None
+        return config
+
+    logger.warning(
+        "No active assistant found",
+        extra={
+            "status_code": "400",
+            "status_message": "No assistant found",
+            "operation_type": "ASSISTANT",
+            "service": "FLASK",
+        },
+    )
+    return None
+
+
+def _transcribe_file(path: str, model: str) -> Tuple[Optional[str], Optional[float]]:
+    audio_seconds = os.path.getsize(path) / MP3_BYTES_PER_SECOND
+    with openai_limiter.slot("audio", requests=1, audio_seconds=audio_seconds), open(path, "rb") as audio_file_mp3:
+        # verbose_json adds the audio duration, used to report saved seconds on later cache hits.
+        transcription = client.audio.transcriptions.create(
+            model=model,
+            file=audio_file_mp3,
+            response_format="verbose_json",
+        )
+    if not transcription:
+        return None, None
+    return transcription.text, getattr(transcription, "duration", None)
+
+
+async def _transcribe_file_async(aclient: AsyncOpenAI, path: str, model: str) -> Tuple[Optional[str], Optional[float]]:
+    audio_seconds = os.path.getsize(path) / MP3_BYTES_PER_SECOND
+    async with openai_limiter.slot_async("audio", requests=1, audio_seconds=audio_seconds):
+        with open(path, "rb") as audio_file_mp3:
+            audio = (os.path.basename(path), await asyncio.to_thread(audio_file_mp3.read))
+        transcription = await aclient.audio.transcriptions.create(
+            model=model,
+            file=audio,
+            response_format="verbose_json",
+        )
+    if not transcription:
+        return None, None
+    return transcription.text, getattr(transcription, "duration", None)
+
 
+def _chunked_duration(path: str) -> Optional[float]:
+    """The recording's duration if it has to be transcribed in chunks, else None."""
+    duration = chunking.probe_duration(path) if TRANSCRIBE_CHUNKED else None
+    if duration and (duration > TRANSCRIBE_CHUNK_THRESHOLD or os.path.getsize(path) > WHISPER_MAX_UPLOAD_BYTES):
+        return duration
+    return None
 
-def transcriptions(audio_file_mp3_path: str):
+
+def _transcribe_chunk(path: str, model: str) -> Optional[str]:
+    """Chunks are cached on their own, so a call deferred mid-way does not pay again for finished chunks."""
+    digest = transcript_cache.content_hash(path)
+    cached = transcript_cache.lookup(digest, model)
+    if cached is not None:
+        return cached.text
+
+    text, duration = _transcribe_file(path, model)
+    if text is not None:
+        transcript_cache.store(digest, model, text, duration)
+    return text
+
+
+def transcriptions(audio_file_mp3_path: str, model: str = TRANSCRIPTION_MODEL):
     try:
+        digest = transcript_cache.content_hash(audio_file_mp3_path)
+        cached = transcript_cache.lookup(digest, model)
+        if cached is not None:
+            logger.info(
+                "Transcription served from cache",
+                extra={
+                    "status_code": "200",
+                    "status_message": "Transcript cache hit",
+                    "operation_type": "TRANSCRIPTION",
+                    "service": "FLASK",
+                },
+            )
+            return cached.text
+
         logger.info(
             "Starting transcription",
             extra={
@@ -153,22 +263,31 @@ def transcriptions(audio_file_mp3_path: str):
                 "service": "FLASK",
             },
         )
-        with open(audio_file_mp3_path, "rb") as audio_file_mp3:
-            transcription = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file_mp3,
+        duration = _chunked_duration(audio_file_mp3_path)
+        if duration:
+            text = chunking.transcribe_chunked(
+                audio_file_mp3_path,
+                duration,
+                lambda chunk_path: _transcribe_chunk(chunk_path, model),
+            )
+        else:
+            text, duration = _transcribe_file(audio_file_mp3_path, model)
+
+        if text is not None:
+            logger.info(
+                "Transcription completed",
+                extra={
+                    "status_code": "200",
+                    "status_message": "Transcribed",
+                    "operation_type": "TRANSCRIPTION",
+                    "service": "FLASK",
+                },
             )
-            if transcription:
-                logger.info(
-                    "Transcription completed",
-                    extra={
-                        "status_code": "200",
-                        "status_message": "Transcribed",
-                        "operation_type": "TRANSCRIPTION",
-                        "service": "FLASK",
-                    },
-                )
-                return transcription.text
+            transcript_cache.store(digest, model, text, duration)
+            return text
+    except (RateLimited, RateLimitError):
+        # Not a failure: the task is deferred until capacity frees up.
+        raise
     except FileNotFoundError as f:
         logger.error(
             f"Transcription failed: file not found - {f}",
@@ -180,6 +299,7 @@ def transcriptions(audio_file_mp3_path: str):
                 "service": "FLASK",
             },
         )
+        raise
     except IOError as o:
         logger.error(
             f"Transcription failed: IO error - {o}",
@@ -191,6 +311,7 @@ def transcriptions(audio_file_mp3_path: str):
                 "service": "FLASK",
             },
         )
+        raise
     except Exception as e:
         logger.error(
             f"Unexpected transcription error: {type(e).__name__} - {e}",
@@ -205,7 +326,33 @@ def transcriptions(audio_file_mp3_path: str):
         raise e
 
 
-def assistant_start(transcrip_text: str, crm_data_json: dict, crm_manager):
+async def transcriptions_async(aclient: AsyncOpenAI, audio_file_mp3_path: str, model: str = TRANSCRIPTION_MODEL):
+    """transcriptions() on the async client, for the asyncio worker."""
+    digest = await asyncio.to_thread(transcript_cache.content_hash, audio_file_mp3_path)
+    cached = await asyncio.to_thread(transcript_cache.lookup, digest, model)
+    if cached is not None:
+        return cached.text
+
+    if await asyncio.to_thread(_chunked_duration, audio_file_mp3_path):
+        # Splitting runs ffmpeg and sends the chunks one after another; the sync path does that in a thread.
+        return await asyncio.to_thread(transcriptions, audio_file_mp3_path, model)
+
+    text, duration = await _transcribe_file_async(aclient, audio_file_mp3_path, model)
+    if text is not None:
+        logger.info(
+            "Transcription completed",
+            extra={
+                "status_code": "200",
+                "status_message": "Transcribed",
+                "operation_type": "TRANSCRIPTION",
+                "service": "FLASK",
+            },
+        )
+        await asyncio.to_thread(transcript_cache.store, digest, model, text, duration)
+    return text
+
+
+def assistant_analyse(transcrip_text: str, crm_data_json: dict, on_saved=None) -> Optional[str]:
     logger.info(
         "Assistant start initiated",
         extra={
@@ -228,47 +375,197 @@ def assistant_start(transcrip_text: str, crm_data_json: dict, crm_manager):
                 "service": "FLASK",
             },
         )
-        return "Not found assistant."
+        return None
+
+    if assistant_check["engine"] == ENGINE_COMPLETION:
+        gpt_answer = _analyse_with_completion(assistant_check, transcrip_text)
+    else:
+        gpt_answer = _analyse_with_assistant(assistant_check, transcrip_text)
+
+    if gpt_answer is None:
+        return None
+
+    _save_analysis(transcrip_text, crm_data_json, gpt_answer, on_saved)
+    return gpt_answer
+
+
+async def assistant_analyse_async(
+    aclient: AsyncOpenAI, transcrip_text: str, crm_data_json: dict, on_saved=None
+) -> Optional[str]:
+    """assistant_analyse() on the async client, for the asyncio worker."""
+    assistant_check = await asyncio.to_thread(get_first_active_assistant)
+    if not assistant_check:
+        return None
+
+    if assistant_check["engine"] == ENGINE_COMPLETION:
+        gpt_answer = await _analyse_with_completion_async(aclient, assistant_check, transcrip_text)
+    else:
+        gpt_answer = await _analyse_with_assistant_async(aclient, assistant_check, transcrip_text)
+
+    if gpt_answer is None:
+        return None
+
+    await asyncio.to_thread(_save_analysis, transcrip_text, crm_data_json, gpt_answer, on_saved)
+    return gpt_answer
+
+
+def _save_analysis(transcrip_text: str, crm_data_json: dict, gpt_answer: str, on_saved=None) -> None:
+    logger.info(
+        "Assistant completed successfully",
+        extra={
+            "status_code": "200",
+            "status_message": "Assistant success",
+            "operation_type": "ASSISTANT",
+            "service": "FLASK",
+        },
+    )
+
+    analysed_json = {
+        "lead_id": crm_data_json["lead_id"],
+        "audio_text": transcrip_text,
+        "analysed_text": gpt_answer,
+        "is_analysed": True,
+    }
+
+    save_analyse_data_to_database(analysed_json, on_saved=on_saved)
+
 
+def _estimate_tokens(*texts: Optional[str]) -> int:
+    # About three characters per token for mixed Ukrainian/Russian/English text.
+    return sum(len(text or "") for text in texts) // 3 + COMPLETION_TOKEN_ESTIMATE
+
+
+def _analyse_with_assistant(assistant_check: dict, transcrip_text: str) -> Optional[str]:
+    instructions = assistant_check["message_promt"]
     handler = AssistanceHandlerOpenAI(
         assistant=assistant_check["assistant_id"],
-        instructions=assistant_check["message_promt"],
+        instructions=instructions,
         message=str(transcrip_text),
     )
 
-    handler.create_assistant_thread()
-    handler.create_assistant_message()
-    response = handler.create_assistant_run()
+    estimate = _estimate_tokens(instructions, transcrip_text)
+    try:
+        with openai_limiter.slot("chat", requests=1, tokens=estimate):
+            handler.create_assistant_thread()
+            handler.create_assistant_message()
+            response = handler.create_assistant_run()
+        usage = getattr(getattr(response, "current_run", None), "usage", None)
+        if usage:
+            openai_limiter.settle("chat", tokens=usage.total_tokens - estimate)
 
-    if response:
+        if not response:
+            logger.error(
+                "Assistant response is empty",
+                extra={
+                    "status_code": "500",
+                    "status_message": "No response",
+                    "operation_type": "ASSISTANT",
+                    "service": "FLASK",
+                },
+            )
+            return None
+
+        _check_run(response.current_run)
         response_message = response.get_final_messages()[0]
-        gpt_answer = response_message.content[0].text.value
+        return response_message.content[0].text.value
+    finally:
+        handler.delete_assistant_thread()
 
-        logger.info(
-            "Assistant completed successfully",
-            extra={
-                "status_code": "200",
-                "status_message": "Assistant success",
-                "operation_type": "ASSISTANT",
-                "service": "FLASK",
-            },
-        )
 
-        analysed_json = {
-            "lead_id": crm_data_json["lead_id"],
-            "audio_text": transcrip_text,
-            "analysed_text": gpt_answer,
-            "is_analysed": True,
-        }
+def _check_run(run) -> None:
+    if run is None or run.status == "completed":
+        return
+    # A failed, expired or cancelled run has no answer; fail the stage instead of posting nothing.
+    logger.error(
+        f"Assistant run {run.id} ended as {run.status}",
+        extra={
+            "status_code": "500",
+            "status_message": "Assistant run failed",
+            "operation_type": "ASSISTANT",
+            "service": "FLASK",
+        },
+    )
+    raise RuntimeError(f"Assistant run {run.id} ended as {run.status}: {run.last_error}")
+
+
+async def _analyse_with_assistant_async(
+    aclient: AsyncOpenAI, assistant_check: dict, transcrip_text: str
+) -> Optional[str]:
+    """The thread/message/run/delete flow of AssistanceHandlerOpenAI; the run is polled instead of streamed."""
+    instructions = assistant_check["message_promt"]
+    estimate = _estimate_tokens(instructions, transcrip_text)
+    assistant_thread = None
+    try:
+        async with openai_limiter.slot_async("chat", requests=1, tokens=estimate):
+            assistant_thread = await aclient.beta.threads.create()
+            await aclient.beta.threads.messages.create(
+                thread_id=assistant_thread.id,
+                role="user",
+                content=str(transcrip_text),
+            )
+            run = await aclient.beta.threads.runs.create_and_poll(
+                thread_id=assistant_thread.id,
+                assistant_id=assistant_check["assistant_id"],
+                instructions=instructions or None,
+                model="gpt-4o-mini",
+            )
+        if run.usage:
+            openai_limiter.settle("chat", tokens=run.usage.total_tokens - estimate)
+        _check_run(run)
 
-        save_analyse_data_to_database(analysed_json)
-        crm_manager.post_send_data_to_crm(
-            lead_id=crm_data_json["lead_element_id"],
-            content=str(gpt_answer),
+        messages = await aclient.beta.threads.messages.list(
+            thread_id=assistant_thread.id,
+            run_id=run.id,
+            order="desc",
+            limit=1,
         )
-    else:
+        if not messages.data:
+            logger.error(
+                "Assistant response is empty",
+                extra={
+                    "status_code": "500",
+                    "status_message": "No response",
+                    "operation_type": "ASSISTANT",
+                    "service": "FLASK",
+                },
+            )
+            return None
+        return messages.data[0].content[0].text.value
+    finally:
+        if assistant_thread:
+            await aclient.beta.threads.delete(thread_id=assistant_thread.id)
+
+
+def _completion_request(assistant_check: dict, transcrip_text: str) -> dict:
+    """Same prompt and input as the Assistants run, sent as one stateless chat completion."""
+    messages = [{"role": "user", "content": str(transcrip_text)}]
+    if assistant_check["message_promt"]:
+        messages.insert(0, {"role": "system", "content": assistant_check["message_promt"]})
+    return {"model": assistant_check["model"] or DEFAULT_ANALYSIS_MODEL, "messages": messages}
+
+
+def _analyse_with_completion(assistant_check: dict, transcrip_text: str) -> Optional[str]:
+    estimate = _estimate_tokens(assistant_check["message_promt"], transcrip_text)
+    with openai_limiter.slot("chat", requests=1, tokens=estimate):
+        completion = client.chat.completions.create(**_completion_request(assistant_check, transcrip_text))
+    return _completion_answer(completion, estimate)
+
+
+async def _analyse_with_completion_async(
+    aclient: AsyncOpenAI, assistant_check: dict, transcrip_text: str
+) -> Optional[str]:
+    estimate = _estimate_tokens(assistant_check["message_promt"], transcrip_text)
+    async with openai_limiter.slot_async("chat", requests=1, tokens=estimate):
+        completion = await aclient.chat.completions.create(**_completion_request(assistant_check, transcrip_text))
+    return _completion_answer(completion, estimate)
+
+
+def _completion_answer(completion, estimate: int) -> Optional[str]:
+    if completion.usage:
+        openai_limiter.settle("chat", tokens=completion.usage.total_tokens - estimate)
+    if not completion.choices or not completion.choices[0].message.content:
         logger.error(
-            "Assistant response is empty",
+            "Completion response is empty",
             extra={
                 "status_code": "500",
                 "status_message": "No response",
@@ -276,5 +573,5 @@ def assistant_start(transcrip_text: str, crm_data_json: dict, crm_manager):
                 "service": "FLASK",
             },
         )
-
-    handler.delete_assistant_thread()
+        return None
+    return completion.choices[0].message.content
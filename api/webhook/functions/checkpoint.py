@@ -0,0 +1,157 @@
+import logging
+from datetime import datetime
+from typing import Collection, Iterable, Optional, Set
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import CallProcessing
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("persisted", "downloaded", "transcribed", "analysed", "posted")
+
+
+def _detach(db, record: CallProcessing) -> CallProcessing:
+    db.refresh(record)
+    db.expunge(record)
+    return record
+
+
+def load_call(call_key: str) -> Optional[CallProcessing]:
+    with SessionLocal() as db:
+        record = db.query(CallProcessing).filter_by(unique_uuid=call_key).first()
+        if record:
+            db.expunge(record)
+        return record
+
+
+def start_call(call_key: str, raw_payload: Optional[bytes] = None) -> CallProcessing:
+    with SessionLocal() as db:
+        record = db.query(CallProcessing).filter_by(unique_uuid=call_key).first()
+        if not record:
+            record = CallProcessing(unique_uuid=call_key, raw_payload=raw_payload, attempts=0)
+            db.add(record)
+            try:
+                db.commit()
+            except IntegrityError:
+                # Another worker registered the same call first.
+                db.rollback()
+                record = db.query(CallProcessing).filter_by(unique_uuid=call_key).one()
+
+        record.attempts = (record.attempts or 0) + 1
+        db.commit()
+
+        logger.info(
+            f"Call {call_key} resumed at stage {first_pending_stage(record)}",
+            extra={
+                "status_code": "100",
+                "status_message": "Call checkpoint loaded",
+                "operation_type": "CHECKPOINT",
+                "service": "FLASK",
+            },
+        )
+        return _detach(db, record)
+
+
+def mark_stage(db: Session, call_key: str, stage: str, **outputs) -> CallProcessing:
+    """Record a finished stage inside the caller's transaction."""
+    return mark_stages(db, call_key, (stage,), **outputs)
+
+
+def mark_stages(db: Session, call_key: str, stages: Iterable[str], **outputs) -> CallProcessing:
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise ValueError(f"Unknown stage: {', '.join(sorted(unknown))}")
+
+    record = db.query(CallProcessing).filter_by(unique_uuid=call_key).one()
+    for key, value in outputs.items():
+        setattr(record, key, value)
+    finished_at = datetime.utcnow()
+    for stage in stages:
+        setattr(record, f"{stage}_at", finished_at)
+    record.last_error = None
+    return record
+
+
+def complete_stage(call_key: str, stage: str, **outputs) -> CallProcessing:
+    with SessionLocal() as db:
+        record = mark_stage(db, call_key, stage, **outputs)
+        db.commit()
+
+        logger.info(
+            f"Call {call_key} stage {stage} completed",
+            extra={
+                "status_code": "200",
+                "status_message": "Stage checkpointed",
+                "operation_type": "CHECKPOINT",
+                "service": "FLASK",
+            },
+        )
+        return _detach(db, record)
+
+
+def complete_stage_for_calls(call_keys: Collection[str], stage: str) -> None:
+    """Checkpoint ``stage`` for many calls in one statement; unknown keys are ignored."""
+    if stage not in STAGES:
+        raise ValueError(f"Unknown stage: {stage}")
+    if not call_keys:
+        return
+    with SessionLocal() as db:
+        db.query(CallProcessing).filter(CallProcessing.unique_uuid.in_(list(call_keys))).update(
+            {f"{stage}_at": datetime.utcnow(), "last_error": None},
+            synchronize_session=False,
+        )
+        db.commit()
+
+
+def calls_done(call_keys: Collection[str], stage: str) -> Set[str]:
+    if not call_keys:
+        return set()
+    with SessionLocal() as db:
+        rows = db.query(CallProcessing.unique_uuid).filter(
+            CallProcessing.unique_uuid.in_(list(call_keys)),
+            getattr(CallProcessing, f"{stage}_at").isnot(None),
+        )
+        return {row.unique_uuid for row in rows}
+
+
+def reset_stage(call_key: str, stage: str) -> None:
+    with SessionLocal() as db:
+        record = db.query(CallProcessing).filter_by(unique_uuid=call_key).one()
+        setattr(record, f"{stage}_at", None)
+        db.commit()
+
+
+def record_failure(call_key: Optional[str], stage: str, error: BaseException) -> None:
+    if not call_key:
+        return
+    try:
+        with SessionLocal() as db:
+            db.query(CallProcessing).filter_by(unique_uuid=call_key).update(
+                {"last_error": f"{stage}: {type(error).__name__}: {error}"}
+            )
+            db.commit()
+    except Exception:
+        logger.warning(
+            f"Could not record failure for call {call_key}",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Checkpoint write error",
+                "operation_type": "CHECKPOINT",
+                "service": "FLASK",
+            },
+        )
+
+
+def is_done(record: CallProcessing, stage: str) -> bool:
+    return getattr(record, f"{stage}_at") is not None
+
+
+def first_pending_stage(record: CallProcessing) -> Optional[str]:
+    for stage in STAGES:
+        if not is_done(record, stage):
+            return stage
+    return None
@@ -0,0 +1,218 @@
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List
+
+import requests
+
+from api.webhook.functions.checkpoint import calls_done, complete_stage_for_calls, record_failure
+from api.webhook.functions.source import ApiCRMManager
+from metrics import metrics
+from redis_config import redis_client
+from resilience import breakers, is_transient
+
+logger = logging.getLogger(__name__)
+
+CRM_NOTES_BATCH_SIZE = int(os.getenv("CRM_NOTES_BATCH_SIZE", 50))
+# A note waits at most this long for its batch to fill up.
+CRM_NOTES_MAX_AGE = float(os.getenv("CRM_NOTES_MAX_AGE", 15))
+CRM_NOTES_FLUSH_INTERVAL = float(os.getenv("CRM_NOTES_FLUSH_INTERVAL", 5))
+# Extended before every page of a recovery lookup, so it only has to cover one CRM request.
+CRM_FLUSH_LOCK_SECONDS = 120
+
+ACCOUNTS_KEY = "crm:outbox:accounts"
+
+# Moves up to ARGV[1] of the oldest queued notes into the in-flight hash.
+# KEYS: notes hash, queue sorted set, in-flight hash. Returns the moved key/payload pairs.
+_CLAIM_SCRIPT = """
+local claimed = {}
+for _, key in ipairs(redis.call('ZRANGE', KEYS[2], 0, tonumber(ARGV[1]) - 1)) do
+    local payload = redis.call('HGET', KEYS[1], key)
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('HDEL', KEYS[1], key)
+    if payload and redis.call('HSETNX', KEYS[3], key, payload) == 1 then
+        table.insert(claimed, key)
+        table.insert(claimed, payload)
+    end
+end
+return claimed
+"""
+
+# Resets the flush lock's TTL (ARGV[2]) or deletes it (ARGV[2] = 0), only while it still holds our token.
+_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) > 0 then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return redis.call('DEL', KEYS[1])
+"""
+
+_claim = redis_client.register_script(_CLAIM_SCRIPT)
+_lock = redis_client.register_script(_LOCK_SCRIPT)
+
+
+class FlushLockLost(RuntimeError):
+    pass
+
+
+def _keys(url_domain: str) -> Dict[str, str]:
+    prefix = f"crm:outbox:{url_domain}"
+    return {
+        "notes": f"{prefix}:notes",
+        "queue": f"{prefix}:queue",
+        "inflight": f"{prefix}:inflight",
+        "lock": f"{prefix}:lock",
+    }
+
+
+def enqueue(url_domain: str, key: str, lead_id, text: str) -> int:
+    """Queue a note for the lead under an idempotency ``key``; returns the account's queue length.
+
+    Queuing the same key again replaces the text but keeps its place in the queue.
+    """
+    keys = _keys(url_domain)
+    pipe = redis_client.pipeline()
+    pipe.hset(keys["notes"], key, json.dumps({"lead_id": lead_id, "text": text, "queued_at": int(time.time())}))
+    pipe.zadd(keys["queue"], {key: time.time()}, nx=True)
+    pipe.sadd(ACCOUNTS_KEY, url_domain)
+    pipe.zcard(keys["queue"])
+    size = pipe.execute()[-1]
+    metrics.set_gauge("crm_outbox_pending", size, shared=True, account=url_domain)
+    return size
+
+
+def _decode(notes: Dict) -> Dict[str, dict]:
+    return {(key.decode() if isinstance(key, bytes) else key): json.loads(payload) for key, payload in notes.items()}
+
+
+def _already_in_crm(crm: ApiCRMManager, batch: Dict[str, dict], on_page=None) -> List[str]:
+    """Keys whose note already exists on the lead, i.e. a previous flush got through before it crashed.
+
+    A note from that flush cannot be older than the oldest queued item, so only notes updated
+    since then are paged through.
+    """
+    queued_at = [item["queued_at"] for item in batch.values() if "queued_at" in item]
+    existing = {
+        (str(note.get("entity_id")), (note.get("params") or {}).get("text"))
+        for note in crm.lead_notes(
+            {item["lead_id"] for item in batch.values()},
+            # Items queued before queued_at was recorded fall back to every note of the lead.
+            updated_from=min(queued_at) if len(queued_at) == len(batch) else None,
+            on_page=on_page,
+        )
+    }
+    return [key for key, item in batch.items() if (str(item["lead_id"]), item["text"]) in existing]
+
+
+def flush(url_domain: str) -> int:
+    """Send one batch of the account's queued notes; returns how many queued notes it settled.
+
+    That is the notes posted plus those a recovered batch found already in the CRM, so 0 means
+    there was nothing to do or another worker holds the account's flush lock.
+
+    Delivery is at least once: a claimed batch stays in the in-flight hash until the calls are
+    checkpointed as posted. A batch found there on the next flush is first checked against
+    the lead's notes in the CRM, so a crash between the request and the checkpoint does not
+    post the same note twice.
+    """
+    keys = _keys(url_domain)
+    token = uuid.uuid4().hex
+    if not redis_client.set(keys["lock"], token, nx=True, ex=CRM_FLUSH_LOCK_SECONDS):
+        return 0
+
+    def extend_lock(page: int) -> None:
+        # Without the lock another flusher may already have claimed this in-flight batch.
+        if not _lock(keys=[keys["lock"]], args=[token, CRM_FLUSH_LOCK_SECONDS]):
+            raise FlushLockLost(f"Flush lock for {url_domain} expired while reading notes page {page}")
+
+    try:
+        batch = _decode(redis_client.hgetall(keys["inflight"]))
+        recovered = bool(batch)
+        if not batch:
+            claimed = _claim(keys=[keys["notes"], keys["queue"], keys["inflight"]], args=[CRM_NOTES_BATCH_SIZE])
+            batch = _decode(dict(zip(claimed[::2], claimed[1::2])))
+        if not batch:
+            return 0
+
+        crm = ApiCRMManager(url_domain, access_token=os.getenv("ACCESS_TOKEN"))
+        done = calls_done(batch.keys(), "posted")
+        pending = {key: item for key, item in batch.items() if key not in done}
+        try:
+            with breakers["crm"].guard():
+                if recovered and pending:
+                    done.update(_already_in_crm(crm, pending, on_page=extend_lock))
+                    pending = {key: item for key, item in pending.items() if key not in done}
+                if pending:
+                    extend_lock(0)
+                    crm.add_notes([
+                        {
+                            "entity_id": int(item["lead_id"]),
+                            "note_type": "common",
+                            "params": {"text": item["text"]},
+                            "request_id": key,
+                        }
+                        for key, item in pending.items()
+                    ])
+        except FlushLockLost:
+            logger.warning(
+                f"Gave up flushing notes to {url_domain}: lock lost",
+                exc_info=True,
+                extra={
+                    "status_code": "409",
+                    "status_message": "CRM flush lock lost",
+                    "operation_type": "CRM",
+                    "service": "FLASK",
+                },
+            )
+            return 0
+        except requests.HTTPError as e:
+            if is_transient(e):
+                raise
+            # The CRM rejected the batch itself; retrying it would fail the same way.
+            # Notes that were already in the CRM are posted all the same.
+            complete_stage_for_calls(list(done), "posted")
+            for key in pending:
+                record_failure(key, "posted", e)
+            redis_client.delete(keys["inflight"])
+            metrics.incr("crm_outbox_dropped_total", len(pending), account=url_domain)
+            raise
+
+        complete_stage_for_calls(list(batch), "posted")
+        redis_client.delete(keys["inflight"])
+        metrics.incr("crm_outbox_posted_total", len(pending), account=url_domain)
+        metrics.set_gauge("crm_outbox_pending", redis_client.zcard(keys["queue"]), shared=True, account=url_domain)
+        logger.info(
+            f"Posted {len(pending)} notes to {url_domain}",
+            extra={
+                "status_code": "200",
+                "status_message": "CRM notes flushed",
+                "operation_type": "CRM",
+                "service": "FLASK",
+            },
+        )
+        return len(batch)
+    finally:
+        _lock(keys=[keys["lock"]], args=[token, 0])
+
+
+def is_due(url_domain: str) -> bool:
+    keys = _keys(url_domain)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.exists(keys["inflight"])
+    pipe.zcard(keys["queue"])
+    pipe.zrange(keys["queue"], 0, 0, withscores=True)
+    inflight, size, oldest = pipe.execute()
+    if inflight or size >= CRM_NOTES_BATCH_SIZE:
+        return True
+    return bool(oldest) and oldest[0][1] <= time.time() - CRM_NOTES_MAX_AGE
+
+
+def accounts() -> List[str]:
+    return [
+        account.decode() if isinstance(account, bytes) else account
+        for account in redis_client.smembers(ACCOUNTS_KEY)
+    ]
@@ -1,13 +1,41 @@
 import logging
+from typing import Callable, Optional
 
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
+from api.webhook.functions.dataclasses import TableMap
+from api.webhook.functions.lookups import integration_ids, manager_ids
+from local_cache import MISSING
 from models import Integrations, Manager, Leads, Phonet, PhonetLeads, Analyzes
 from database import SessionLocal
 
 logger = logging.getLogger(__name__)
 
 
-def save_to_database(data: dict) -> dict:
+def _upsert_integration(db: Session, data) -> int:
+    stmt = insert(Integrations).values(subdomain=data.subdomain, link=data.link)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Integrations.subdomain],
+        set_={"subdomain": stmt.excluded.subdomain},
+    ).returning(Integrations.id)
+    return db.execute(stmt).scalar_one()
+
+
+def _upsert_manager(db: Session, data) -> int:
+    stmt = insert(Manager).values(
+        crm_user_id=data.crm_user_id,
+        username=data.username,
+        type=data.type,
+    )
+    # Existing managers keep their username and is_permissions, as before.
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Manager.crm_user_id],
+        set_={"crm_user_id": stmt.excluded.crm_user_id},
+    ).returning(Manager.id)
+    return db.execute(stmt).scalar_one()
+
+
+def save_to_database(data: TableMap, on_saved: Optional[Callable[[Session, dict], None]] = None) -> dict:
     logger.info(
         "Start saving incoming data to database",
         extra={
@@ -19,29 +47,21 @@ def save_to_database(data: dict) -> dict:
     )
 
     try:
-        with SessionLocal() as db:
-            integration_data = data.get("Integrations")
-            integration = None
-
-            if integration_data:
-                integration = db.query(Integrations).filter_by(subdomain=integration_data["subdomain"]).first()
-                if not integration:
-                    integration = Integrations(**integration_data)
-                    db.add(integration)
-                    db.commit()
-
-            manager_data = data.get("Manager")
-            manager = None
-            if manager_data:
-                manager = db.query(Manager).filter_by(crm_user_id=manager_data["crm_user_id"]).first()
-                if not manager:
-                    manager = Manager(**manager_data)
-                    db.add(manager)
-                    db.commit()
-
-            leads_data = data.get("Leads")
+        integration_id = integration_ids.get(data.integrations.subdomain) if data.integrations else None
+        manager_id = manager_ids.get(data.manager.crm_user_id) if data.manager else None
+
+        with SessionLocal() as db, db.begin():
+            # Known subdomains and managers come from the per-worker cache; only
+            # unseen ones need the upsert round trip.
+            if integration_id is MISSING:
+                integration_id = _upsert_integration(db, data.integrations)
+            if manager_id is MISSING:
+                manager_id = _upsert_manager(db, data.manager)
+
+            leads_data = data.leads
+            leads = None
             if leads_data:
-                if not manager:
+                if manager_id is None:
                     logger.error(
                         "Missing manager while saving lead",
                         extra={
@@ -53,7 +73,7 @@ def save_to_database(data: dict) -> dict:
                     )
                     raise ValueError("Manager is required but not found")
 
-                if not integration:
+                if integration_id is None:
                     logger.error(
                         "Missing integration while saving lead",
                         extra={
@@ -65,59 +85,84 @@ def save_to_database(data: dict) -> dict:
                     )
                     raise ValueError("Integration is required but not found")
 
-                leads_data["manager_id"] = manager.id
-                leads_data["integration_id"] = integration.id
-                leads = Leads(**leads_data)
+                leads = Leads(
+                    owner_id=leads_data.owner_id,
+                    account_id=leads_data.account_id,
+                    element_id=leads_data.element_id,
+                    element_type=leads_data.element_type,
+                    manager_id=manager_id,
+                    integration_id=integration_id,
+                    text_message=leads_data.text_message,
+                    timestamp_x=leads_data.timestamp_x,
+                    created_at=leads_data.created_at,
+                    updated_at=leads_data.updated_at,
+                    lead_status=leads_data.lead_status,
+                )
                 db.add(leads)
-                db.commit()
-            else:
-                leads = None
 
-            phonet_data = data.get("Phonet")
+            phonet_data = data.phonet
+            phonet = None
             if phonet_data:
-                phonet = Phonet(**phonet_data)
+                phonet = Phonet(
+                    unique_uuid=phonet_data.unique_uuid,
+                    audio_mp3=phonet_data.audio_mp3,
+                    phone_number=phonet_data.phone_number,
+                    duration=phonet_data.duration,
+                    call_status=phonet_data.call_status,
+                    call_result=phonet_data.call_result,
+                )
                 db.add(phonet)
-                db.commit()
-
-                phonet_leads_data = data.get("PhonetLeads")
-                if phonet_leads_data:
-                    if not leads:
-                        logger.error(
-                            "Missing lead while saving PhonetLeads",
-                            extra={
-                                "status_code": "400",
-                                "status_message": "Leads missing",
-                                "operation_type": "WEBHOOK",
-                                "service": "FLASK",
-                            },
-                        )
-                        raise ValueError("Leads is required but not found")
-
-                    phonet_leads_data["phonet_id"] = phonet.id
-                    phonet_leads_data["leads_id"] = leads.id
-                    phonet_leads = PhonetLeads(**phonet_leads_data)
-                    db.add(phonet_leads)
-                    db.commit()
-            else:
-                phonet = None
-
-            logger.info(
-                "Data saved to database successfully",
-                extra={
-                    "status_code": "200",
-                    "status_message": "DB save complete",
-                    "operation_type": "WEBHOOK",
-                    "service": "FLASK",
-                },
-            )
-
-            return {
-                "manager_id": manager.id if manager else None,
+
+            # One flush assigns the lead and phonet ids without committing.
+            db.flush()
+
+            phonet_leads_data = data.phonet_leads
+            if phonet and phonet_leads_data:
+                if not leads:
+                    logger.error(
+                        "Missing lead while saving PhonetLeads",
+                        extra={
+                            "status_code": "400",
+                            "status_message": "Leads missing",
+                            "operation_type": "WEBHOOK",
+                            "service": "FLASK",
+                        },
+                    )
+                    raise ValueError("Leads is required but not found")
+
+                db.add(PhonetLeads(
+                    phonet_id=phonet.id,
+                    leads_id=leads.id,
+                    last_update=phonet_leads_data.last_update,
+                ))
+
+            saved = {
+                "manager_id": manager_id,
                 "lead_id": leads.id if leads else None,
                 "lead_element_id": leads.element_id if leads else None,
                 "phonet_id": phonet.id if phonet else None,
             }
 
+            if on_saved:
+                on_saved(db, saved)
+
+        # Cache only after commit, so a rolled back insert never leaks an id.
+        if integration_id is not None:
+            integration_ids.set(data.integrations.subdomain, integration_id)
+        if manager_id is not None:
+            manager_ids.set(data.manager.crm_user_id, manager_id)
+
+        logger.info(
+            "Data saved to database successfully",
+            extra={
+                "status_code": "200",
+                "status_message": "DB save complete",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        return saved
+
     except Exception as e:
         logger.error(
             "Exception during saving to database",
@@ -132,7 +177,7 @@ def save_to_database(data: dict) -> dict:
         raise
 
 
-def save_analyse_data_to_database(data: dict) -> None:
+def save_analyse_data_to_database(data: dict, on_saved: Optional[Callable[[Session, Analyzes], None]] = None) -> None:
     logger.info(
         "Start saving analysis data",
         extra={
@@ -154,6 +199,11 @@ def save_analyse_data_to_database(data: dict) -> None:
         with SessionLocal() as db:
             analysed_data = Analyzes(**analyse_data)
             db.add(analysed_data)
+            db.flush()
+
+            if on_saved:
+                on_saved(db, analysed_data)
+
             db.commit()
 
         logger.info(
@@ -180,5 +230,11 @@ def save_analyse_data_to_database(data: dict) -> None:
         raise
 
 
+def update_lead_status(lead_id: int, lead_status: str) -> None:
+    with SessionLocal() as db:
+        db.query(Leads).filter_by(id=lead_id).update({"lead_status": lead_status}, synchronize_session=False)
+        db.commit()
+
+
 def get_created_lead_id():
     pass
@@ -1,40 +1,48 @@
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+from typing import Any, Optional
 from uuid import UUID
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Integrations:
     subdomain: Optional[str] = None
     link: Optional[str] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Manager:
     crm_user_id: Optional[int] = None
     username: Optional[str] = None
-    type: Optional[str] = None
+    type: Optional[Any] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Leads:
     owner_id: Optional[int] = None
     account_id: Optional[int] = None
     element_id: Optional[int] = None
     element_type: Optional[int] = None
     text_message: Optional[str] = None
-    timestamp_x: Optional[datetime] = None
+    timestamp_x: Optional[Any] = None
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     lead_status: Optional[str] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class PhonetLeads:
     last_update: Optional[datetime] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Phonet:
     unique_uuid: Optional[UUID] = None
     audio_mp3: Optional[str] = None
     phone_number: Optional[str] = None
     duration: Optional[int] = None
     call_status: Optional[int] = None
-    call_result: Optional[int] = None
+    call_result: Optional[Any] = None
+
+@dataclass(frozen=True, slots=True)
+class TableMap:
+    integrations: Optional[Integrations] = None
+    manager: Optional[Manager] = None
+    leads: Optional[Leads] = None
+    phonet_leads: Optional[PhonetLeads] = None
+    phonet: Optional[Phonet] = None
@@ -0,0 +1,126 @@
+import json
+import re
+from dataclasses import dataclass
+from typing import Any, Optional, Union
+from urllib.parse import unquote_plus
+
+_SHORT_KEY_PATTERN = re.compile(r"\[([^\[\]]*)\]$")
+_ESCAPES_PATTERN = re.compile(r'\\n"|\\')
+
+# Only the fields read by HookDecoder.integration_data() and table_map().
+_WANTED_KEYS = frozenset({
+    "text",
+    "element_id",
+    "element_type",
+    "main_user_id",
+    "timestamp_x",
+    "created_at",
+    "updated_at",
+    "metadata",
+    "subdomain",
+    "self",
+})
+
+
+@dataclass(frozen=True, slots=True)
+class CallPayload:
+    uniq: Optional[str] = None
+    link: Optional[str] = None
+    phone: Optional[str] = None
+    duration: Optional[int] = None
+    call_status: Optional[int] = None
+    call_result: Optional[Any] = None
+
+
+@dataclass(frozen=True, slots=True)
+class WebhookEvent:
+    element_id: Optional[int] = None
+    element_type: Optional[int] = None
+    main_user_id: Optional[int] = None
+    timestamp_x: Optional[Any] = None
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
+    subdomain: Optional[str] = None
+    account_link: Optional[str] = None
+    author_id: Optional[int] = None
+    author_name: Optional[str] = None
+    author_type: Optional[Any] = None
+    text: Optional[str] = None
+    call: Optional[CallPayload] = None
+
+    @property
+    def is_phonet(self) -> bool:
+        return self.call is not None
+
+
+def _scalar(value: str) -> Any:
+    if value.isdigit():
+        return int(value)
+    if value[:1] in "{[":
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            pass
+    return _ESCAPES_PATTERN.sub("", value)
+
+
+def _short_key(key: str) -> Optional[str]:
+    # Keys arrive as "leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Btext%5D"; slicing the
+    # last bracket off the encoded form avoids unquoting every key.
+    if key.endswith(("%5D", "%5d")):
+        start = max(key.rfind("%5B"), key.rfind("%5b"))
+        return key[start + 3:-3] if start >= 0 else None
+    match = _SHORT_KEY_PATTERN.search(key)
+    return match.group(1) if match else None
+
+
+def decode_webhook(raw_data: Union[bytes, str]) -> WebhookEvent:
+    """Decode an amoCRM form-encoded webhook body into a WebhookEvent in one pass."""
+    if isinstance(raw_data, bytes):
+        raw_data = raw_data.decode("latin-1")
+
+    fields = {}
+    for pair in raw_data.split("&"):
+        key, _, value = pair.partition("=")
+        if not value:
+            continue
+        short_key = _short_key(key)
+        if short_key in _WANTED_KEYS:
+            if "%" in value or "+" in value:
+                value = unquote_plus(value)
+            fields[short_key] = _scalar(value)
+
+    text = fields.get("text")
+    call = None
+    if isinstance(text, dict):
+        phone = text.get("PHONE")
+        call = CallPayload(
+            uniq=text.get("UNIQ"),
+            link=text.get("LINK"),
+            phone=phone.strip() if isinstance(phone, str) else phone,
+            duration=text.get("DURATION"),
+            call_status=text.get("call_status"),
+            call_result=text.get("call_result"),
+        )
+        text = None
+    elif text is not None and not isinstance(text, str):
+        text = str(text)
+
+    metadata = fields.get("metadata")
+    event_source = metadata.get("event_source", {}) if isinstance(metadata, dict) else {}
+
+    return WebhookEvent(
+        element_id=fields.get("element_id"),
+        element_type=fields.get("element_type"),
+        main_user_id=fields.get("main_user_id"),
+        timestamp_x=fields.get("timestamp_x"),
+        created_at=fields.get("created_at"),
+        updated_at=fields.get("updated_at"),
+        subdomain=fields.get("subdomain"),
+        account_link=fields.get("self"),
+        author_id=event_source.get("id"),
+        author_name=event_source.get("author_name"),
+        author_type=event_source.get("type"),
+        text=text,
+        call=call,
+    )
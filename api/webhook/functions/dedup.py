@@ -0,0 +1,59 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from api.webhook.functions.ingress import call_identity
+from redis_config import redis_client
+
+DEDUP_TTL_SECONDS = int(os.getenv("WEBHOOK_DEDUP_TTL", 180))
+DEDUP_LOCAL_SIZE = int(os.getenv("WEBHOOK_DEDUP_LOCAL_SIZE", 1024))
+
+
+def dedup_key(raw_data: bytes, identity: Optional[str] = None) -> str:
+    identity = identity or call_identity(raw_data)
+    if identity:
+        return f"webhook:call:{identity}"
+    return f"webhook:body:{hashlib.sha256(raw_data).hexdigest()}"
+
+
+class WebhookDeduplicator:
+    def __init__(self, ttl: int = DEDUP_TTL_SECONDS, local_size: int = DEDUP_LOCAL_SIZE) -> None:
+        self.__ttl = ttl
+        self.__local_size = local_size
+        self.__seen: "OrderedDict[str, float]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __seen_locally(self, key: str) -> bool:
+        with self.__lock:
+            expires_at = self.__seen.get(key)
+            if expires_at is None:
+                return False
+            if expires_at < time.monotonic():
+                del self.__seen[key]
+                return False
+            self.__seen.move_to_end(key)
+            return True
+
+    def __remember(self, key: str) -> None:
+        with self.__lock:
+            self.__seen[key] = time.monotonic() + self.__ttl
+            self.__seen.move_to_end(key)
+            while len(self.__seen) > self.__local_size:
+                self.__seen.popitem(last=False)
+
+    def claim(self, raw_data: bytes, identity: Optional[str] = None) -> bool:
+        """Return True for the first delivery of a webhook, False for a duplicate."""
+        key = dedup_key(raw_data, identity)
+        if self.__seen_locally(key):
+            return False
+
+        # SET NX is the check and the claim in one round trip.
+        claimed = bool(redis_client.set(key, 1, nx=True, ex=self.__ttl))
+        self.__remember(key)
+        return claimed
+
+
+webhook_dedup = WebhookDeduplicator()
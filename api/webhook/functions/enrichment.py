@@ -0,0 +1,24 @@
+import os
+
+from api.webhook.functions.source import ApiCRMManager
+from metrics import metrics
+from redis_config import redis_client
+
+UNKNOWN_STATUS = "Unknown"
+# Calls on the same lead often arrive minutes apart; they share one CRM lookup.
+LEAD_STATUS_CACHE_TTL = int(os.getenv("LEAD_STATUS_CACHE_TTL", 300))
+
+
+def lead_status(url_domain: str, lead_id) -> str:
+    """Name of the lead's current status, from Redis when another call looked it up recently."""
+    key = f"crm:lead_status:{url_domain}:{lead_id}"
+    cached = redis_client.get(key)
+    if cached is not None:
+        metrics.incr("lead_status_cache_total", result="hit")
+        return cached.decode() if isinstance(cached, bytes) else cached
+
+    metrics.incr("lead_status_cache_total", result="miss")
+    crm_manager = ApiCRMManager(url_domain, access_token=os.getenv("ACCESS_TOKEN"))
+    status = crm_manager.status_info(lead_id).get("name") or UNKNOWN_STATUS
+    redis_client.set(key, status, ex=LEAD_STATUS_CACHE_TTL)
+    return status
@@ -0,0 +1,80 @@
+import os
+from typing import Any, FrozenSet, NamedTuple, Optional
+
+from api.webhook.functions.decoder import CallPayload
+from database import SessionLocal
+from local_cache import MISSING, publish_invalidation, register_cache
+from models import GatingPolicy
+
+ANALYSE = "analyse"
+TRANSCRIBE_ONLY = "transcribe"
+METADATA_ONLY = "metadata"
+
+# Pipeline stages a decision skips; they are checkpointed as done when the call is persisted.
+SKIPPED_STAGES = {
+    ANALYSE: (),
+    TRANSCRIBE_ONLY: ("analysed", "posted"),
+    METADATA_ONLY: ("downloaded", "transcribed", "analysed", "posted"),
+}
+
+GATING_POLICY = "gating_policy"
+GATING_CACHE_TTL = float(os.getenv("GATING_CACHE_TTL", 60))
+
+gating_policy_cache = register_cache(GATING_POLICY, GATING_CACHE_TTL, maxsize=1)
+
+
+class GatingRules(NamedTuple):
+    min_transcribe_seconds: int = 0
+    min_analyse_seconds: int = 0
+    metadata_only_statuses: FrozenSet[str] = frozenset()
+    metadata_only_results: FrozenSet[str] = frozenset()
+    transcribe_only_statuses: FrozenSet[str] = frozenset()
+
+
+def _codes(value: Optional[str]) -> FrozenSet[str]:
+    return frozenset(code.strip().lower() for code in (value or "").split(",") if code.strip())
+
+
+def _normalise(value: Any) -> str:
+    return str(value).strip().lower() if value is not None else ""
+
+
+def active_rules() -> Optional[GatingRules]:
+    rules = gating_policy_cache.get(GATING_POLICY)
+    if rules is not MISSING:
+        return rules
+
+    with SessionLocal() as db:
+        policy = db.query(GatingPolicy).filter_by(is_active=True).order_by(GatingPolicy.id).first()
+        rules = None if policy is None else GatingRules(
+            min_transcribe_seconds=policy.min_transcribe_seconds or 0,
+            min_analyse_seconds=policy.min_analyse_seconds or 0,
+            metadata_only_statuses=_codes(policy.metadata_only_statuses),
+            metadata_only_results=_codes(policy.metadata_only_results),
+            transcribe_only_statuses=_codes(policy.transcribe_only_statuses),
+        )
+    gating_policy_cache.set(GATING_POLICY, rules)
+    return rules
+
+
+def decide(call: Optional[CallPayload], rules: Optional[GatingRules]) -> str:
+    if call is None or not call.link:
+        return METADATA_ONLY
+    if rules is None:
+        return ANALYSE
+
+    duration = call.duration or 0
+    status = _normalise(call.call_status)
+    if (
+        status in rules.metadata_only_statuses
+        or _normalise(call.call_result) in rules.metadata_only_results
+        or duration < rules.min_transcribe_seconds
+    ):
+        return METADATA_ONLY
+    if status in rules.transcribe_only_statuses or duration < rules.min_analyse_seconds:
+        return TRANSCRIBE_ONLY
+    return ANALYSE
+
+
+def invalidate_gating_policy() -> None:
+    publish_invalidation(GATING_POLICY)
@@ -0,0 +1,39 @@
+import re
+from typing import NamedTuple, Optional
+from urllib.parse import unquote_to_bytes
+
+ROUTE_CALL = "call"
+ROUTE_IGNORED = "ignored"
+ROUTE_DUPLICATE = "duplicate"
+
+_UNIQ_PATTERN = re.compile(rb'UNIQ\\*"[\s+]*:[\s+]*\\*"([^"\\]+)')
+_ELEMENT_ID_PATTERN = re.compile(rb'\[element_id\]=(\d+)')
+
+
+class IngressDecision(NamedTuple):
+    route: str
+    identity: Optional[str] = None
+
+
+def call_identity(raw_data: bytes) -> Optional[str]:
+    decoded = unquote_to_bytes(raw_data)
+    uniq = _UNIQ_PATTERN.search(decoded)
+    if not uniq:
+        return None
+    element_id = _ELEMENT_ID_PATTERN.search(decoded)
+    return "{}:{}".format(
+        uniq.group(1).decode(errors="replace"),
+        element_id.group(1).decode() if element_id else "",
+    )
+
+
+def classify_webhook(raw_data: bytes) -> IngressDecision:
+    # Phonet call notes always carry the UNIQ key; plain text notes and
+    # other CRM events are rejected by this substring test without decoding.
+    if b"UNIQ" not in raw_data:
+        return IngressDecision(ROUTE_IGNORED)
+
+    identity = call_identity(raw_data)
+    if identity is None:
+        return IngressDecision(ROUTE_IGNORED)
+    return IngressDecision(ROUTE_CALL, identity)
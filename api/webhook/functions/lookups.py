@@ -0,0 +1,29 @@
+import os
+
+from local_cache import publish_invalidation, register_cache
+
+LOOKUP_CACHE_TTL = float(os.getenv("LOOKUP_CACHE_TTL", 30))
+
+INTEGRATION_IDS = "integration_ids"
+MANAGER_IDS = "manager_ids"
+MANAGER_PERMISSIONS = "manager_permissions"
+ASSISTANT_CONFIG = "assistant_config"
+
+integration_ids = register_cache(INTEGRATION_IDS, LOOKUP_CACHE_TTL)
+manager_ids = register_cache(MANAGER_IDS, LOOKUP_CACHE_TTL)
+manager_permissions = register_cache(MANAGER_PERMISSIONS, LOOKUP_CACHE_TTL)
+# Only changes through the admin, which publishes an invalidation, so it can live longer.
+assistant_config = register_cache(ASSISTANT_CONFIG, float(os.getenv("ASSISTANT_CACHE_TTL", 300)), maxsize=1)
+
+
+def invalidate_integrations() -> None:
+    publish_invalidation(INTEGRATION_IDS)
+
+
+def invalidate_managers() -> None:
+    publish_invalidation(MANAGER_IDS)
+    publish_invalidation(MANAGER_PERMISSIONS)
+
+
+def invalidate_assistant_config() -> None:
+    publish_invalidation(ASSISTANT_CONFIG)
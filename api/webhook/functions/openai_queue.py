@@ -0,0 +1,76 @@
+import os
+import time
+from typing import List
+
+from redis_config import redis_client
+
+# With OPENAI_ASYNC on, the transcribe and analyze tasks hand calls to the asyncio worker
+# (flask openai-worker) through this queue instead of calling OpenAI themselves.
+OPENAI_ASYNC = os.getenv("OPENAI_ASYNC", "false").lower() == "true"
+# A claimed call goes back to the queue if its worker has not acked it by then, e.g. after a crash.
+OPENAI_ASYNC_LEASE_SECONDS = int(os.getenv("OPENAI_ASYNC_LEASE_SECONDS", 900))
+
+QUEUE_KEY = "openai:async:queue"
+LEASES_KEY = "openai:async:leases"
+RETRIES_KEY = "openai:async:retries"
+
+# KEYS: queue and leases sorted sets, both scored by time. ARGV: call key, due time.
+# A call already claimed is left alone; its worker resumes the chain when it is done.
+_SUBMIT_SCRIPT = """
+if redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return 0
+end
+return redis.call('ZADD', KEYS[1], 'NX', ARGV[2], ARGV[1])
+"""
+
+# Returns expired leases to the queue, then moves up to ARGV[2] due calls into the leases.
+# KEYS: queue, leases. ARGV: now, count, lease seconds.
+_CLAIM_SCRIPT = """
+local now = tonumber(ARGV[1])
+for _, key in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], key)
+    redis.call('ZADD', KEYS[1], 'NX', now, key)
+end
+local claimed = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, tonumber(ARGV[2]))
+for _, key in ipairs(claimed) do
+    redis.call('ZREM', KEYS[1], key)
+    redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), key)
+end
+return claimed
+"""
+
+_submit = redis_client.register_script(_SUBMIT_SCRIPT)
+_claim = redis_client.register_script(_CLAIM_SCRIPT)
+
+
+def submit(call_key: str) -> None:
+    _submit(keys=[QUEUE_KEY, LEASES_KEY], args=[call_key, time.time()])
+
+
+def claim(count: int) -> List[str]:
+    claimed = _claim(keys=[QUEUE_KEY, LEASES_KEY], args=[time.time(), count, OPENAI_ASYNC_LEASE_SECONDS])
+    return [key.decode() if isinstance(key, bytes) else key for key in claimed]
+
+
+def ack(call_key: str) -> None:
+    pipe = redis_client.pipeline()
+    pipe.zrem(LEASES_KEY, call_key)
+    pipe.hdel(RETRIES_KEY, call_key)
+    pipe.execute()
+
+
+def requeue(call_key: str, delay: float) -> None:
+    """Give a claimed call back to the queue, due in ``delay`` seconds."""
+    pipe = redis_client.pipeline()
+    pipe.zrem(LEASES_KEY, call_key)
+    pipe.zadd(QUEUE_KEY, {call_key: time.time() + delay})
+    pipe.execute()
+
+
+def count_retry(call_key: str) -> int:
+    """Retries of the call so far, this one included."""
+    return redis_client.hincrby(RETRIES_KEY, call_key, 1)
+
+
+def pending() -> int:
+    return redis_client.zcard(QUEUE_KEY)
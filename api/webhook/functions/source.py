@@ -1,19 +1,44 @@
-import json
 import logging
-import re
+import os
+import tempfile
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, Literal, Optional
-
-from urllib.parse import parse_qs, unquote
+from typing import Callable, Dict, Iterable, List, Literal, Optional, Tuple, Union
+from uuid import UUID
 
 import requests
 
-from dataclasses import Integrations, Manager, Leads, Phonet, PhonetLeads, asdict
+from api.webhook.functions.dataclasses import Integrations, Manager, Leads, Phonet, PhonetLeads, TableMap
+from api.webhook.functions.decoder import WebhookEvent, decode_webhook
 from api.openai.decorators import has_permission
+from http_client import get_session
+from local_cache import MISSING, register_cache
 
 logger = logging.getLogger(__name__)
 
+AUDIO_CONNECT_TIMEOUT = float(os.getenv("AUDIO_CONNECT_TIMEOUT", 5))
+AUDIO_READ_TIMEOUT = float(os.getenv("AUDIO_READ_TIMEOUT", 30))
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", 200 * 1024 * 1024))
+AUDIO_CHUNK_SIZE = 64 * 1024
+
+# Overrides the account link from the webhook, e.g. to point every integration at scripts/fake_crm_server.py.
+CRM_BASE_URL = os.getenv("CRM_BASE_URL")
+CRM_CONNECT_TIMEOUT = float(os.getenv("CRM_CONNECT_TIMEOUT", 5))
+CRM_READ_TIMEOUT = float(os.getenv("CRM_READ_TIMEOUT", 15))
+# amoCRM allows 7 requests per second per account; this budget is per worker process.
+CRM_REQUESTS_PER_SECOND = float(os.getenv("CRM_REQUESTS_PER_SECOND", 7))
+# The largest page amoCRM returns from list endpoints.
+CRM_NOTES_PAGE_SIZE = 250
+CRM_PIPELINES = "crm_pipelines"
+
+crm_pipelines = register_cache(CRM_PIPELINES, float(os.getenv("CRM_PIPELINES_TTL", 600)), maxsize=1000)
+
+
+class AudioTooLargeError(ValueError):
+    pass
+
 
 class AudioManager:
     def __init__(self) -> None:
@@ -22,19 +47,42 @@ class AudioManager:
 
     @has_permission
     def download(self, url: str, uniq_uuid: str, manager_id: int) -> Path:
+        logger.info(
+            "Downloading audio",
+            extra={
+                "status_code": "100",
+                "status_message": "Downloading audio file",
+                "operation_type": "AUDIO",
+                "service": "FLASK",
+            },
+        )
+
+        path = self.__audio_path / f"{uniq_uuid}.mp3"
+        fd, tmp_name = tempfile.mkstemp(dir=self.__audio_path, prefix=f".{uniq_uuid}.", suffix=".part")
+        tmp_path = Path(tmp_name)
         try:
-            logger.info(
-                "Downloading audio",
-                extra={
-                    "status_code": "100",
-                    "status_message": "Downloading audio file",
-                    "operation_type": "AUDIO",
-                    "service": "FLASK",
-                },
-            )
-            response = requests.get(url, headers={"User-Agent": "Mozilla/5.0"})
-            response.raise_for_status()
+            with os.fdopen(fd, "wb") as f, get_session("phonet").get(
+                url,
+                stream=True,
+                timeout=(AUDIO_CONNECT_TIMEOUT, AUDIO_READ_TIMEOUT),
+            ) as response:
+                response.raise_for_status()
+
+                declared_size = int(response.headers.get("Content-Length") or 0)
+                if declared_size > AUDIO_MAX_BYTES:
+                    raise AudioTooLargeError(f"Audio is {declared_size} bytes, limit is {AUDIO_MAX_BYTES}")
+
+                written = 0
+                for chunk in response.iter_content(chunk_size=AUDIO_CHUNK_SIZE):
+                    written += len(chunk)
+                    if written > AUDIO_MAX_BYTES:
+                        raise AudioTooLargeError(f"Audio exceeds {AUDIO_MAX_BYTES} bytes")
+                    f.write(chunk)
+
+            # Readers only ever see a complete file under the final name.
+            os.replace(tmp_path, path)
         except requests.RequestException:
+            tmp_path.unlink(missing_ok=True)
             logger.error(
                 "Audio download failed",
                 exc_info=True,
@@ -46,22 +94,8 @@ class AudioManager:
                 },
             )
             raise
-
-        path = self.__audio_path / f"{uniq_uuid}.mp3"
-        try:
-            with open(path, "wb") as f:
-                f.write(response.content)
-            logger.info(
-                "Audio saved",
-                extra={
-                    "status_code": "200",
-                    "status_message": "Audio file saved",
-                    "operation_type": "AUDIO",
-                    "service": "FLASK",
-                },
-            )
-            return path
         except Exception:
+            tmp_path.unlink(missing_ok=True)
             logger.error(
                 "Audio save failed",
                 exc_info=True,
@@ -74,6 +108,17 @@ class AudioManager:
             )
             raise
 
+        logger.info(
+            "Audio saved",
+            extra={
+                "status_code": "200",
+                "status_message": "Audio file saved",
+                "operation_type": "AUDIO",
+                "service": "FLASK",
+            },
+        )
+        return path
+
     def delete(self, audio_path: Path) -> None:
         try:
             audio_path.unlink()
@@ -103,16 +148,37 @@ class AudioManager:
         return self.__audio_path
 
 
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            return value
+    if isinstance(value, int):
+        return datetime.utcfromtimestamp(value)
+    return value
+
+
+def _parse_uuid(value):
+    try:
+        return UUID(value)
+    except (TypeError, ValueError):
+        return value
+
+
 class HookDecoder:
     def __init__(self) -> None:
-        self.__clear_data: dict = {}
-        self.__is_phonet: bool = False
+        self.__event: WebhookEvent = WebhookEvent()
 
     @property
     def is_phonet(self) -> bool:
-        return self.__is_phonet
+        return self.__event.is_phonet
+
+    @property
+    def event(self) -> WebhookEvent:
+        return self.__event
 
-    def webhook_decoder(self, raw_data: str, return_data: bool = False) -> Optional[Dict[str, Any]]:
+    def webhook_decoder(self, raw_data: Union[bytes, str], return_data: bool = False) -> Optional[WebhookEvent]:
         logger.info(
             "Decoding webhook data",
             extra={
@@ -123,19 +189,7 @@ class HookDecoder:
             },
         )
 
-        decoded_data = unquote(raw_data)
-        parsed_data = parse_qs(decoded_data)
-
-        for key, value in parsed_data.items():
-            if isinstance(value, list) and len(value) == 1:
-                try:
-                    short_key = re.findall(r"\[(.*?)\]", key)[-1]
-                    self.__clear_data[short_key] = json.loads(value[0])
-                except json.JSONDecodeError:
-                    cleaned = re.sub(r'\\n"|\\', '', value[0])
-                    self.__clear_data[short_key] = int(cleaned) if cleaned.isdigit() else cleaned
-
-        self.__is_phonet = not isinstance(self.__clear_data.get("text"), str)
+        self.__event = decode_webhook(raw_data)
 
         if return_data:
             logger.info(
@@ -147,19 +201,20 @@ class HookDecoder:
                     "service": "FLASK",
                 },
             )
-            return self.__clear_data
+            return self.__event
 
     def integration_data(self) -> Optional[tuple[str, str, int, str]]:
-        if self.__is_phonet:
+        event = self.__event
+        if event.is_phonet:
             return (
-                self.__clear_data.get("text", {}).get("UNIQ"),
-                self.__clear_data.get("text", {}).get("LINK"),
-                self.__clear_data.get("element_id"),
-                self.__clear_data.get("self"),
+                event.call.uniq,
+                event.call.link,
+                event.element_id,
+                event.account_link,
             )
         return None
 
-    def table_map(self, lead_status: str) -> Dict[str, Dict[str, Any]]:
+    def table_map(self, lead_status: Optional[str] = None) -> TableMap:
         logger.info(
             "Mapping data to model",
             extra={
@@ -170,37 +225,190 @@ class HookDecoder:
             },
         )
 
-        created_at = self.__clear_data.get("created_at")
-        updated_at = self.__clear_data.get("updated_at")
-
-        return {
-            "Integrations": asdict(Integrations(
-                subdomain=self.__clear_data.get("subdomain"),
-                link=self.__clear_data.get("self"),
-            )),
-            "Manager": asdict(Manager(
-                crm_user_id=self.__clear_data.get("metadata", {}).get("event_source", {}).get("id"),
-                username=self.__clear_data.get("metadata", {}).get("event_source", {}).get("author_name"),
-                type=self.__clear_data.get("metadata", {}).get("event_source", {}).get("type"),
-            )),
-            "Leads": asdict(Leads(
-                owner_id=self.__clear_data.get("main_user_id"),
-                account_id=self.__clear_data.get("main_user_id"),
-                element_id=self.__clear_data.get("element_id"),
-                element_type=self.__clear_data.get("element_type"),
-                text_message=self.__clear_data.get("text") if isinstance(self.__clear_data.get("text"), str) else None,
-                timestamp_x=self.__clear_data.get("timestamp_x"),
-                created_at=datetime.utcfromtimestamp(created_at).strftime('%Y-%m-%d %H:%M:%S') if created_at else None,
-                updated_at=datetime.utcfromtimestamp(updated_at).strftime('%Y-%m-%d %H:%M:%S') if updated_at else None,
-                lead_status=lead_status if self.__is_phonet else "",
-            )),
-            "PhonetLeads": asdict(PhonetLeads()),
-            "Phonet": {} if not self.__is_phonet else asdict(Phonet(
-                unique_uuid=self.__clear_data.get("text", {}).get("UNIQ"),
-                audio_mp3=self.__clear_data.get("text", {}).get("LINK"),
-                phone_number=self.__clear_data.get("text", {}).get("PHONE").lstrip(),
-                duration=self.__clear_data.get("text", {}).get("DURATION"),
-                call_status=self.__clear_data.get("text", {}).get("call_status"),
-                call_result=self.__clear_data.get("text", {}).get("call_result"),
-            )),
+        event = self.__event
+        call = event.call
+
+        return TableMap(
+            integrations=Integrations(
+                subdomain=event.subdomain,
+                link=event.account_link,
+            ),
+            manager=Manager(
+                crm_user_id=event.author_id,
+                username=event.author_name,
+                type=event.author_type,
+            ),
+            leads=Leads(
+                owner_id=event.main_user_id,
+                account_id=event.main_user_id,
+                element_id=event.element_id,
+                element_type=event.element_type,
+                text_message=event.text,
+                timestamp_x=_parse_timestamp(event.timestamp_x),
+                created_at=datetime.utcfromtimestamp(event.created_at) if event.created_at else None,
+                updated_at=datetime.utcfromtimestamp(event.updated_at) if event.updated_at else None,
+                lead_status=lead_status if event.is_phonet else "",
+            ),
+            phonet_leads=PhonetLeads(),
+            phonet=None if not call else Phonet(
+                unique_uuid=_parse_uuid(call.uniq),
+                audio_mp3=call.link,
+                phone_number=call.phone,
+                duration=call.duration,
+                call_status=call.call_status,
+                call_result=call.call_result,
+            ),
+        )
+
+
+class _RequestPacer:
+    """Token bucket that blocks the calling thread until the next request fits within ``rate`` per second."""
+
+    def __init__(self, rate: float) -> None:
+        self.__rate = rate
+        self.__tokens = rate
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def wait(self) -> None:
+        if self.__rate <= 0:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(self.__rate, self.__tokens + (now - self.__updated) * self.__rate)
+            self.__updated = now
+            self.__tokens -= 1
+            delay = -self.__tokens / self.__rate if self.__tokens < 0 else 0
+        if delay:
+            time.sleep(delay)
+
+
+_pacers: Dict[str, _RequestPacer] = {}
+_pacers_lock = threading.Lock()
+
+
+def _pacer(base_url: str) -> _RequestPacer:
+    pacer = _pacers.get(base_url)
+    if pacer is None:
+        with _pacers_lock:
+            pacer = _pacers.setdefault(base_url, _RequestPacer(CRM_REQUESTS_PER_SECOND))
+    return pacer
+
+
+class ApiCRMManager:
+    def __init__(self, url_domain: str, access_token: Optional[str] = None) -> None:
+        self.url_domain = url_domain
+        base_url = (CRM_BASE_URL or url_domain).rstrip("/")
+        if "://" not in base_url:
+            base_url = f"https://{base_url}"
+        self.__base_url = base_url
+        self.__session = get_session("crm")
+        self.__headers = {"Authorization": f"Bearer {access_token}"} if access_token else {}
+
+    def __request(self, method: str, path: str, **kwargs) -> requests.Response:
+        _pacer(self.__base_url).wait()
+        response = self.__session.request(
+            method,
+            f"{self.__base_url}{path}",
+            headers=self.__headers,
+            timeout=(CRM_CONNECT_TIMEOUT, CRM_READ_TIMEOUT),
+            **kwargs,
+        )
+        response.raise_for_status()
+        return response
+
+    def statuses(self, refresh: bool = False) -> Dict[Tuple[int, int], dict]:
+        """Every lead status of the account keyed by (pipeline_id, status_id), cached per account."""
+        statuses = MISSING if refresh else crm_pipelines.get(self.__base_url)
+        if statuses is not MISSING:
+            return statuses
+
+        response = self.__request("GET", "/api/v4/leads/pipelines")
+        pipelines = response.json().get("_embedded", {}).get("pipelines", []) if response.content else []
+        statuses = {
+            (pipeline["id"], status["id"]): {
+                "id": status["id"],
+                "name": status.get("name"),
+                "pipeline_id": pipeline["id"],
+                "pipeline_name": pipeline.get("name"),
+            }
+            for pipeline in pipelines
+            for status in pipeline.get("_embedded", {}).get("statuses", [])
+        }
+        crm_pipelines.set(self.__base_url, statuses)
+        return statuses
+
+    def status_info(self, lead_id: Union[int, str]) -> dict:
+        """Status of the lead as {"id", "name", "pipeline_id", "pipeline_name"}; empty if the lead is unknown."""
+        try:
+            response = self.__request("GET", f"/api/v4/leads/{lead_id}")
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return {}
+            raise
+        if not response.content:
+            # amoCRM answers 204 for a lead that does not exist.
+            return {}
+
+        lead = response.json()
+        key = (lead.get("pipeline_id"), lead.get("status_id"))
+        status = self.statuses().get(key)
+        if status is None:
+            # A status added since the dictionary was cached.
+            status = self.statuses(refresh=True).get(key, {})
+        return status
+
+    def post_send_data_to_crm(self, lead_id: Union[int, str], content: str) -> dict:
+        response = self.__request(
+            "POST",
+            f"/api/v4/leads/{lead_id}/notes",
+            json=[{"note_type": "common", "params": {"text": content}}],
+        )
+        logger.info(
+            f"Note added to lead {lead_id}",
+            extra={
+                "status_code": str(response.status_code),
+                "status_message": "CRM note created",
+                "operation_type": "CRM",
+                "service": "FLASK",
+            },
+        )
+        return response.json() if response.content else {}
+
+    def add_notes(self, notes: List[dict]) -> List[dict]:
+        """Create notes on several leads in one request; each note carries its ``entity_id`` (the lead id)."""
+        response = self.__request("POST", "/api/v4/leads/notes", json=notes)
+        return response.json().get("_embedded", {}).get("notes", []) if response.content else []
+
+    def lead_notes(
+        self,
+        lead_ids: Iterable[Union[int, str]],
+        updated_from: Optional[int] = None,
+        on_page: Optional[Callable[[int], None]] = None,
+    ) -> List[dict]:
+        """Common notes of the given leads, newest first, optionally only those updated since ``updated_from``.
+
+        Follows every page; the CRM returns at most CRM_NOTES_PAGE_SIZE notes per request.
+        ``on_page`` is called with the page number before each request.
+        """
+        params = {
+            "filter[entity_id][]": list(lead_ids),
+            "filter[note_type]": "common",
+            "order[updated_at]": "desc",
+            "limit": CRM_NOTES_PAGE_SIZE,
         }
+        if updated_from is not None:
+            params["filter[updated_at][from]"] = updated_from
+
+        notes: List[dict] = []
+        page = 1
+        while True:
+            if on_page:
+                on_page(page)
+            response = self.__request("GET", "/api/v4/leads/notes", params={**params, "page": page})
+            body = response.json() if response.content else {}
+            found = body.get("_embedded", {}).get("notes", [])
+            notes.extend(found)
+            if len(found) < CRM_NOTES_PAGE_SIZE or "next" not in body.get("_links", {}):
+                return notes
+            page += 1
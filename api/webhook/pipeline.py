@@ -0,0 +1,504 @@
+import logging
+import random
+from pathlib import Path
+from typing import Optional
+
+from celery import chain
+from dotenv import load_dotenv
+from openai import RateLimitError
+
+from api.openai.trancription import assistant_analyse, transcriptions
+from api.webhook.functions.checkpoint import (
+    STAGES,
+    complete_stage,
+    first_pending_stage,
+    is_done,
+    load_call,
+    mark_stage,
+    mark_stages,
+    record_failure,
+    reset_stage,
+    start_call,
+)
+from api.webhook.functions import crm_outbox, openai_queue
+from api.webhook.functions.database_orm import save_analyse_data_to_database, save_to_database, update_lead_status
+from api.webhook.functions.enrichment import lead_status
+from api.webhook.functions.gating import METADATA_ONLY, SKIPPED_STAGES, TRANSCRIBE_ONLY, active_rules, decide
+from api.webhook.functions.source import AudioManager, HookDecoder
+from celery_settings import celery
+from metrics import metrics
+from rate_limit import RateLimited
+from resilience import CircuitOpen, breakers, is_out_of_quota, park, retry_or_raise
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+DECODE_QUEUE = "decode"
+DOWNLOAD_QUEUE = "download"
+TRANSCRIBE_QUEUE = "transcribe"
+ANALYZE_QUEUE = "analyze"
+CRM_POST_QUEUE = "crm_post"
+
+DEFAULT_RETRY_AFTER = 20.0
+DEFER_JITTER = 5.0
+
+
+def get_app():
+    from app import app
+    return app
+
+
+def build_pipeline(data) -> chain:
+    return chain(
+        decode_and_persist.s(data),
+        download_audio.s(),
+        transcribe_audio.s(),
+        analyze_transcript.s(),
+        post_to_crm.s(),
+    )
+
+
+def resume_pipeline(call_key: str) -> Optional[chain]:
+    """Build a chain that starts at the first stage the call has not finished."""
+    record = load_call(call_key)
+    if record is None:
+        raise ValueError(f"No processing record for call {call_key}")
+
+    pending = first_pending_stage(record)
+    if pending is None:
+        return None
+    if pending == "persisted":
+        return build_pipeline(record.raw_payload)
+
+    stage_tasks = {
+        "downloaded": download_audio,
+        "transcribed": transcribe_audio,
+        "analysed": analyze_transcript,
+        "posted": post_to_crm,
+    }
+    remaining = STAGES[STAGES.index(pending):]
+    first, *rest = (stage_tasks[stage] for stage in remaining)
+    return chain(first.s(call_key), *(task.s() for task in rest))
+
+
+def _download(call_key: str, record) -> Optional[Path]:
+    app = get_app()
+    with app.app_context(), breakers["phonet"].guard():
+        audio_path = AudioManager().download(record.audio_url, record.unique_uuid, record.manager_id)
+    # has_permission returns a Response instead of a path when the manager is not allowed.
+    if isinstance(audio_path, Path):
+        return audio_path
+
+    # Not retried: the chain stops here, and the reason stays on the call so it can be resumed later.
+    reason = audio_path.get_data(as_text=True) if hasattr(audio_path, "get_data") else "no audio returned"
+    logger.warning(
+        f"Call {call_key} audio not downloaded: {reason}",
+        extra={
+            "status_code": str(getattr(audio_path, "status_code", 403)),
+            "status_message": "Download not permitted",
+            "operation_type": "WEBHOOK",
+            "service": "FLASK",
+        },
+    )
+    record_failure(call_key, "downloaded", PermissionError(reason))
+    return None
+
+
+def defer_delay(error: Exception) -> float:
+    """Seconds until the capacity behind a RateLimited, CircuitOpen or OpenAI 429 is expected back."""
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    # A 429 from OpenAI itself; it usually says how long to wait.
+    try:
+        return float(error.response.headers.get("retry-after", DEFAULT_RETRY_AFTER))
+    except (AttributeError, TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def defer_reason(error: Exception) -> str:
+    return f"{error.name}_circuit_open" if isinstance(error, CircuitOpen) else "rate_limited"
+
+
+def _defer(task, call_key: str, error: Exception, stage: Optional[str] = None) -> Exception:
+    """Park the task until capacity is expected back, instead of failing the call.
+
+    An exhausted OpenAI quota, or a call parked too often, fails ``stage`` instead.
+    """
+    if is_out_of_quota(error):
+        logger.error(
+            f"Call {call_key} failed: OpenAI quota exhausted",
+            extra={
+                "status_code": "429",
+                "status_message": "Insufficient quota",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        if stage:
+            record_failure(call_key, stage, error)
+        return error
+
+    retry_after = defer_delay(error)
+    logger.warning(
+        f"Call {call_key} deferred for {retry_after:.1f}s: {error}",
+        extra={
+            "status_code": "429",
+            "status_message": "Dependency unavailable",
+            "operation_type": "WEBHOOK",
+            "service": "FLASK",
+        },
+    )
+    # Jitter keeps parked tasks from coming back as one burst.
+    delay = retry_after + random.uniform(0, DEFER_JITTER)
+    deferred = park(task, error, delay, reason=defer_reason(error), call_key=call_key)
+    if deferred is error and stage:
+        record_failure(call_key, stage, error)
+    return deferred
+
+
+@celery.task(bind=True)
+def decode_and_persist(self, data) -> Optional[str]:
+    call_key = None
+    try:
+        logger.info(
+            "Start decoding webhook data",
+            extra={
+                "status_code": "100",
+                "status_message": "Decoding webhook data",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+
+        hook_decod = HookDecoder()
+        hook_decod.webhook_decoder(raw_data=data)
+        integration = hook_decod.integration_data()
+        if not integration or not integration[0]:
+            logger.warning(
+                "Webhook is not a Phonet call event",
+                extra={
+                    "status_code": "400",
+                    "status_message": "Not a call event",
+                    "operation_type": "WEBHOOK",
+                    "service": "FLASK",
+                },
+            )
+            return None
+
+        call_key, audio_url, _, url_domain = integration
+        record = start_call(call_key, raw_payload=data if isinstance(data, bytes) else str(data).encode())
+        if is_done(record, "persisted"):
+            return call_key
+
+        decision = decide(hook_decod.event.call, active_rules())
+        metrics.incr("call_gating_total", decision=decision)
+
+        # The lead status is filled in later by enrich_lead_status, so the CRM is not on the critical path.
+        db_data = hook_decod.table_map()
+        # The checkpoint is written in the same transaction as the call rows,
+        # so a crash can never leave rows saved but the stage unrecorded.
+        # Stages the gating policy skips are checkpointed as done right away.
+        saved = save_to_database(
+            db_data,
+            on_saved=lambda db, saved: mark_stages(
+                db,
+                call_key,
+                ("persisted", *SKIPPED_STAGES[decision]),
+                url_domain=url_domain,
+                audio_url=audio_url,
+                gating=decision,
+                **saved,
+            ),
+        )
+
+        if saved.get("lead_id"):
+            enrich_lead_status.delay(call_key)
+
+        logger.info(
+            f"Call {call_key} gated as {decision}",
+            extra={
+                "status_code": "200",
+                "status_message": "Call gated",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        return None if decision == METADATA_ONLY else call_key
+    except Exception as e:
+        logger.error(
+            "Decode and persist stage failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Decode stage error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        record_failure(call_key, "persisted", e)
+        raise
+
+
+@celery.task(bind=True)
+def enrich_lead_status(self, call_key: str) -> Optional[str]:
+    """Backfill Leads.lead_status for a persisted call; runs beside the pipeline, not in it."""
+    try:
+        record = load_call(call_key)
+        if record is None or not record.lead_id:
+            return None
+
+        with breakers["crm"].guard():
+            status = lead_status(record.url_domain, record.lead_element_id)
+        update_lead_status(record.lead_id, status)
+
+        logger.info(
+            "Fetched lead status from CRM",
+            extra={
+                "status_code": "200",
+                "status_message": "Lead status fetched",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        return status
+    except CircuitOpen as e:
+        raise _defer(self, call_key, e)
+    except Exception as e:
+        logger.error(
+            "Lead status enrichment failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Lead status error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        raise retry_or_raise(self, "crm", e)
+
+
+@celery.task(bind=True)
+def download_audio(self, call_key: Optional[str]) -> Optional[str]:
+    if not call_key:
+        return None
+
+    try:
+        record = load_call(call_key)
+        if is_done(record, "downloaded"):
+            return call_key
+
+        if not record.audio_url:
+            logger.warning(
+                "No audio URL provided",
+                extra={
+                    "status_code": "400",
+                    "status_message": "Missing audio URL",
+                    "operation_type": "WEBHOOK",
+                    "service": "FLASK",
+                },
+            )
+            complete_stage(call_key, "downloaded", audio_path=None)
+            return call_key
+
+        audio_path = _download(call_key, record)
+        if audio_path is None:
+            return None
+
+        complete_stage(call_key, "downloaded", audio_path=str(audio_path))
+        return call_key
+    except CircuitOpen as e:
+        raise _defer(self, call_key, e, "downloaded")
+    except Exception as e:
+        logger.error(
+            "Download stage failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Audio download error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        record_failure(call_key, "downloaded", e)
+        raise retry_or_raise(self, "phonet", e)
+
+
+def save_transcript(call_key: str, record, transcript: str) -> None:
+    if record.gating == TRANSCRIBE_ONLY and record.lead_id:
+        # No analysis follows, so the transcript is stored as an unanalysed row for the admin,
+        # in the same transaction as the checkpoint.
+        save_analyse_data_to_database(
+            {"lead_id": record.lead_id, "audio_text": transcript, "is_analysed": False},
+            on_saved=lambda db, _: mark_stage(db, call_key, "transcribed", transcript=transcript),
+        )
+    else:
+        complete_stage(call_key, "transcribed", transcript=transcript)
+
+
+@celery.task(bind=True)
+def transcribe_audio(self, call_key: Optional[str]) -> Optional[str]:
+    if not call_key:
+        return None
+    if openai_queue.OPENAI_ASYNC:
+        # The asyncio worker runs the OpenAI stages and resumes the chain after them.
+        openai_queue.submit(call_key)
+        return None
+
+    try:
+        record = load_call(call_key)
+        if is_done(record, "transcribed"):
+            return call_key
+
+        if not record.audio_path:
+            complete_stage(call_key, "transcribed", transcript="")
+            return call_key
+
+        audio_path = Path(record.audio_path)
+        if not audio_path.exists():
+            # The file was lost since the download checkpoint, e.g. on another host.
+            reset_stage(call_key, "downloaded")
+            audio_path = _download(call_key, record)
+            if audio_path is None:
+                return None
+            complete_stage(call_key, "downloaded", audio_path=str(audio_path))
+
+        with breakers["openai"].guard():
+            transcript = transcriptions(audio_file_mp3_path=str(audio_path)) or ""
+        save_transcript(call_key, record, transcript)
+        AudioManager().delete(audio_path)
+        return call_key
+    except (RateLimited, RateLimitError, CircuitOpen) as e:
+        raise _defer(self, call_key, e, "transcribed")
+    except Exception as e:
+        logger.error(
+            "Transcription stage failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Transcription error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        record_failure(call_key, "transcribed", e)
+        raise retry_or_raise(self, "openai", e)
+
+
+@celery.task(bind=True)
+def analyze_transcript(self, call_key: Optional[str]) -> Optional[str]:
+    if not call_key:
+        return None
+    if openai_queue.OPENAI_ASYNC:
+        openai_queue.submit(call_key)
+        return None
+
+    try:
+        record = load_call(call_key)
+        if is_done(record, "analysed"):
+            return call_key
+
+        with breakers["openai"].guard():
+            # The Analyzes row and the checkpoint commit together, like the call rows in decode_and_persist.
+            analysis = assistant_analyse(
+                transcrip_text=record.transcript or "",
+                crm_data_json={"lead_id": record.lead_id},
+                on_saved=lambda db, analysed: mark_stage(
+                    db, call_key, "analysed", analysed_text=analysed.analysed_text
+                ),
+            )
+        if analysis is None:
+            return None
+
+        return call_key
+    except (RateLimited, RateLimitError, CircuitOpen) as e:
+        raise _defer(self, call_key, e, "analysed")
+    except Exception as e:
+        logger.error(
+            "Assistant execution failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Assistant error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        record_failure(call_key, "analysed", e)
+        raise retry_or_raise(self, "openai", e)
+
+
+@celery.task(bind=True)
+def post_to_crm(self, call_key: Optional[str]) -> None:
+    """Queue the analysis note; flush_crm_notes posts it and checkpoints the call as posted."""
+    if not call_key:
+        return
+
+    try:
+        record = load_call(call_key)
+        if is_done(record, "posted"):
+            return
+
+        queued = crm_outbox.enqueue(
+            record.url_domain,
+            key=call_key,
+            lead_id=record.lead_element_id,
+            text=str(record.analysed_text),
+        )
+        if queued >= crm_outbox.CRM_NOTES_BATCH_SIZE:
+            flush_crm_notes.delay(record.url_domain)
+
+        logger.info(
+            f"Note for call {call_key} queued for the CRM",
+            extra={
+                "status_code": "202",
+                "status_message": "CRM note queued",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+    except Exception as e:
+        logger.error(
+            "CRM post stage failed",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "CRM post error",
+                "operation_type": "WEBHOOK",
+                "service": "FLASK",
+            },
+        )
+        record_failure(call_key, "posted", e)
+        raise
+
+
+@celery.task(ignore_result=True)
+def flush_crm_notes(url_domain: Optional[str] = None) -> int:
+    """Post queued notes in batches: for one account, or for every account with a batch due."""
+    posted = 0
+    for account in [url_domain] if url_domain else crm_outbox.accounts():
+        try:
+            # A recovered in-flight batch may settle fewer notes than a full batch, or none
+            # when it was already in the CRM, with more queued behind it: stop only when a
+            # flush finds nothing to do.
+            while url_domain or crm_outbox.is_due(account):
+                settled = crm_outbox.flush(account)
+                if not settled:
+                    break
+                posted += settled
+        except CircuitOpen:
+            # The notes stay queued; the next scheduled flush tries again.
+            continue
+        except Exception:
+            logger.error(
+                f"CRM notes flush failed for {account}",
+                exc_info=True,
+                extra={
+                    "status_code": "500",
+                    "status_message": "CRM flush error",
+                    "operation_type": "WEBHOOK",
+                    "service": "FLASK",
+                },
+            )
+    return posted
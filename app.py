@@ -1,9 +1,10 @@
+import hmac
 import logging
 import os
 
 import click
 from dotenv import load_dotenv
-from flask import Blueprint, Flask, redirect, render_template, request, url_for
+from flask import Blueprint, Flask, Response, abort, redirect, render_template, request, url_for
 from flask.cli import with_appcontext
 from flask_admin import Admin, AdminIndexView, expose
 from flask_login import LoginManager, login_required, login_user, logout_user
@@ -14,6 +15,7 @@ from werkzeug.security import check_password_hash
 from admin import (
     AnalysesAdminView,
     AssistantAdminView,
+    GatingPolicyAdminView,
     IntegrationsAdminView,
     LeadsAdminView,
     ManagerAdminView,
@@ -21,12 +23,17 @@ from admin import (
     PhonetLeadsAdminView,
     PromptsAdmin,
 )
+from api.openai.async_worker import OPENAI_ASYNC_CONCURRENCY, run as run_openai_worker
+from api.webhook.pipeline import resume_pipeline
 from api.webhook.router import webhook_route
 from celery_settings import celery, configure_celery
 from config import Config
+from database import bind_engine, engine_options
+from metrics import metrics
 from models import (
     Analyzes,
     Assistant,
+    GatingPolicy,
     Integrations,
     Leads,
     Manager,
@@ -48,7 +55,13 @@ app.config.update(
     CELERY_RESULT_BACKEND=os.getenv('CELERY_RESULT_BACKEND', 'redis://redis:6379/0')
 )
 
+app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options())
+
 db.init_app(app)
+with app.app_context():
+    # SessionLocal (Celery stages, save_to_database) shares Flask-SQLAlchemy's pool.
+    bind_engine(db.engine)
+
 migrate = Migrate(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -79,6 +92,7 @@ admin.add_view(AnalysesAdminView(Analyzes, db.session))
 admin.add_view(PhonetLeadsAdminView(PhonetLeads, db.session))
 admin.add_view(AssistantAdminView(Assistant, db.session))
 admin.add_view(PromptsAdmin(Prompts, db.session))
+admin.add_view(GatingPolicyAdminView(GatingPolicy, db.session))
 
 
 @login_manager.user_loader
@@ -110,6 +124,16 @@ def logout():
     return redirect(url_for('login'))
 
 
+@app.route('/metrics')
+def metrics_view():
+    token = app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response('Unauthorized', 401, {'WWW-Authenticate': 'Bearer'})
+    return Response(metrics.render(), mimetype='text/plain')
+
+
 @app.cli.command('createsuperuser')
 @click.option('--username', prompt=True, help='The username for the superuser.')
 @click.option('--email', prompt=True, help='The email for the superuser.')
@@ -132,6 +156,31 @@ def create_superuser(username, email, password):
     print(f"Superuser {username} created successfully.")
 
 
+@app.cli.command('replay-call')
+@click.argument('unique_uuid')
+@with_appcontext
+def replay_call(unique_uuid):
+    """Resume processing of a call from its first unfinished stage"""
+
+    pipeline = resume_pipeline(unique_uuid)
+    if pipeline is None:
+        print(f"Call {unique_uuid} is already fully processed.")
+        return
+
+    pipeline.apply_async()
+    print(f"Call {unique_uuid} re-queued.")
+
+
+@app.cli.command('openai-worker')
+@click.option('--concurrency', default=OPENAI_ASYNC_CONCURRENCY, show_default=True,
+              help='OpenAI calls in flight at once.')
+def openai_worker(concurrency):
+    """Run the transcribe and analyze stages on AsyncOpenAI, for OPENAI_ASYNC=true"""
+
+    logging.basicConfig(level=logging.INFO)
+    run_openai_worker(concurrency)
+
+
 def create_app():
     logging.basicConfig(level=logging.INFO)
     app.logger.setLevel(logging.INFO)
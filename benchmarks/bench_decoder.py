@@ -0,0 +1,82 @@
+"""Microbenchmark: single-pass decode_webhook against the original HookDecoder parsing.
+
+Usage:
+    python -m benchmarks.bench_decoder [--samples benchmarks/samples/webhooks.jsonl] [--number 20000]
+
+Each line of the samples file is a JSON object with ``sample_id`` and the raw
+form-encoded ``body`` as amoCRM posts it.
+"""
+import argparse
+import json
+import re
+import timeit
+from pathlib import Path
+from urllib.parse import parse_qs, unquote
+
+from api.webhook.functions.decoder import decode_webhook
+
+DEFAULT_SAMPLES = Path(__file__).parent / "samples" / "webhooks.jsonl"
+
+
+def legacy_decode(raw_data: str) -> dict:
+    # HookDecoder.webhook_decoder as it was before decode_webhook replaced it.
+    clear_data = {}
+    decoded_data = unquote(raw_data)
+    parsed_data = parse_qs(decoded_data)
+
+    for key, value in parsed_data.items():
+        if isinstance(value, list) and len(value) == 1:
+            try:
+                short_key = re.findall(r"\[(.*?)\]", key)[-1]
+                clear_data[short_key] = json.loads(value[0])
+            except json.JSONDecodeError:
+                cleaned = re.sub(r'\\n"|\\', '', value[0])
+                clear_data[short_key] = int(cleaned) if cleaned.isdigit() else cleaned
+    return clear_data
+
+
+def check_equivalence(sample_id: str, body: str) -> None:
+    legacy = legacy_decode(body)
+    event = decode_webhook(body.encode())
+
+    text = legacy.get("text")
+    if isinstance(text, dict):
+        assert event.call is not None, sample_id
+        assert event.call.uniq == text.get("UNIQ"), sample_id
+        assert event.call.link == text.get("LINK"), sample_id
+        assert event.call.duration == text.get("DURATION"), sample_id
+        # The legacy double unquote turned a leading "+" into a space.
+        assert event.call.phone.lstrip("+") == text.get("PHONE").lstrip(), sample_id
+    else:
+        assert event.call is None and event.text == text, sample_id
+
+    assert event.element_id == legacy.get("element_id"), sample_id
+    assert event.subdomain == legacy.get("subdomain"), sample_id
+    assert event.account_link == legacy.get("self"), sample_id
+    assert event.created_at == legacy.get("created_at"), sample_id
+    assert event.author_id == legacy.get("metadata", {}).get("event_source", {}).get("id"), sample_id
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=Path, default=DEFAULT_SAMPLES)
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    samples = [json.loads(line) for line in args.samples.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    print(f"{'sample':<22}{'legacy us':>12}{'single-pass us':>16}{'speedup':>10}")
+    for sample in samples:
+        sample_id, body = sample["sample_id"], sample["body"]
+        check_equivalence(sample_id, body)
+        raw = body.encode()
+
+        legacy = min(timeit.repeat(lambda: legacy_decode(body), number=args.number, repeat=3))
+        single = min(timeit.repeat(lambda: decode_webhook(raw), number=args.number, repeat=3))
+        legacy_us = legacy / args.number * 1e6
+        single_us = single / args.number * 1e6
+        print(f"{sample_id:<22}{legacy_us:>12.2f}{single_us:>16.2f}{legacy_us / single_us:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
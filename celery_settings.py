@@ -1,11 +1,45 @@
+import os
+
 from celery import Celery
 
 celery = Celery(__name__)
 
+PIPELINE_TASK_ROUTES = {
+    'api.webhook.router.process_webhook_data': {'queue': 'decode'},
+    'api.webhook.pipeline.decode_and_persist': {'queue': 'decode'},
+    'api.webhook.pipeline.download_audio': {'queue': 'download'},
+    'api.webhook.pipeline.transcribe_audio': {'queue': 'transcribe'},
+    'api.webhook.pipeline.analyze_transcript': {'queue': 'analyze'},
+    'api.webhook.pipeline.enrich_lead_status': {'queue': 'crm_post'},
+    'api.webhook.pipeline.post_to_crm': {'queue': 'crm_post'},
+    'api.webhook.pipeline.flush_crm_notes': {'queue': 'crm_post'},
+    'resilience.release_parked_tasks': {'queue': 'decode'},
+}
+
+BEAT_SCHEDULE = {
+    'release-parked-tasks': {
+        'task': 'resilience.release_parked_tasks',
+        'schedule': float(os.getenv('PARK_RELEASE_INTERVAL', 5)),
+        'options': {'expires': 30},
+    },
+    'flush-crm-notes': {
+        'task': 'api.webhook.pipeline.flush_crm_notes',
+        'schedule': float(os.getenv('CRM_NOTES_FLUSH_INTERVAL', 5)),
+        'options': {'expires': 30},
+    },
+}
+
 
 def configure_celery(app):
     celery.conf.update(
         broker_url=app.config['CELERY_BROKER_URL'],
-        result_backend=app.config['CELERY_RESULT_BACKEND']
+        result_backend=app.config['CELERY_RESULT_BACKEND'],
+        task_routes=PIPELINE_TASK_ROUTES,
+        task_serializer='msgpack',
+        result_serializer='msgpack',
+        accept_content=['msgpack', 'json'],
+        task_acks_late=True,
+        worker_prefetch_multiplier=1,
+        beat_schedule=BEAT_SCHEDULE,
     )
     celery.conf.update(app.config)
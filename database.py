@@ -1,16 +1,126 @@
 import os
+import threading
+import time
+from typing import Optional
 
-from sqlalchemy import create_engine, Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, Column, String, Integer, DateTime, ForeignKey
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import NullPool, QueuePool
 from datetime import datetime
 from dotenv import load_dotenv
+
+from metrics import metrics
+
 load_dotenv()
 
 Base = declarative_base()
 
 DATABASE_URL = os.environ.get('SQLALCHEMY_DATABASE_URI')
+DB_POOL_ROLE = os.environ.get('DB_POOL_ROLE', 'web')
+
+# Connections per process = pool_size + max_overflow, so the total against
+# Postgres is that times the number of gunicorn workers / Celery children.
+POOL_PROFILES = {
+    # gunicorn sync workers serve one request at a time.
+    'web': {'pool_size': 2, 'max_overflow': 3},
+    # Prefork Celery children run one task at a time.
+    'worker': {'pool_size': 1, 'max_overflow': 1},
+    # Threads of one process share its pool: `-P threads` Celery workers, `flask openai-worker`.
+    'worker-threads': {'pool_size': 4, 'max_overflow': 8},
+    # Short-lived flask commands and scripts.
+    'cli': {'poolclass': NullPool},
+}
+
+
+class MeteredQueuePool(QueuePool):
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe('db_pool_checkout_wait_seconds', time.perf_counter() - started, role=DB_POOL_ROLE)
+
+
+def engine_options(role: str = DB_POOL_ROLE) -> dict:
+    if role not in POOL_PROFILES:
+        raise ValueError(f"Unknown DB_POOL_ROLE: {role}")
+
+    options = {'pool_pre_ping': True, **POOL_PROFILES[role]}
+    if options.get('poolclass') is NullPool:
+        return options
+
+    options['poolclass'] = MeteredQueuePool
+    options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', options['pool_size']))
+    options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', options['max_overflow']))
+    options['pool_timeout'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    options['pool_recycle'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    return options
+
+
+def instrument_engine(shared_engine: Engine) -> Engine:
+    if not isinstance(shared_engine.pool, QueuePool):
+        return shared_engine
+
+    @event.listens_for(shared_engine, 'checkout')
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.set_gauge('db_pool_checked_out', shared_engine.pool.checkedout(), role=DB_POOL_ROLE)
+
+    @event.listens_for(shared_engine, 'checkin')
+    def _on_checkin(dbapi_connection, connection_record):
+        # The event fires before the pool takes the connection back.
+        metrics.set_gauge('db_pool_checked_out', max(shared_engine.pool.checkedout() - 1, 0), role=DB_POOL_ROLE)
+
+    return shared_engine
+
+
+def create_shared_engine(role: str = DB_POOL_ROLE) -> Engine:
+    return instrument_engine(create_engine(DATABASE_URL, **engine_options(role)))
+
+
+engine: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> Engine:
+    """The process's engine: the one bound by bind_engine, or a new one for code running without the app."""
+    global engine
+    if engine is None:
+        with _engine_lock:
+            if engine is None:
+                engine = create_shared_engine()
+    return engine
+
+
+class LazySessionMaker(sessionmaker):
+    """Binds to get_engine() on first use, so importing this module opens no pool."""
+
+    def __call__(self, **local_kw):
+        if self.kw.get('bind') is None:
+            self.configure(bind=get_engine())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = LazySessionMaker(autocommit=False, autoflush=False)
+
+
+def bind_engine(shared_engine: Engine) -> None:
+    """Point SessionLocal at an engine built elsewhere, e.g. Flask-SQLAlchemy's, so each process keeps one pool."""
+    global engine
+    if shared_engine is engine:
+        return
+    if engine is not None:
+        engine.dispose()
+    engine = instrument_engine(shared_engine)
+    SessionLocal.configure(bind=engine)
+
+
+def _dispose_after_fork() -> None:
+    # Connections inherited from the parent must not be reused by the child;
+    # close=False leaves the parent's sockets alone.
+    if engine is not None:
+        engine.dispose(close=False)
 
-engine = create_engine(DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+os.register_at_fork(after_in_child=_dispose_after_fork)
@@ -0,0 +1,139 @@
+import os
+import threading
+from typing import Dict
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import metrics
+
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+_sessions_pid = os.getpid()
+
+
+def _counting_pool(base, adapter: "PooledHTTPAdapter"):
+    class CountingConnection(base.ConnectionCls):
+        def connect(self):
+            # Pooled connections reconnect in place once the server drops them,
+            # so count handshakes here rather than when the pool creates one.
+            adapter._connection_opened(self.host)
+            return super().connect()
+
+    class CountingPool(base):
+        ConnectionCls = CountingConnection
+
+    return CountingPool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that counts requests and new connections, so keep-alive reuse can be measured."""
+
+    def __init__(self, client: str, **kwargs) -> None:
+        self.client = client
+        self.__counts_lock = threading.Lock()
+        self.__requests = 0
+        self.__connections = 0
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self),
+            "https": _counting_pool(HTTPSConnectionPool, self),
+        }
+
+    def _connection_opened(self, host: str) -> None:
+        metrics.incr("http_client_connections_opened_total", client=self.client, host=host)
+        with self.__counts_lock:
+            self.__connections += 1
+
+    def send(self, request, *args, **kwargs):
+        response = super().send(request, *args, **kwargs)
+        metrics.incr("http_client_requests_total", client=self.client, host=urlsplit(request.url).hostname)
+        with self.__counts_lock:
+            self.__requests += 1
+            reuse_ratio = 1 - min(self.__connections, self.__requests) / self.__requests
+        metrics.set_gauge("http_client_connection_reuse_ratio", reuse_ratio, client=self.client)
+        return response
+
+
+def _build_session(name: str) -> requests.Session:
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(
+        name,
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=HTTP_POOL_BLOCK,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["User-Agent"] = "Mozilla/5.0"
+    return session
+
+
+def get_session(name: str) -> requests.Session:
+    """Return the process-wide session for ``name``; connections to each host are kept alive between calls."""
+    global _sessions_pid
+    with _sessions_lock:
+        # Sockets inherited from the parent must not be shared with a forked child.
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = _build_session(name)
+        return session
+
+
+def close_sessions() -> None:
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _count_httpx_connection(request: httpx.Request) -> None:
+    def trace(event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            metrics.incr("http_client_connections_opened_total", client="openai", host=request.url.host)
+
+    request.extensions["trace"] = trace
+    metrics.incr("http_client_requests_total", client="openai", host=request.url.host)
+
+
+async def _count_httpx_connection_async(request: httpx.Request) -> None:
+    async def trace(event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            metrics.incr("http_client_connections_opened_total", client="openai", host=request.url.host)
+
+    request.extensions["trace"] = trace
+    metrics.incr("http_client_requests_total", client="openai", host=request.url.host)
+
+
+def _openai_limits(max_connections: int) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def openai_http_client() -> httpx.Client:
+    """httpx client for the OpenAI SDK with the same pool limits and connection metrics as the requests sessions."""
+    return httpx.Client(limits=_openai_limits(HTTP_POOL_MAXSIZE), event_hooks={"request": [_count_httpx_connection]})
+
+
+def openai_async_http_client(max_connections: int = HTTP_POOL_MAXSIZE) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=_openai_limits(max_connections),
+        event_hooks={"request": [_count_httpx_connection_async]},
+    )
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from redis_config import redis_client
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+MISSING = object()
+
+_caches: Dict[str, "TTLCache"] = {}
+_listener_lock = threading.Lock()
+_listener_pid: Optional[int] = None
+
+
+class TTLCache:
+    """Per-process LRU cache whose entries expire after ``ttl`` seconds or on a published invalidation."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int = 10000) -> None:
+        self.name = name
+        self.__ttl = ttl
+        self.__maxsize = maxsize
+        self.__data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        _ensure_listener()
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self.__data[key]
+                return MISSING
+            self.__data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self.__lock:
+            self.__data[key] = (time.monotonic() + self.__ttl, value)
+            self.__data.move_to_end(key)
+            # Evict one entry at a time, so a full cache never turns into a burst of misses.
+            while len(self.__data) > self.__maxsize:
+                self.__data.popitem(last=False)
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        with self.__lock:
+            if key is None:
+                self.__data.clear()
+            else:
+                self.__data.pop(key, None)
+
+
+def register_cache(name: str, ttl: float, maxsize: int = 10000) -> TTLCache:
+    cache = TTLCache(name, ttl, maxsize)
+    _caches[name] = cache
+    return cache
+
+
+def publish_invalidation(name: str, key: Optional[Hashable] = None) -> None:
+    if name in _caches:
+        _caches[name].invalidate(key)
+    try:
+        redis_client.publish(INVALIDATION_CHANNEL, json.dumps({"cache": name, "key": key}))
+    except Exception:
+        logger.error(
+            f"Failed to publish invalidation for cache {name}",
+            exc_info=True,
+            extra={
+                "status_code": "500",
+                "status_message": "Cache invalidation publish error",
+                "operation_type": "CACHE",
+                "service": "FLASK",
+            },
+        )
+
+
+def _invalidate_all() -> None:
+    for cache in _caches.values():
+        cache.invalidate()
+
+
+def _listen() -> None:
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # Anything published while we were disconnected is lost; start clean.
+            _invalidate_all()
+            for message in pubsub.listen():
+                payload = json.loads(message["data"])
+                cache = _caches.get(payload.get("cache"))
+                if cache:
+                    cache.invalidate(payload.get("key"))
+        except Exception:
+            logger.warning(
+                "Cache invalidation listener disconnected",
+                exc_info=True,
+                extra={
+                    "status_code": "500",
+                    "status_message": "Invalidation listener error",
+                    "operation_type": "CACHE",
+                    "service": "FLASK",
+                },
+            )
+            _invalidate_all()
+            time.sleep(1)
+
+
+def _ensure_listener() -> None:
+    # Started lazily and per pid, so every forked worker gets its own subscriber.
+    global _listener_pid
+    if _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _invalidate_all()
+        threading.Thread(target=_listen, name="cache-invalidation", daemon=True).start()
+        _listener_pid = os.getpid()
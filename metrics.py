@@ -0,0 +1,123 @@
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Tuple
+
+from redis_config import redis_client
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_KEY = "metrics:counters"
+# Gauges of shared state (Redis queues, breakers) have no instance label and live in GAUGES_KEY;
+# every other gauge lives in GAUGES_KEY:<instance>, next to the instance's last flush in INSTANCES_KEY.
+GAUGES_KEY = "metrics:gauges"
+INSTANCES_KEY = "metrics:instances"
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+# Gauges of an instance that has not flushed for this long, e.g. a restarted worker, are dropped.
+STALE_INSTANCE_SECONDS = float(os.getenv("METRICS_STALE_INSTANCE_SECONDS", 600))
+
+
+def _series(name: str, labels: Dict[str, object]) -> str:
+    if not labels:
+        return name
+    body = ",".join(f'{key}="{labels[key]}"' for key in sorted(labels))
+    return f"{name}{{{body}}}"
+
+
+class MetricsRegistry:
+    """Per-process metric buffer, flushed to Redis so all workers aggregate in one place."""
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL) -> None:
+        self.__flush_interval = flush_interval
+        self.__counters: Dict[str, float] = {}
+        self.__gauges: Dict[str, float] = {}
+        self.__shared_gauges: Dict[str, float] = {}
+        self.__lock = threading.Lock()
+        self.__last_flush = time.monotonic()
+        self.__instance = f"{socket.gethostname()}:{os.getpid()}"
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        series = _series(name, labels)
+        with self.__lock:
+            self.__counters[series] = self.__counters.get(series, 0) + value
+        self.__maybe_flush()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        self.incr(f"{name}_count", 1, **labels)
+        self.incr(f"{name}_sum", value, **labels)
+
+    def set_gauge(self, name: str, value: float, shared: bool = False, **labels) -> None:
+        """Set a gauge of this process, or with ``shared`` one of state every process sees the same."""
+        with self.__lock:
+            if shared:
+                self.__shared_gauges[_series(name, labels)] = value
+            else:
+                self.__gauges[_series(name, {**labels, "instance": self.__instance})] = value
+        self.__maybe_flush()
+
+    def __maybe_flush(self) -> None:
+        if time.monotonic() - self.__last_flush >= self.__flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.__lock:
+            counters, self.__counters = self.__counters, {}
+            gauges, self.__gauges = self.__gauges, {}
+            shared_gauges, self.__shared_gauges = self.__shared_gauges, {}
+            self.__last_flush = time.monotonic()
+            instance = self.__instance
+            # The instance label must follow the process after a fork.
+            self.__instance = f"{socket.gethostname()}:{os.getpid()}"
+
+        if not counters and not gauges and not shared_gauges:
+            return
+
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for series, value in counters.items():
+                pipe.hincrbyfloat(COUNTERS_KEY, series, value)
+            if shared_gauges:
+                pipe.hset(GAUGES_KEY, mapping=shared_gauges)
+            if gauges:
+                pipe.hset(f"{GAUGES_KEY}:{instance}", mapping=gauges)
+            pipe.hset(INSTANCES_KEY, instance, time.time())
+            pipe.execute()
+        except Exception:
+            logger.warning(
+                "Metrics flush failed",
+                exc_info=True,
+                extra={
+                    "status_code": "500",
+                    "status_message": "Metrics flush error",
+                    "operation_type": "METRICS",
+                    "service": "FLASK",
+                },
+            )
+
+    def snapshot(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        self.flush()
+        counters = redis_client.hgetall(COUNTERS_KEY)
+        gauges = redis_client.hgetall(GAUGES_KEY)
+        stale_before = time.time() - STALE_INSTANCE_SECONDS
+        for instance, flushed_at in redis_client.hgetall(INSTANCES_KEY).items():
+            instance = instance.decode()
+            if float(flushed_at) < stale_before:
+                redis_client.delete(f"{GAUGES_KEY}:{instance}")
+                redis_client.hdel(INSTANCES_KEY, instance)
+            else:
+                gauges.update(redis_client.hgetall(f"{GAUGES_KEY}:{instance}"))
+        return (
+            {key.decode(): float(value) for key, value in counters.items()},
+            {key.decode(): float(value) for key, value in gauges.items()},
+        )
+
+    def render(self) -> str:
+        counters, gauges = self.snapshot()
+        lines = [f"{series} {value:g}" for series, value in sorted(counters.items())]
+        lines += [f"{series} {value:g}" for series, value in sorted(gauges.items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
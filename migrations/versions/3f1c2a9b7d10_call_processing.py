@@ -0,0 +1,48 @@
+"""Call processing checkpoints
+
+Revision ID: 3f1c2a9b7d10
+Revises: 54f94b063e93
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9b7d10'
+down_revision = '54f94b063e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('call_processing',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('unique_uuid', sa.String(), nullable=False),
+    sa.Column('raw_payload', sa.LargeBinary(), nullable=True),
+    sa.Column('url_domain', sa.String(), nullable=True),
+    sa.Column('audio_url', sa.String(), nullable=True),
+    sa.Column('manager_id', sa.Integer(), nullable=True),
+    sa.Column('lead_id', sa.Integer(), nullable=True),
+    sa.Column('lead_element_id', sa.Integer(), nullable=True),
+    sa.Column('phonet_id', sa.Integer(), nullable=True),
+    sa.Column('audio_path', sa.String(), nullable=True),
+    sa.Column('transcript', sa.Text(), nullable=True),
+    sa.Column('analysed_text', sa.Text(), nullable=True),
+    sa.Column('persisted_at', sa.DateTime(), nullable=True),
+    sa.Column('downloaded_at', sa.DateTime(), nullable=True),
+    sa.Column('transcribed_at', sa.DateTime(), nullable=True),
+    sa.Column('analysed_at', sa.DateTime(), nullable=True),
+    sa.Column('posted_at', sa.DateTime(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('unique_uuid')
+    )
+
+
+def downgrade():
+    op.drop_table('call_processing')
@@ -0,0 +1,45 @@
+"""Unique integrations.subdomain and manager.crm_user_id
+
+Revision ID: 8b4e6d2f1a37
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 10:04:17.902113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8b4e6d2f1a37'
+down_revision = '3f1c2a9b7d10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fold duplicates created by concurrent webhooks into the oldest row
+    # before the unique constraints make them impossible.
+    op.execute("""
+        UPDATE leads SET integration_id = d.keep_id
+        FROM (SELECT id, MIN(id) OVER (PARTITION BY subdomain) AS keep_id FROM integrations) d
+        WHERE leads.integration_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute("""
+        DELETE FROM integrations i USING integrations k
+        WHERE i.subdomain = k.subdomain AND i.id > k.id
+    """)
+    op.execute("""
+        UPDATE leads SET manager_id = d.keep_id
+        FROM (SELECT id, MIN(id) OVER (PARTITION BY crm_user_id) AS keep_id FROM manager) d
+        WHERE leads.manager_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute("""
+        DELETE FROM manager m USING manager k
+        WHERE m.crm_user_id = k.crm_user_id AND m.id > k.id
+    """)
+    op.create_unique_constraint('uq_integrations_subdomain', 'integrations', ['subdomain'])
+    op.create_unique_constraint('uq_manager_crm_user_id', 'manager', ['crm_user_id'])
+
+
+def downgrade():
+    op.drop_constraint('uq_manager_crm_user_id', 'manager', type_='unique')
+    op.drop_constraint('uq_integrations_subdomain', 'integrations', type_='unique')
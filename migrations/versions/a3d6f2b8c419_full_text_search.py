@@ -0,0 +1,72 @@
+"""Full-text search on transcripts, analyses and lead messages
+
+Revision ID: a3d6f2b8c419
+Revises: f1a9c3e7d502
+Create Date: 2026-10-18 13:27:40.518904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d6f2b8c419'
+down_revision = 'f1a9c3e7d502'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_CONFIG = 'phonet_text'
+
+SEARCH_VECTORS = (
+    ('leads', [('text_message', 'A')]),
+    ('analyzes', [('analysed_text', 'A'), ('audio_text', 'B')]),
+)
+
+
+def _search_vector(weighted_columns):
+    return ' || '.join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce({column}, '')), '{weight}')"
+        for column, weight in weighted_columns
+    )
+
+
+def upgrade():
+    # Calls are mostly Ukrainian and Russian, often mixed within one transcript. Postgres ships no
+    # Ukrainian stemmer, and the Russian one mangles Ukrainian endings, so words are only lowercased
+    # and unaccented (ё/е, й/и fold together); the admin search matches them by prefix instead.
+    op.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    op.execute(f'CREATE TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} (COPY = simple)')
+    op.execute(
+        f'ALTER TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} '
+        'ALTER MAPPING FOR asciiword, asciihword, hword_asciipart, word, hword, hword_part '
+        'WITH unaccent, simple'
+    )
+
+    for table, weighted_columns in SEARCH_VECTORS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column(
+                'search_vector',
+                postgresql.TSVECTOR(),
+                sa.Computed(_search_vector(weighted_columns), persisted=True),
+                nullable=True,
+            ))
+
+    with op.get_context().autocommit_block():
+        for table, _ in SEARCH_VECTORS:
+            op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], unique=False,
+                            postgresql_using='gin', postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, _ in reversed(SEARCH_VECTORS):
+            op.drop_index(f'ix_{table}_search_vector', table_name=table, postgresql_concurrently=True,
+                          if_exists=True)
+
+    for table, _ in reversed(SEARCH_VECTORS):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('search_vector')
+
+    op.execute(f'DROP TEXT SEARCH CONFIGURATION IF EXISTS {SEARCH_CONFIG}')
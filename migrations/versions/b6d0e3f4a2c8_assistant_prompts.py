@@ -0,0 +1,53 @@
+"""Assistant and prompts tables
+
+Revision ID: b6d0e3f4a2c8
+Revises: 8b4e6d2f1a37
+Create Date: 2026-10-18 10:21:36.540817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d0e3f4a2c8'
+down_revision = '8b4e6d2f1a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The initial migration never created these tables; databases set up with
+    # db.create_all() already have them, so only create what is missing.
+    existing = sa.inspect(op.get_bind()).get_table_names()
+
+    if 'assistant' not in existing:
+        op.create_table('assistant',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('assistant_name', sa.String(), nullable=False),
+        sa.Column('assistant_id', sa.String(), nullable=True),
+        sa.Column('model', sa.String(), nullable=False),
+        sa.Column('description', sa.String(), nullable=False),
+        sa.Column('message_prompt', sa.String(), nullable=True),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('assistant_id')
+        )
+
+    if 'prompts' not in existing:
+        op.create_table('prompts',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('assistant_id', sa.Integer(), nullable=False),
+        sa.Column('prompt_type', sa.String(), nullable=False),
+        sa.Column('content', sa.String(), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(['assistant_id'], ['assistant.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('assistant_id')
+        )
+
+
+def downgrade():
+    # Deliberately keeps both tables: on databases set up with db.create_all() they
+    # predate this revision and hold live data, and upgrade() accepts them as they are.
+    pass
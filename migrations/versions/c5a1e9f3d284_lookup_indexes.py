@@ -0,0 +1,43 @@
+"""Indexes for webhook and admin lookups
+
+Revision ID: c5a1e9f3d284
+Revises: b6d0e3f4a2c8
+Create Date: 2026-10-18 10:41:55.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5a1e9f3d284'
+down_revision = 'b6d0e3f4a2c8'
+branch_labels = None
+depends_on = None
+
+
+INDEXES = (
+    ('ix_leads_manager_id', 'leads', ['manager_id'], {}),
+    ('ix_leads_integration_id', 'leads', ['integration_id'], {}),
+    ('ix_analyzes_lead_id', 'analyzes', ['lead_id'], {}),
+    ('ix_phonet_leads_phonet_id', 'phonet_leads', ['phonet_id'], {}),
+    ('ix_phonet_leads_leads_id', 'phonet_leads', ['leads_id'], {}),
+    ('ix_phonet_unique_uuid', 'phonet', ['unique_uuid'], {}),
+    ('ix_manager_id_is_permissions', 'manager', ['id'], {'postgresql_include': ['is_permissions']}),
+    ('ix_assistant_active', 'assistant', ['id'], {'postgresql_where': sa.text('is_active')}),
+)
+
+
+def upgrade():
+    # CONCURRENTLY keeps the tables writable while large indexes build,
+    # which requires running outside the migration transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True,
+                            if_not_exists=True, **options)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
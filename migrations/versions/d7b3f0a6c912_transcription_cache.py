@@ -0,0 +1,33 @@
+"""Transcription cache
+
+Revision ID: d7b3f0a6c912
+Revises: c5a1e9f3d284
+Create Date: 2026-10-18 11:27:03.914552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7b3f0a6c912'
+down_revision = 'c5a1e9f3d284'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('transcription_cache',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('model', sa.String(), nullable=False),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.Column('duration', sa.Float(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_hash', 'model', name='uq_transcription_cache_hash_model')
+    )
+
+
+def downgrade():
+    op.drop_table('transcription_cache')
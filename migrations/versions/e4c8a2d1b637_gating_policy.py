@@ -0,0 +1,40 @@
+"""Gating policy
+
+Revision ID: e4c8a2d1b637
+Revises: d7b3f0a6c912
+Create Date: 2026-10-18 12:05:48.620193
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4c8a2d1b637'
+down_revision = 'd7b3f0a6c912'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('gating_policy',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('min_transcribe_seconds', sa.Integer(), nullable=False),
+    sa.Column('min_analyse_seconds', sa.Integer(), nullable=False),
+    sa.Column('metadata_only_statuses', sa.String(), nullable=True),
+    sa.Column('metadata_only_results', sa.String(), nullable=True),
+    sa.Column('transcribe_only_statuses', sa.String(), nullable=True),
+    sa.Column('is_active', sa.Boolean(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('call_processing', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('gating', sa.String(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('call_processing', schema=None) as batch_op:
+        batch_op.drop_column('gating')
+
+    op.drop_table('gating_policy')
@@ -0,0 +1,27 @@
+"""Assistant analysis engine
+
+Revision ID: f1a9c3e7d502
+Revises: e4c8a2d1b637
+Create Date: 2026-10-18 12:48:16.077431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a9c3e7d502'
+down_revision = 'e4c8a2d1b637'
+branch_labels = None
+# Adds a column to the assistant table, which b6d0e3f4a2c8 creates.
+depends_on = 'b6d0e3f4a2c8'
+
+
+def upgrade():
+    with op.batch_alter_table('assistant', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('engine', sa.String(), server_default='assistants', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('assistant', schema=None) as batch_op:
+        batch_op.drop_column('engine')
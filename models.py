@@ -3,7 +3,8 @@ from datetime import datetime
 from werkzeug.security import generate_password_hash
 
 from flask_login import UserMixin
-from sqlalchemy.dialects.postgresql import UUID as PGUUID
+from sqlalchemy.dialects.postgresql import TSVECTOR, UUID as PGUUID
+from sqlalchemy.orm import deferred
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
@@ -22,6 +23,7 @@ class User(db.Model, UserMixin):
 
 class Integrations(db.Model):
     __tablename__ = "integrations"
+    __table_args__ = (db.UniqueConstraint("subdomain", name="uq_integrations_subdomain"),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     subdomain = db.Column(db.String, nullable=False)
     link = db.Column(db.String, nullable=False)
@@ -30,6 +32,11 @@ class Integrations(db.Model):
 
 class Manager(db.Model):
     __tablename__ = "manager"
+    __table_args__ = (
+        db.UniqueConstraint("crm_user_id", name="uq_manager_crm_user_id"),
+        # Lets the permission check run as an index-only scan.
+        db.Index("ix_manager_id_is_permissions", "id", postgresql_include=["is_permissions"]),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     crm_user_id = db.Column(db.Integer, nullable=False)
     username = db.Column(db.String, nullable=False)
@@ -38,20 +45,34 @@ class Manager(db.Model):
     is_permissions = db.Column(db.Boolean, nullable=True, default=False)
 
 
+# Text search configuration created by migration a3d6f2b8c419.
+SEARCH_CONFIG = "phonet_text"
+
+
+def _search_vector(*weighted_columns):
+    return " || ".join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce({column}, '')), '{weight}')"
+        for column, weight in weighted_columns
+    )
+
+
 class Leads(db.Model):
     __tablename__ = "leads"
+    __table_args__ = (db.Index("ix_leads_search_vector", "search_vector", postgresql_using="gin"),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     owner_id = db.Column(db.Integer, nullable=False)
     account_id = db.Column(db.Integer, nullable=False)
     element_id = db.Column(db.Integer, nullable=False)
     element_type = db.Column(db.Integer, nullable=False)
-    manager_id = db.Column(db.Integer, db.ForeignKey("manager.id"), nullable=False)
-    integration_id = db.Column(db.Integer, db.ForeignKey("integrations.id"), nullable=False)
+    manager_id = db.Column(db.Integer, db.ForeignKey("manager.id"), nullable=False, index=True)
+    integration_id = db.Column(db.Integer, db.ForeignKey("integrations.id"), nullable=False, index=True)
     text_message = db.Column(db.Text)
     timestamp_x = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     lead_status = db.Column(db.String, nullable=True)
+    # Deferred so list pages never load it; only the admin search reads it.
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(_search_vector(("text_message", "A")), persisted=True)))
     manager = db.relationship("Manager", back_populates="leads")
     integration = db.relationship("Integrations", back_populates="leads")
     phonet_leads = db.relationship("PhonetLeads", back_populates="lead")
@@ -60,7 +81,7 @@ class Leads(db.Model):
 class Phonet(db.Model):
     __tablename__ = "phonet"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    unique_uuid = db.Column(PGUUID(as_uuid=True), default=uuid.uuid4, nullable=False)
+    unique_uuid = db.Column(PGUUID(as_uuid=True), default=uuid.uuid4, nullable=False, index=True)
     audio_mp3 = db.Column(db.String)
     phone_number = db.Column(db.String, nullable=False)
     duration = db.Column(db.Integer, nullable=False)
@@ -70,12 +91,17 @@ class Phonet(db.Model):
 
 
 class Analyzes(db.Model):
+    __table_args__ = (db.Index("ix_analyzes_search_vector", "search_vector", postgresql_using="gin"),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    lead_id = db.Column(db.Integer, db.ForeignKey("leads.id"), nullable=False)
+    lead_id = db.Column(db.Integer, db.ForeignKey("leads.id"), nullable=False, index=True)
     audio_text = db.Column(db.String)
     analysed_text = db.Column(db.String, default=None)
     is_analysed = db.Column(db.Boolean, nullable=False, default=False)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    search_vector = deferred(db.Column(
+        TSVECTOR,
+        db.Computed(_search_vector(("analysed_text", "A"), ("audio_text", "B")), persisted=True),
+    ))
     lead = db.relationship('Leads', backref='analyses')
 
     @property
@@ -86,8 +112,8 @@ class Analyzes(db.Model):
 class PhonetLeads(db.Model):
     __tablename__ = "phonet_leads"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    phonet_id = db.Column(db.Integer, db.ForeignKey("phonet.id"))
-    leads_id = db.Column(db.Integer, db.ForeignKey("leads.id"))
+    phonet_id = db.Column(db.Integer, db.ForeignKey("phonet.id"), index=True)
+    leads_id = db.Column(db.Integer, db.ForeignKey("leads.id"), index=True)
     last_update = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     phonet = db.relationship("Phonet", back_populates="phonet_leads")
     lead = db.relationship("Leads", back_populates="phonet_leads")
@@ -95,6 +121,9 @@ class PhonetLeads(db.Model):
 
 class Assistant(db.Model):
     __tablename__ = "assistant"
+    __table_args__ = (
+        db.Index("ix_assistant_active", "id", postgresql_where=db.text("is_active")),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     assistant_name = db.Column(db.String, nullable=False)
     assistant_id = db.Column(db.String, nullable=True, unique=True, default=None)
@@ -102,6 +131,8 @@ class Assistant(db.Model):
     description = db.Column(db.String, nullable=False)
     message_prompt = db.Column(db.String, nullable=True)
     is_active = db.Column(db.Boolean, nullable=False, default=False)
+    # "assistants" runs a Threads/Runs conversation, "completion" a single chat completion.
+    engine = db.Column(db.String, nullable=False, default="assistants", server_default="assistants")
 
 
 class Prompts(db.Model):
@@ -112,3 +143,57 @@ class Prompts(db.Model):
     content = db.Column(db.String, nullable=False)
     is_active = db.Column(db.Boolean, nullable=False, default=False)
 
+
+class CallProcessing(db.Model):
+    __tablename__ = "call_processing"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    unique_uuid = db.Column(db.String, nullable=False, unique=True)
+    raw_payload = db.Column(db.LargeBinary)
+    url_domain = db.Column(db.String)
+    audio_url = db.Column(db.String)
+    manager_id = db.Column(db.Integer)
+    lead_id = db.Column(db.Integer)
+    lead_element_id = db.Column(db.Integer)
+    phonet_id = db.Column(db.Integer)
+    audio_path = db.Column(db.String)
+    transcript = db.Column(db.Text)
+    analysed_text = db.Column(db.Text)
+    persisted_at = db.Column(db.DateTime)
+    downloaded_at = db.Column(db.DateTime)
+    transcribed_at = db.Column(db.DateTime)
+    analysed_at = db.Column(db.DateTime)
+    posted_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    gating = db.Column(db.String)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class TranscriptionCache(db.Model):
+    __tablename__ = "transcription_cache"
+    __table_args__ = (
+        db.UniqueConstraint("content_hash", "model", name="uq_transcription_cache_hash_model"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    content_hash = db.Column(db.String(64), nullable=False)
+    model = db.Column(db.String, nullable=False)
+    text = db.Column(db.Text, nullable=False)
+    duration = db.Column(db.Float)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class GatingPolicy(db.Model):
+    __tablename__ = "gating_policy"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    name = db.Column(db.String, nullable=False)
+    # Calls shorter than this are stored without downloading the audio.
+    min_transcribe_seconds = db.Column(db.Integer, nullable=False, default=0)
+    # Calls shorter than this are transcribed but not analysed.
+    min_analyse_seconds = db.Column(db.Integer, nullable=False, default=0)
+    # Comma-separated Phonet call_status codes / call_result values.
+    metadata_only_statuses = db.Column(db.String)
+    metadata_only_results = db.Column(db.String)
+    transcribe_only_statuses = db.Column(db.String)
+    is_active = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
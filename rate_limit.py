@@ -0,0 +1,188 @@
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Tuple
+
+from metrics import metrics
+from redis_config import redis_client
+
+# Limits are per minute and shared by every worker; 0 disables a bucket.
+OPENAI_LIMITS: Dict[str, Dict[str, float]] = {
+    "chat": {
+        "requests": float(os.getenv("OPENAI_CHAT_RPM", 500)),
+        "tokens": float(os.getenv("OPENAI_CHAT_TPM", 200000)),
+    },
+    "audio": {
+        "requests": float(os.getenv("OPENAI_AUDIO_RPM", 50)),
+        "audio_seconds": float(os.getenv("OPENAI_AUDIO_SECONDS_PER_MINUTE", 0)),
+    },
+}
+# Share of each limit the buckets hand out, so bursts stay just under the account limits.
+OPENAI_LIMIT_HEADROOM = float(os.getenv("OPENAI_LIMIT_HEADROOM", 0.9))
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 16))
+# A lease outlives a crashed worker by at most this long.
+OPENAI_LEASE_SECONDS = int(os.getenv("OPENAI_LEASE_SECONDS", 900))
+# Short waits are absorbed in-process; longer ones defer the task.
+OPENAI_LIMIT_MAX_WAIT = float(os.getenv("OPENAI_LIMIT_MAX_WAIT", 5))
+
+# Takes every bucket or none. KEYS: bucket hashes; ARGV: triples of capacity,
+# refill per second and cost per key. Returns {1, 0} or {0, wait_ms}.
+_TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local levels = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local cost = tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if cost > 0 and tokens < math.min(cost, capacity) then
+        wait = math.max(wait, (math.min(cost, capacity) - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return {0, math.ceil(wait * 1000)}
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 3 - 2])
+    local rate = tonumber(ARGV[i * 3 - 1])
+    local tokens = math.min(capacity, levels[i] - tonumber(ARGV[i * 3]))
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return {1, 0}
+"""
+
+# KEYS[1]: sorted set of leases scored by expiry; ARGV: limit, lease id, lease seconds.
+_CONCURRENCY_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+return 1
+"""
+
+
+class RateLimited(Exception):
+    def __init__(self, kind: str, retry_after: float) -> None:
+        super().__init__(f"OpenAI {kind} capacity exhausted, retry in {retry_after:.1f}s")
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+class OpenAILimiter:
+    """Token buckets (requests, tokens, audio seconds per minute) plus a concurrency cap, shared through Redis."""
+
+    def __init__(
+        self,
+        limits: Dict[str, Dict[str, float]] = OPENAI_LIMITS,
+        max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+    ) -> None:
+        self.__limits = limits
+        self.__max_concurrency = max_concurrency
+        self.__token_bucket = redis_client.register_script(_TOKEN_BUCKET_SCRIPT)
+        self.__concurrency = redis_client.register_script(_CONCURRENCY_SCRIPT)
+
+    def __buckets(self, kind: str, costs: Dict[str, float]) -> Tuple[list, list]:
+        keys, args = [], []
+        for resource, limit in self.__limits[kind].items():
+            cost = costs.get(resource, 0)
+            if limit <= 0 or not cost:
+                continue
+            capacity = limit * OPENAI_LIMIT_HEADROOM
+            keys.append(f"ratelimit:openai:{kind}:{resource}")
+            args.extend((capacity, capacity / 60, cost))
+        return keys, args
+
+    def __take(self, kind: str, costs: Dict[str, float]) -> float:
+        keys, args = self.__buckets(kind, costs)
+        if not keys:
+            return 0
+        allowed, wait_ms = self.__token_bucket(keys=keys, args=args)
+        return 0 if allowed else wait_ms / 1000
+
+    def acquire(self, kind: str, max_wait: float = OPENAI_LIMIT_MAX_WAIT, **costs: float) -> None:
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.__take(kind, costs)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                metrics.incr("openai_rate_limited_total", kind=kind)
+                raise RateLimited(kind, wait)
+            metrics.observe("openai_rate_limit_wait_seconds", wait, kind=kind)
+            time.sleep(wait)
+
+    async def acquire_async(self, kind: str, max_wait: float = OPENAI_LIMIT_MAX_WAIT, **costs: float) -> None:
+        """acquire() for the asyncio worker: waits without blocking the event loop."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.__take(kind, costs)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                metrics.incr("openai_rate_limited_total", kind=kind)
+                raise RateLimited(kind, wait)
+            metrics.observe("openai_rate_limit_wait_seconds", wait, kind=kind)
+            await asyncio.sleep(wait)
+
+    def settle(self, kind: str, **overrun: float) -> None:
+        """Charge (or refund, if negative) the difference between the estimated and the actual cost."""
+        keys, args = self.__buckets(kind, overrun)
+        if not keys:
+            return
+        # The request already happened, so this never waits; a bucket may go negative.
+        pipe = redis_client.pipeline(transaction=False)
+        for key, cost in zip(keys, args[2::3]):
+            pipe.hincrbyfloat(key, "tokens", -cost)
+        pipe.execute()
+
+    @contextmanager
+    def slot(self, kind: str, max_wait: float = OPENAI_LIMIT_MAX_WAIT, **costs: float) -> Iterator[None]:
+        """Hold one of OPENAI_MAX_CONCURRENCY in-flight slots and take ``costs`` from the ``kind`` buckets."""
+        key = "ratelimit:openai:inflight"
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + max_wait
+        while not self.__concurrency(keys=[key], args=[self.__max_concurrency, lease, OPENAI_LEASE_SECONDS]):
+            if time.monotonic() >= deadline:
+                metrics.incr("openai_rate_limited_total", kind="concurrency")
+                raise RateLimited("concurrency", 1.0)
+            time.sleep(0.2)
+
+        try:
+            self.acquire(kind, max(deadline - time.monotonic(), 0), **costs)
+            yield
+        finally:
+            redis_client.zrem(key, lease)
+
+    @asynccontextmanager
+    async def slot_async(self, kind: str, max_wait: float = OPENAI_LIMIT_MAX_WAIT, **costs: float) -> AsyncIterator[None]:
+        """slot() for the asyncio worker; the Redis round trips stay on the loop, the waits do not block it."""
+        key = "ratelimit:openai:inflight"
+        lease = uuid.uuid4().hex
+        deadline = time.monotonic() + max_wait
+        while not self.__concurrency(keys=[key], args=[self.__max_concurrency, lease, OPENAI_LEASE_SECONDS]):
+            if time.monotonic() >= deadline:
+                metrics.incr("openai_rate_limited_total", kind="concurrency")
+                raise RateLimited("concurrency", 1.0)
+            await asyncio.sleep(0.2)
+
+        try:
+            await self.acquire_async(kind, max(deadline - time.monotonic(), 0), **costs)
+            yield
+        finally:
+            redis_client.zrem(key, lease)
+
+
+openai_limiter = OpenAILimiter()
@@ -0,0 +1,254 @@
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, NamedTuple, Optional
+
+import openai
+import requests
+from celery.exceptions import Ignore
+from kombu.utils.json import dumps, loads
+
+from celery_settings import celery
+from metrics import metrics
+from redis_config import redis_client
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_WINDOW_SECONDS = int(os.getenv("BREAKER_WINDOW_SECONDS", 60))
+BREAKER_COOLDOWN_SECONDS = int(os.getenv("BREAKER_COOLDOWN_SECONDS", 60))
+
+PARKED_TASKS_KEY = "parked:tasks"
+PARK_RELEASE_INTERVAL = float(os.getenv("PARK_RELEASE_INTERVAL", 5))
+PARK_RELEASE_BATCH = 500
+# A call parked this many times fails instead; counted over PARK_COUNT_TTL seconds.
+PARK_MAX_TIMES = int(os.getenv("PARK_MAX_TIMES", 30))
+PARK_COUNT_TTL = 24 * 3600
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class RetryPolicy(NamedTuple):
+    max_retries: int
+    base_delay: float
+    max_delay: float
+
+    def countdown(self, retries: int) -> float:
+        # Equal jitter: at least half the exponential delay, so retries spread out but still back off.
+        delay = min(self.max_delay, self.base_delay * 2 ** retries)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    "phonet": RetryPolicy(max_retries=5, base_delay=10, max_delay=600),
+    "crm": RetryPolicy(max_retries=8, base_delay=15, max_delay=1800),
+    "openai": RetryPolicy(max_retries=6, base_delay=20, max_delay=900),
+}
+
+
+def is_transient(error: BaseException) -> bool:
+    """Failures worth retrying: the dependency was unreachable, timed out or answered 5xx/429."""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def is_out_of_quota(error: BaseException) -> bool:
+    """An OpenAI 429 that waiting does not fix: the account has run out of credit."""
+    if not isinstance(error, openai.RateLimitError):
+        return False
+    return "insufficient_quota" in (error.code, error.type)
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: float) -> None:
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Shared through Redis: opens after ``threshold`` transient failures within ``window`` seconds,
+    then lets a single probe through once ``cooldown`` has passed."""
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int = BREAKER_FAILURE_THRESHOLD,
+        window: int = BREAKER_WINDOW_SECONDS,
+        cooldown: int = BREAKER_COOLDOWN_SECONDS,
+    ) -> None:
+        self.name = name
+        self.__threshold = threshold
+        self.__window = window
+        self.__cooldown = cooldown
+        self.__failures_key = f"breaker:{name}:failures"
+        self.__open_key = f"breaker:{name}:open"
+        self.__tripped_key = f"breaker:{name}:tripped"
+        self.__probe_key = f"breaker:{name}:probe"
+
+    def __set_state(self, state: str) -> None:
+        metrics.set_gauge("circuit_breaker_state", BREAKER_STATES[state], shared=True, dependency=self.name)
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpen if calls are blocked; return True if a success has state to clear."""
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.pttl(self.__open_key)
+            pipe.exists(self.__tripped_key)
+            pipe.exists(self.__failures_key)
+            open_ttl, tripped, failures = pipe.execute()
+
+            if open_ttl and open_ttl > 0:
+                self.__set_state("open")
+                metrics.incr("circuit_breaker_rejected_total", dependency=self.name)
+                raise CircuitOpen(self.name, open_ttl / 1000)
+            if tripped:
+                # Half-open: only the caller that wins the probe key may try the dependency.
+                if not redis_client.set(self.__probe_key, 1, nx=True, ex=self.__cooldown):
+                    self.__set_state("half_open")
+                    metrics.incr("circuit_breaker_rejected_total", dependency=self.name)
+                    raise CircuitOpen(self.name, min(self.__cooldown, PARK_RELEASE_INTERVAL * 2))
+                self.__set_state("half_open")
+            return bool(tripped or failures)
+        except CircuitOpen:
+            raise
+        except Exception:
+            # Without Redis the breaker fails closed, i.e. calls go through.
+            logger.warning(
+                f"Circuit breaker {self.name} unavailable",
+                exc_info=True,
+                extra={
+                    "status_code": "500",
+                    "status_message": "Circuit breaker Redis error",
+                    "operation_type": "RESILIENCE",
+                    "service": "FLASK",
+                },
+            )
+            return False
+
+    def record_success(self) -> None:
+        redis_client.delete(self.__failures_key, self.__tripped_key, self.__probe_key)
+        self.__set_state("closed")
+
+    def record_failure(self) -> None:
+        pipe = redis_client.pipeline()
+        pipe.incr(self.__failures_key)
+        pipe.exists(self.__tripped_key)
+        failures, tripped = pipe.execute()
+        if failures == 1:
+            # The window starts at the first failure.
+            redis_client.expire(self.__failures_key, self.__window)
+        if not tripped and failures < self.__threshold:
+            return
+
+        pipe = redis_client.pipeline()
+        pipe.set(self.__open_key, 1, ex=self.__cooldown)
+        pipe.set(self.__tripped_key, 1)
+        pipe.delete(self.__failures_key, self.__probe_key)
+        pipe.execute()
+        self.__set_state("open")
+        logger.warning(
+            f"Circuit for {self.name} opened for {self.__cooldown}s",
+            extra={
+                "status_code": "503",
+                "status_message": "Circuit opened",
+                "operation_type": "RESILIENCE",
+                "service": "FLASK",
+            },
+        )
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        dirty = self.before_call()
+        try:
+            yield
+        except Exception as e:
+            try:
+                if is_transient(e):
+                    self.record_failure()
+                elif dirty:
+                    # Any answer, even a 4xx, shows the dependency is reachable again.
+                    self.record_success()
+            except Exception:
+                pass
+            raise
+        else:
+            if dirty:
+                self.record_success()
+
+
+breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in RETRY_POLICIES}
+
+
+def retry_or_raise(task, dependency: str, error: Exception) -> Exception:
+    """Return the exception the task should raise: a scheduled Retry for transient errors, else ``error``."""
+    policy = RETRY_POLICIES[dependency]
+    retries = task.request.retries
+    if task.request.called_directly or not is_transient(error) or retries >= policy.max_retries:
+        return error
+
+    countdown = policy.countdown(retries)
+    metrics.incr("pipeline_retries_total", task=task.name.rsplit(".", 1)[-1], dependency=dependency)
+    return task.retry(exc=error, countdown=countdown, max_retries=policy.max_retries, throw=False)
+
+
+def may_park(call_key: str, task_name: str, reason: str) -> bool:
+    """Count one more park of ``call_key``; False once it has been parked PARK_MAX_TIMES times."""
+    pipe = redis_client.pipeline()
+    pipe.incr(f"parked:count:{call_key}")
+    pipe.expire(f"parked:count:{call_key}", PARK_COUNT_TTL)
+    parks, _ = pipe.execute()
+    if parks > PARK_MAX_TIMES:
+        metrics.incr("pipeline_park_exhausted_total", task=task_name, reason=reason)
+        return False
+    return True
+
+
+def park(task, error: Exception, delay: float, reason: str, call_key: Optional[str] = None) -> Exception:
+    """Hold the task in Redis for ``delay`` seconds without using a retry or a worker slot.
+
+    The stored signature keeps the rest of the chain; release_parked_tasks re-sends it when due.
+    Returns Ignore once parked; otherwise, e.g. after PARK_MAX_TIMES parks of ``call_key``,
+    the error itself, which the caller should fail the call with.
+    """
+    if task.request.called_directly or task.request.is_eager:
+        return error
+
+    if call_key and not may_park(call_key, task.name.rsplit(".", 1)[-1], reason):
+        return error
+
+    signature = task.signature_from_request(task.request)
+    redis_client.zadd(PARKED_TASKS_KEY, {dumps(dict(signature)): time.time() + delay})
+    metrics.incr("pipeline_parked_total", task=task.name.rsplit(".", 1)[-1], reason=reason)
+    return Ignore()
+
+
+@celery.task(ignore_result=True)
+def release_parked_tasks() -> int:
+    released = 0
+    for item in redis_client.zrangebyscore(PARKED_TASKS_KEY, 0, time.time(), start=0, num=PARK_RELEASE_BATCH):
+        # ZREM is the claim, so concurrent releasers never send the same task twice.
+        if not redis_client.zrem(PARKED_TASKS_KEY, item):
+            continue
+        try:
+            celery.signature(loads(item)).apply_async()
+            released += 1
+        except Exception:
+            redis_client.zadd(PARKED_TASKS_KEY, {item: time.time() + PARK_RELEASE_INTERVAL})
+            logger.error(
+                "Failed to release parked task",
+                exc_info=True,
+                extra={
+                    "status_code": "500",
+                    "status_message": "Parked task release error",
+                    "operation_type": "RESILIENCE",
+                    "service": "FLASK",
+                },
+            )
+    metrics.set_gauge("parked_tasks", redis_client.zcard(PARKED_TASKS_KEY), shared=True)
+    return released
@@ -0,0 +1,148 @@
+"""Assert that the hot ORM queries are served by an index.
+
+Runs EXPLAIN for the queries issued by database_orm.py, decorators.py and
+trancription.py (plus the FK joins the admin follows) against the configured
+Postgres database, and fails if any of them falls back to a sequential scan.
+
+Usage:
+    python -m scripts.check_query_plans
+
+Sequential scans are disabled for the session, so the check is meaningful on
+a near-empty development database as well: it proves an index is usable, not
+that the planner prefers it for today's row counts.
+"""
+import sys
+import uuid
+from typing import Iterator, List, NamedTuple, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+import database
+from models import (
+    SEARCH_CONFIG,
+    Analyzes,
+    Assistant,
+    CallProcessing,
+    Integrations,
+    Leads,
+    Manager,
+    Phonet,
+    PhonetLeads,
+    Prompts,
+)
+
+
+class PlanCheck(NamedTuple):
+    source: str
+    description: str
+    statement: object
+    relation: str
+    index: Optional[str] = None
+
+
+def _integration_upsert():
+    stmt = insert(Integrations).values(subdomain="check", link="https://check")
+    return stmt.on_conflict_do_update(
+        index_elements=[Integrations.subdomain],
+        set_={"subdomain": stmt.excluded.subdomain},
+    ).returning(Integrations.id)
+
+
+def _manager_upsert():
+    stmt = insert(Manager).values(crm_user_id=0, username="check", type=0)
+    return stmt.on_conflict_do_update(
+        index_elements=[Manager.crm_user_id],
+        set_={"crm_user_id": stmt.excluded.crm_user_id},
+    ).returning(Manager.id)
+
+
+CHECKS: List[PlanCheck] = [
+    PlanCheck("database_orm.py", "upsert integration by subdomain", _integration_upsert(),
+              "integrations", "uq_integrations_subdomain"),
+    PlanCheck("database_orm.py", "upsert manager by crm_user_id", _manager_upsert(),
+              "manager", "uq_manager_crm_user_id"),
+    PlanCheck("decorators.py", "manager permission by id",
+              select(Manager.is_permissions).where(Manager.id == 1), "manager"),
+    # The two queries of _load_active_assistant, run on an assistant cache miss.
+    PlanCheck("trancription.py", "first active assistant",
+              select(Assistant.id, Assistant.assistant_id, Assistant.message_prompt, Assistant.model, Assistant.engine)
+              .where(Assistant.is_active == True).limit(1),
+              "assistant", "ix_assistant_active"),
+    PlanCheck("trancription.py", "active prompts of the assistant",
+              select(Prompts.prompt_type, Prompts.content).where(Prompts.assistant_id == 1, Prompts.is_active == True),
+              "prompts", "prompts_assistant_id_key"),
+    PlanCheck("checkpoint.py", "call checkpoint by UNIQ",
+              select(CallProcessing).where(CallProcessing.unique_uuid == "check"), "call_processing"),
+    PlanCheck("dedup", "phonet by unique_uuid",
+              select(Phonet.id).where(Phonet.unique_uuid == uuid.UUID(int=0)), "phonet", "ix_phonet_unique_uuid"),
+    PlanCheck("admin", "leads by manager", select(Leads.id).where(Leads.manager_id == 1),
+              "leads", "ix_leads_manager_id"),
+    PlanCheck("admin", "leads by integration", select(Leads.id).where(Leads.integration_id == 1),
+              "leads", "ix_leads_integration_id"),
+    PlanCheck("admin", "analyses by lead", select(Analyzes.id).where(Analyzes.lead_id == 1),
+              "analyzes", "ix_analyzes_lead_id"),
+    PlanCheck("admin", "phonet_leads by phonet", select(PhonetLeads.id).where(PhonetLeads.phonet_id == 1),
+              "phonet_leads", "ix_phonet_leads_phonet_id"),
+    PlanCheck("admin", "analyses full-text search",
+              select(Analyzes.id).where(Analyzes.search_vector.op("@@")(func.to_tsquery(SEARCH_CONFIG, "check:*"))),
+              "analyzes", "ix_analyzes_search_vector"),
+    PlanCheck("admin", "leads full-text search",
+              select(Leads.id).where(Leads.search_vector.op("@@")(func.to_tsquery(SEARCH_CONFIG, "check:*"))),
+              "leads", "ix_leads_search_vector"),
+    PlanCheck("admin", "phonet_leads by lead", select(PhonetLeads.id).where(PhonetLeads.leads_id == 1),
+              "phonet_leads", "ix_phonet_leads_leads_id"),
+]
+
+
+def _walk(node: dict) -> Iterator[dict]:
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def explain(connection, statement) -> dict:
+    compiled = statement.compile(dialect=database.get_engine().dialect)
+    # exec_driver_sql skips SQLAlchemy's bind processing, so adapt UUIDs here.
+    params = {key: str(value) if isinstance(value, uuid.UUID) else value for key, value in compiled.params.items()}
+    result = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", params)
+    return result.scalar()[0]["Plan"]
+
+
+def evaluate(plan: dict, check: PlanCheck) -> Optional[str]:
+    """Return the index serving the check's relation, or None if it is scanned sequentially."""
+    # INSERT ... ON CONFLICT resolves conflicts through its arbiter index.
+    arbiters = plan.get("Conflict Arbiter Indexes")
+    if arbiters:
+        return check.index if check.index in arbiters else (None if check.index else arbiters[0])
+
+    for node in _walk(plan):
+        if node.get("Relation Name") != check.relation:
+            continue
+        if node["Node Type"] == "Seq Scan":
+            return None
+        # Bitmap heap scans name their index on the child Bitmap Index Scan node.
+        for index in (child.get("Index Name") for child in _walk(node)):
+            if index and check.index in (None, index):
+                return index
+    return None
+
+
+def main() -> int:
+    failures = 0
+    with database.get_engine().connect() as connection:
+        connection.exec_driver_sql("SET enable_seqscan = off")
+        for check in CHECKS:
+            index = evaluate(explain(connection, check.statement), check)
+            status = "ok" if index else "FAIL"
+            failures += not index
+            print(f"[{status:>4}] {check.source:<16} {check.description:<36} {index or '-'}")
+        connection.rollback()
+
+    if failures:
+        print(f"{failures} quer{'y' if failures == 1 else 'ies'} without index support")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
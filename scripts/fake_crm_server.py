@@ -0,0 +1,231 @@
+"""Offline stand-in for the amoCRM v4 API and Phonet call recordings.
+
+Serves the endpoints ApiCRMManager uses, so load tests and local runs can
+exercise the whole process_webhook_data path without a real account:
+
+    GET  /api/v4/leads/pipelines
+    GET  /api/v4/leads/<id>
+    POST /api/v4/leads/<id>/notes
+    GET  /api/v4/leads/notes       filter[entity_id][], filter[updated_at][from], limit and page are honoured
+    POST /api/v4/leads/notes
+    GET  /records/<name>           call recording for the webhook ``link``
+    GET  /_notes                   every note received so far
+
+Usage:
+    python -m scripts.fake_crm_server [--port 8089] [--latency 0.05] [--rps 7] [--audio call.mp3]
+
+Point the workers at it with CRM_BASE_URL=http://localhost:8089 and use
+http://localhost:8089/records/<name>.mp3 as the call link. Leads whose id is
+listed in --missing answer 204 like amoCRM does; requests above --rps per
+second answer 429.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from typing import List, Optional
+
+PIPELINES = [
+    {
+        "id": 7001,
+        "name": "Sales",
+        "_embedded": {
+            "statuses": [
+                {"id": 142, "name": "Closed - won", "pipeline_id": 7001},
+                {"id": 143, "name": "Closed - lost", "pipeline_id": 7001},
+                {"id": 61001, "name": "New lead", "pipeline_id": 7001},
+                {"id": 61002, "name": "Contacted", "pipeline_id": 7001},
+                {"id": 61003, "name": "Negotiation", "pipeline_id": 7001},
+            ]
+        },
+    },
+    {
+        "id": 7002,
+        "name": "Support",
+        "_embedded": {
+            "statuses": [
+                {"id": 62001, "name": "Incoming", "pipeline_id": 7002},
+                {"id": 62002, "name": "Resolved", "pipeline_id": 7002},
+            ]
+        },
+    },
+]
+STATUSES = [status for pipeline in PIPELINES for status in pipeline["_embedded"]["statuses"]]
+
+LEAD_PATH = re.compile(r"^/api/v4/leads/(\d+)$")
+LEAD_NOTES_PATH = re.compile(r"^/api/v4/leads/(\d+)/notes$")
+
+
+class FakeCRM:
+    def __init__(self, latency: float, rps: float, missing: List[int], audio: bytes) -> None:
+        self.latency = latency
+        self.rps = rps
+        self.missing = set(missing)
+        self.audio = audio
+        self.notes: List[dict] = []
+        self.__lock = threading.Lock()
+        self.__window = 0
+        self.__count = 0
+
+    def admit(self) -> bool:
+        if self.rps <= 0:
+            return True
+        with self.__lock:
+            second = int(time.time())
+            if second != self.__window:
+                self.__window, self.__count = second, 0
+            self.__count += 1
+            return self.__count <= self.rps
+
+    def add_notes(self, notes: List[dict], lead_id: Optional[int] = None) -> List[dict]:
+        created = []
+        with self.__lock:
+            for note in notes:
+                note_id = len(self.notes) + 1
+                entity_id = lead_id if lead_id is not None else note.get("entity_id")
+                self.notes.append({**note, "id": note_id, "entity_id": entity_id, "updated_at": int(time.time())})
+                created.append({"id": note_id, "entity_id": entity_id, "request_id": note.get("request_id", "0")})
+        return created
+
+    def find_notes(self, lead_ids: List[str], updated_from: int) -> List[dict]:
+        with self.__lock:
+            notes = [
+                note for note in self.notes
+                if (not lead_ids or str(note["entity_id"]) in lead_ids) and note["updated_at"] >= updated_from
+            ]
+        return notes[::-1]
+
+def lead(lead_id: int) -> dict:
+    status = STATUSES[lead_id % len(STATUSES)]
+    return {
+        "id": lead_id,
+        "name": f"Lead #{lead_id}",
+        "status_id": status["id"],
+        "pipeline_id": status["pipeline_id"],
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    crm: FakeCRM
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def __send(self, status: int, body: Optional[object] = None, content_type: str = "application/hal+json") -> None:
+        payload = b"" if body is None else body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        if payload:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def __read_json(self) -> object:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def __admit(self) -> bool:
+        if self.crm.latency:
+            time.sleep(self.crm.latency)
+        if self.crm.admit():
+            return True
+        self.__send(429, {"title": "Too Many Requests", "status": 429})
+        return False
+
+    def do_GET(self) -> None:
+        path, _, query = self.path.partition("?")
+        if path.startswith("/records/"):
+            self.__send(200, self.crm.audio, "audio/mpeg")
+            return
+        if path == "/_notes":
+            self.__send(200, self.crm.notes, "application/json")
+            return
+        if not self.__admit():
+            return
+        if path == "/api/v4/leads/pipelines":
+            self.__send(200, {"_total_items": len(PIPELINES), "_embedded": {"pipelines": PIPELINES}})
+            return
+        if path == "/api/v4/leads/notes":
+            params = parse_qs(query)
+            limit = int(params.get("limit", [250])[0])
+            page = int(params.get("page", [1])[0])
+            notes = self.crm.find_notes(
+                params.get("filter[entity_id][]", []),
+                int(params.get("filter[updated_at][from]", [0])[0]),
+            )
+            found = notes[(page - 1) * limit:page * limit]
+            if not found:
+                self.__send(204)
+                return
+            body = {"_page": page, "_embedded": {"notes": found}, "_links": {"self": {"href": self.path}}}
+            if len(notes) > page * limit:
+                body["_links"]["next"] = {"href": path + f"?page={page + 1}"}
+            self.__send(200, body)
+            return
+        match = LEAD_PATH.match(path)
+        if match:
+            lead_id = int(match.group(1))
+            if lead_id in self.crm.missing:
+                self.__send(204)
+            else:
+                self.__send(200, lead(lead_id))
+            return
+        self.__send(404, {"title": "Not Found", "status": 404})
+
+    def do_POST(self) -> None:
+        path = self.path.split("?", 1)[0]
+        try:
+            notes = self.__read_json()
+        except ValueError:
+            self.__send(400, {"title": "Bad Request", "status": 400})
+            return
+        if not self.__admit():
+            return
+        if not isinstance(notes, list):
+            self.__send(400, {"title": "Bad Request", "status": 400})
+            return
+
+        match = LEAD_NOTES_PATH.match(path)
+        if match:
+            created = self.crm.add_notes(notes, int(match.group(1)))
+        elif path == "/api/v4/leads/notes":
+            created = self.crm.add_notes(notes)
+        else:
+            self.__send(404, {"title": "Not Found", "status": 404})
+            return
+        self.__send(200, {"_embedded": {"notes": created}})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_CRM_PORT", 8089)))
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument("--rps", type=float, default=7, help="requests per second before answering 429, 0 disables")
+    parser.add_argument("--missing", type=int, nargs="*", default=[], help="lead ids that answer 204")
+    parser.add_argument("--audio", help="file served for /records/*, defaults to 32 KB of zeros")
+    args = parser.parse_args()
+
+    audio = b"\0" * 32 * 1024
+    if args.audio:
+        with open(args.audio, "rb") as file:
+            audio = file.read()
+
+    Handler.crm = FakeCRM(args.latency, args.rps, args.missing, audio)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f"Fake CRM listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
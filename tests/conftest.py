@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import quote
+
+import fakeredis
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+TEST_DATABASE_URI = os.getenv("TEST_DATABASE_URI")
+
+# Set before anything reads them at import time.
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["ACCESS_TOKEN"] = "test"
+os.environ["DB_POOL_ROLE"] = "cli"
+os.environ["TRANSCRIBE_CHUNKED"] = "false"
+if TEST_DATABASE_URI:
+    os.environ["SQLALCHEMY_DATABASE_URI"] = TEST_DATABASE_URI
+
+# Every module binds redis_config.redis_client on import, so swap it first.
+import redis_config  # noqa: E402
+
+redis_config.redis_client = fakeredis.FakeStrictRedis()
+
+from scripts import fake_crm_server  # noqa: E402
+
+SAMPLE_LINK = "https://phonet.example.com/rec/"
+
+
+@pytest.fixture(scope="session")
+def app():
+    if not TEST_DATABASE_URI:
+        pytest.skip("TEST_DATABASE_URI is not set; point it at an empty, disposable Postgres database")
+
+    from flask_migrate import upgrade
+
+    from app import app as flask_app
+    from celery_settings import celery
+
+    celery.conf.update(task_always_eager=True, task_eager_propagates=True)
+    with flask_app.app_context():
+        upgrade(directory=str(ROOT / "migrations"))
+    return flask_app
+
+
+@pytest.fixture
+def fake_redis():
+    """The fakeredis client every module is bound to, emptied for the test."""
+    redis_config.redis_client.flushall()
+    return redis_config.redis_client
+
+
+@pytest.fixture(scope="session")
+def fake_crm_url():
+    fake_crm_server.Handler.crm = fake_crm_server.FakeCRM(0.0, 0, [], b"\xff\xfb" + b"\0" * 4094)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), fake_crm_server.Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_crm(fake_crm_url, monkeypatch):
+    from api.webhook.functions import source
+
+    monkeypatch.setattr(source, "CRM_BASE_URL", fake_crm_url)
+    fake_crm_server.Handler.crm.notes.clear()
+    return fake_crm_server.Handler.crm
+
+
+class FakeOpenAI:
+    """Answers the two OpenAI calls the pipeline makes with the completion engine."""
+
+    transcript = "Добрий день, хочу замовити доставку на завтра."
+    analysis = "Клієнт замовляє доставку на завтра."
+
+    def __init__(self) -> None:
+        self.requests = []
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self.__transcribe))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.__complete))
+
+    def __transcribe(self, **kwargs):
+        self.requests.append("transcription")
+        return SimpleNamespace(text=self.transcript, duration=241.0)
+
+    def __complete(self, **kwargs):
+        self.requests.append("completion")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.analysis))],
+            usage=SimpleNamespace(total_tokens=120),
+        )
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    from api.openai import trancription
+
+    client = FakeOpenAI()
+    monkeypatch.setattr(trancription, "client", client)
+    return client
+
+
+@pytest.fixture
+def db(app, tmp_path, monkeypatch):
+    """A clean database and Redis per test; downloaded audio goes to a temporary directory."""
+    import local_cache
+    from database import SessionLocal
+    from models import Assistant, Manager
+    from models import db as flask_db
+
+    with app.app_context():
+        tables = ", ".join(f'"{table.name}"' for table in flask_db.metadata.sorted_tables)
+        with flask_db.engine.begin() as connection:
+            connection.exec_driver_sql(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+    redis_config.redis_client.flushall()
+    local_cache._invalidate_all()
+    monkeypatch.chdir(tmp_path)
+
+    with SessionLocal() as session:
+        session.add(Assistant(
+            assistant_name="Call review",
+            model="gpt-4o-mini",
+            description="Summarises the call",
+            message_prompt="Summarise the call in one sentence.",
+            is_active=True,
+            engine="completion",
+        ))
+        # The author of the sample webhook; downloads need a manager with permissions.
+        session.add(Manager(crm_user_id=7712301, username="Olena Koval", type=1, is_permissions=True))
+        session.commit()
+        yield session
+
+
+@pytest.fixture
+def webhook(fake_crm_url):
+    """The first sample webhook, with its recording served by the fake CRM."""
+    with open(ROOT / "benchmarks" / "samples" / "webhooks.jsonl") as samples:
+        body = json.loads(samples.readline())["body"]
+    return body.replace(quote(SAMPLE_LINK, safe=""), quote(f"{fake_crm_url}/records/", safe="")).encode()
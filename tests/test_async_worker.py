@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+from api.openai.async_worker import AsyncStageWorker
+from api.webhook.functions import openai_queue
+from api.webhook.functions.checkpoint import STAGES, load_call
+from api.webhook.pipeline import build_pipeline, flush_crm_notes
+from models import Analyzes
+from redis_config import redis_client
+
+CALL_KEY = "4c1f3b0e-8f2a-4d6b-9a51-0e7f0d3c2b11"
+
+
+class FakeAsyncOpenAI:
+    """FakeOpenAI's answers, on coroutines; records how many requests overlapped."""
+
+    def __init__(self, fake_openai) -> None:
+        self.fake = fake_openai
+        self.inflight = 0
+        self.most_inflight = 0
+        self.audio = SimpleNamespace(transcriptions=SimpleNamespace(create=self.__transcribe))
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.__complete))
+
+    async def __call(self, kind, answer):
+        self.inflight += 1
+        self.most_inflight = max(self.most_inflight, self.inflight)
+        try:
+            await asyncio.sleep(0.05)
+            self.fake.requests.append(kind)
+            return answer
+        finally:
+            self.inflight -= 1
+
+    async def __transcribe(self, **kwargs):
+        return await self.__call("transcription", SimpleNamespace(text=self.fake.transcript, duration=241.0))
+
+    async def __complete(self, **kwargs):
+        return await self.__call("completion", SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.fake.analysis))],
+            usage=SimpleNamespace(total_tokens=120),
+        ))
+
+    async def close(self):
+        pass
+
+
+async def drain(worker):
+    serving = asyncio.create_task(worker.serve())
+    while redis_client.zcard(openai_queue.QUEUE_KEY) or redis_client.zcard(openai_queue.LEASES_KEY):
+        await asyncio.sleep(0.02)
+    worker.stop()
+    await serving
+
+
+def test_async_worker_runs_openai_stages_and_resumes_chain(db, webhook, fake_crm, fake_openai, monkeypatch):
+    monkeypatch.setattr(openai_queue, "OPENAI_ASYNC", True)
+
+    build_pipeline(webhook).apply()
+    record = load_call(CALL_KEY)
+    assert record.downloaded_at is not None and record.transcribed_at is None
+    assert redis_client.zscore(openai_queue.QUEUE_KEY, CALL_KEY) is not None
+
+    client = FakeAsyncOpenAI(fake_openai)
+    asyncio.run(drain(AsyncStageWorker(concurrency=4, client=client)))
+    flush_crm_notes.apply(args=(record.url_domain,))
+
+    record = load_call(CALL_KEY)
+    assert all(getattr(record, f"{stage}_at") is not None for stage in STAGES)
+    assert record.last_error is None
+    assert db.query(Analyzes).one().analysed_text == fake_openai.analysis
+    assert [note["params"]["text"] for note in fake_crm.notes] == [fake_openai.analysis]
+    assert fake_openai.requests == ["transcription", "completion"]
+
+
+def test_async_worker_keeps_several_calls_in_flight(db, webhook, fake_crm, fake_openai, monkeypatch):
+    monkeypatch.setattr(openai_queue, "OPENAI_ASYNC", True)
+    call_keys = [CALL_KEY[:-1] + str(number) for number in range(6)]
+    for call_key in call_keys:
+        build_pipeline(webhook.replace(CALL_KEY.encode(), call_key.encode())).apply()
+
+    client = FakeAsyncOpenAI(fake_openai)
+    asyncio.run(drain(AsyncStageWorker(concurrency=4, client=client)))
+
+    assert all(load_call(call_key).analysed_at is not None for call_key in call_keys)
+    assert 1 < client.most_inflight <= 4
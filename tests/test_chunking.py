@@ -0,0 +1,47 @@
+import pytest
+
+from api.openai.functions.chunking import CHUNK_SECONDS, SILENCE_SEARCH_SECONDS, split_points, stitch
+
+
+def test_short_audio_is_not_split():
+    assert split_points(CHUNK_SECONDS, []) == []
+    assert split_points(CHUNK_SECONDS * 1.2, [(10, 12)]) == []
+
+
+def test_cuts_at_chunk_marks_without_silences():
+    assert split_points(CHUNK_SECONDS * 3, []) == [(CHUNK_SECONDS, False), (CHUNK_SECONDS * 2, False)]
+
+
+def test_cuts_at_the_closest_silence_near_a_mark():
+    near, nearer = CHUNK_SECONDS - SILENCE_SEARCH_SECONDS / 2, CHUNK_SECONDS + 2
+    silences = [(near - 1, near + 1), (nearer - 0.5, nearer + 0.5)]
+
+    points = split_points(CHUNK_SECONDS * 2.5, silences)
+
+    assert points[0] == (nearer, True)
+    # The next mark counts from the cut actually made.
+    assert points[1] == (nearer + CHUNK_SECONDS, False)
+
+
+def test_silences_too_far_from_a_mark_are_ignored():
+    far = CHUNK_SECONDS - SILENCE_SEARCH_SECONDS - 5
+
+    assert split_points(CHUNK_SECONDS * 2, [(far - 1, far + 1)]) == [(CHUNK_SECONDS, False)]
+
+
+@pytest.mark.parametrize(
+    "texts, expected",
+    [
+        (["добрий день хочу замовити", "хочу замовити доставку"], "добрий день хочу замовити доставку"),
+        (["Хочу замовити,", "хочу замовити доставку."], "Хочу замовити, доставку."),
+        (["one two", "three four"], "one two three four"),
+        (["one two", "", "two three"], "one two three"),
+    ],
+)
+def test_stitch_drops_words_repeated_across_a_boundary(texts, expected):
+    assert stitch(texts) == expected
+
+
+def test_stitch_keeps_repeats_at_silence_cuts():
+    assert stitch(["так так", "так добре"], overlapped=[False]) == "так так так добре"
+    assert stitch(["так так", "так добре"], overlapped=[True]) == "так так добре"
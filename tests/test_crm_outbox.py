@@ -0,0 +1,124 @@
+import json
+import time
+
+import pytest
+import requests
+
+from api.webhook.functions import crm_outbox
+from api.webhook.pipeline import flush_crm_notes
+from redis_config import redis_client
+
+ACCOUNT = "outbox-test"
+
+
+@pytest.fixture
+def calls(fake_crm, fake_redis, monkeypatch):
+    """The outbox's checkpoint calls, kept in memory instead of CallProcessing."""
+    state = {"posted": set(), "failed": {}}
+    monkeypatch.setattr(crm_outbox, "calls_done", lambda keys, stage: state["posted"] & set(keys))
+    monkeypatch.setattr(crm_outbox, "complete_stage_for_calls", lambda keys, stage: state["posted"].update(keys))
+    monkeypatch.setattr(
+        crm_outbox, "record_failure", lambda key, stage, error: state["failed"].__setitem__(key, error)
+    )
+    return state
+
+
+def queue(count, start=0):
+    for number in range(start, start + count):
+        crm_outbox.enqueue(ACCOUNT, f"call-{number}", 1000 + number, f"note {number}")
+
+
+def crash_after_claim(count):
+    """Leave a batch in flight as a flush that died before its checkpoint would."""
+    keys = crm_outbox._keys(ACCOUNT)
+    crm_outbox._claim(keys=[keys["notes"], keys["queue"], keys["inflight"]], args=[count])
+
+
+def test_flush_posts_a_batch_and_checkpoints_it(calls, fake_crm):
+    queue(3)
+
+    assert crm_outbox.flush(ACCOUNT) == 3
+
+    assert sorted(note["params"]["text"] for note in fake_crm.notes) == ["note 0", "note 1", "note 2"]
+    assert calls["posted"] == {"call-0", "call-1", "call-2"}
+    assert crm_outbox.flush(ACCOUNT) == 0
+
+
+def test_recovered_batch_skips_notes_already_in_crm(calls, fake_crm):
+    queue(2)
+    crash_after_claim(2)
+    fake_crm.add_notes([{"entity_id": 1000, "note_type": "common", "params": {"text": "note 0"}}])
+
+    assert crm_outbox.flush(ACCOUNT) == 2
+
+    assert sorted(note["params"]["text"] for note in fake_crm.notes) == ["note 0", "note 1"]
+    assert calls["posted"] == {"call-0", "call-1"}
+    assert not redis_client.exists(crm_outbox._keys(ACCOUNT)["inflight"])
+
+
+def test_flush_loop_continues_past_a_recovered_batch_already_posted(calls, fake_crm):
+    queue(1)
+    crash_after_claim(1)
+    fake_crm.add_notes([{"entity_id": 1000, "note_type": "common", "params": {"text": "note 0"}}])
+    queue(crm_outbox.CRM_NOTES_BATCH_SIZE, start=1)
+
+    assert flush_crm_notes(ACCOUNT) == crm_outbox.CRM_NOTES_BATCH_SIZE + 1
+
+    assert len(fake_crm.notes) == crm_outbox.CRM_NOTES_BATCH_SIZE + 1
+    assert redis_client.zcard(crm_outbox._keys(ACCOUNT)["queue"]) == 0
+
+
+def test_rejected_batch_fails_only_pending_calls(calls, fake_crm, monkeypatch):
+    queue(2)
+    crash_after_claim(2)
+    fake_crm.add_notes([{"entity_id": 1000, "note_type": "common", "params": {"text": "note 0"}}])
+
+    def reject(self, notes):
+        response = requests.Response()
+        response.status_code = 400
+        raise requests.HTTPError("400 Bad Request", response=response)
+
+    monkeypatch.setattr(crm_outbox.ApiCRMManager, "add_notes", reject)
+
+    with pytest.raises(requests.HTTPError):
+        crm_outbox.flush(ACCOUNT)
+
+    assert calls["posted"] == {"call-0"}
+    assert set(calls["failed"]) == {"call-1"}
+    assert not redis_client.exists(crm_outbox._keys(ACCOUNT)["inflight"])
+
+
+def test_lost_lock_leaves_the_batch_in_flight(calls, fake_crm, monkeypatch):
+    queue(1)
+    crash_after_claim(1)
+    lock = crm_outbox._keys(ACCOUNT)["lock"]
+    lead_notes = crm_outbox.ApiCRMManager.lead_notes
+
+    def slow_lead_notes(self, lead_ids, updated_from=None, on_page=None):
+        # Another worker took the lock over after it expired.
+        redis_client.set(lock, "someone-else")
+        return lead_notes(self, lead_ids, updated_from, on_page)
+
+    monkeypatch.setattr(crm_outbox.ApiCRMManager, "lead_notes", slow_lead_notes)
+
+    assert crm_outbox.flush(ACCOUNT) == 0
+
+    assert fake_crm.notes == []
+    assert calls["posted"] == set()
+    assert redis_client.hlen(crm_outbox._keys(ACCOUNT)["inflight"]) == 1
+    assert redis_client.get(lock) == b"someone-else"
+
+
+def test_is_due_when_batch_is_full_or_oldest_note_is_old(calls):
+    assert not crm_outbox.is_due(ACCOUNT)
+    queue(1)
+    assert not crm_outbox.is_due(ACCOUNT)
+
+    keys = crm_outbox._keys(ACCOUNT)
+    redis_client.zadd(keys["queue"], {"call-0": time.time() - crm_outbox.CRM_NOTES_MAX_AGE - 1})
+    assert crm_outbox.is_due(ACCOUNT)
+
+    redis_client.zadd(keys["queue"], {"call-0": time.time()})
+    queue(crm_outbox.CRM_NOTES_BATCH_SIZE - 1, start=1)
+    assert crm_outbox.is_due(ACCOUNT)
+    assert json.loads(redis_client.hget(keys["notes"], "call-1"))["lead_id"] == 1001
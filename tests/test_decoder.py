@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from api.webhook.functions.decoder import decode_webhook
+from benchmarks.bench_decoder import DEFAULT_SAMPLES, check_equivalence
+
+SAMPLES = [json.loads(line) for line in DEFAULT_SAMPLES.read_text(encoding="utf-8").splitlines() if line.strip()]
+
+
+@pytest.mark.parametrize("sample", SAMPLES, ids=[sample["sample_id"] for sample in SAMPLES])
+def test_decode_webhook_matches_legacy_parser(sample):
+    check_equivalence(sample["sample_id"], sample["body"])
+
+
+def test_decode_webhook_reads_phonet_call():
+    event = decode_webhook(SAMPLES[0]["body"].encode())
+
+    assert event.is_phonet
+    assert event.call.uniq == "4c1f3b0e-8f2a-4d6b-9a51-0e7f0d3c2b11"
+    assert event.call.phone == "+380671234567"
+    assert event.call.duration == 241
+    assert event.call.call_status == 1
+    assert event.element_id == 18223401
+    assert event.author_id == 7712301
+    assert event.author_name == "Olena Koval"
+    assert event.subdomain == "phonetai"
+    assert event.text is None
+
+
+def test_decode_webhook_keeps_plain_note_text():
+    body = "leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Btext%5D=Call+me+back&leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Belement_id%5D=5"
+
+    event = decode_webhook(body)
+
+    assert not event.is_phonet
+    assert event.text == "Call me back"
+    assert event.element_id == 5
+
+
+def test_decode_webhook_skips_empty_and_unknown_fields():
+    event = decode_webhook(b"leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Belement_id%5D=&account%5Bid%5D=42")
+
+    assert event.element_id is None
+    assert event.call is None
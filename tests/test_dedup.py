@@ -0,0 +1,43 @@
+from api.webhook.functions.dedup import WebhookDeduplicator, dedup_key
+
+CALL = b"leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Btext%5D=%7B%22UNIQ%22%3A+%22abc-1%22%7D&x%5Belement_id%5D=77"
+REDELIVERED_CALL = CALL + b"&leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Bupdated_at%5D=1738065351"
+
+
+def test_first_delivery_is_claimed_and_repeats_are_not(fake_redis):
+    dedup = WebhookDeduplicator(ttl=60)
+
+    assert dedup.claim(CALL)
+    assert not dedup.claim(CALL)
+    # The same call in a body that differs elsewhere is still a duplicate.
+    assert not dedup.claim(REDELIVERED_CALL)
+
+
+def test_duplicates_are_shared_between_processes(fake_redis):
+    assert WebhookDeduplicator(ttl=60).claim(CALL)
+    assert not WebhookDeduplicator(ttl=60).claim(CALL)
+    assert fake_redis.ttl(dedup_key(CALL)) > 0
+
+
+def test_evicted_local_entry_falls_back_to_redis(fake_redis):
+    dedup = WebhookDeduplicator(ttl=60, local_size=1)
+
+    assert dedup.claim(CALL)
+    assert dedup.claim(b"other=body")
+    assert not dedup.claim(CALL)
+
+
+def test_expired_claim_can_be_claimed_again(fake_redis):
+    dedup = WebhookDeduplicator(ttl=60)
+    assert dedup.claim(CALL)
+
+    fake_redis.delete(dedup_key(CALL))
+    assert not dedup.claim(CALL)
+    assert WebhookDeduplicator(ttl=60).claim(CALL)
+
+
+def test_key_uses_call_identity_or_body_hash():
+    assert dedup_key(CALL) == "webhook:call:abc-1:77"
+    assert dedup_key(CALL, identity="given") == "webhook:call:given"
+    assert dedup_key(b"a=1").startswith("webhook:body:")
+    assert dedup_key(b"a=1") != dedup_key(b"a=2")
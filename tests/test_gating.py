@@ -0,0 +1,47 @@
+import pytest
+
+from api.webhook.functions.decoder import CallPayload
+from api.webhook.functions.gating import ANALYSE, METADATA_ONLY, TRANSCRIBE_ONLY, GatingRules, _codes, decide
+
+RULES = GatingRules(
+    min_transcribe_seconds=10,
+    min_analyse_seconds=30,
+    metadata_only_statuses=_codes("3, Busy"),
+    metadata_only_results=_codes("voicemail"),
+    transcribe_only_statuses=_codes("2"),
+)
+
+
+def call(**fields) -> CallPayload:
+    return CallPayload(**{"link": "https://phonet.example.com/rec/a.mp3", "duration": 120, "call_status": 1, **fields})
+
+
+def test_call_without_recording_is_metadata_only():
+    assert decide(None, RULES) == METADATA_ONLY
+    assert decide(call(link=""), None) == METADATA_ONLY
+
+
+def test_without_policy_every_recorded_call_is_analysed():
+    assert decide(call(duration=1), None) == ANALYSE
+
+
+@pytest.mark.parametrize("fields, decision", [
+    ({}, ANALYSE),
+    ({"duration": None}, METADATA_ONLY),
+    ({"duration": 9}, METADATA_ONLY),
+    ({"duration": 10}, TRANSCRIBE_ONLY),
+    ({"duration": 29}, TRANSCRIBE_ONLY),
+    ({"duration": 30}, ANALYSE),
+    ({"call_status": 3}, METADATA_ONLY),
+    ({"call_status": " BUSY "}, METADATA_ONLY),
+    ({"call_result": "Voicemail"}, METADATA_ONLY),
+    ({"call_status": 2}, TRANSCRIBE_ONLY),
+    ({"call_status": 2, "call_result": "voicemail"}, METADATA_ONLY),
+])
+def test_decide(fields, decision):
+    assert decide(call(**fields), RULES) == decision
+
+
+def test_codes_are_split_trimmed_and_lowercased():
+    assert _codes(" A, b ,,c ") == frozenset({"a", "b", "c"})
+    assert _codes(None) == frozenset()
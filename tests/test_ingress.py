@@ -0,0 +1,53 @@
+import json
+from urllib.parse import quote_plus
+
+import pytest
+
+from api.webhook.functions.ingress import ROUTE_CALL, ROUTE_IGNORED, call_identity, classify_webhook
+from benchmarks.bench_decoder import DEFAULT_SAMPLES
+
+SAMPLES = {
+    sample["sample_id"]: sample["body"].encode()
+    for sample in map(json.loads, DEFAULT_SAMPLES.read_text(encoding="utf-8").splitlines())
+}
+ELEMENT_ID = "leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Belement_id%5D=77"
+
+
+def note(text: str) -> bytes:
+    return f"leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Btext%5D={quote_plus(text)}&{ELEMENT_ID}".encode()
+
+
+def test_phonet_call_is_routed_with_its_identity():
+    decision = classify_webhook(SAMPLES["phonet_call"])
+
+    assert decision.route == ROUTE_CALL
+    assert decision.identity == "4c1f3b0e-8f2a-4d6b-9a51-0e7f0d3c2b11:18223401"
+
+
+def test_text_note_is_ignored():
+    assert classify_webhook(SAMPLES["text_note"]).route == ROUTE_IGNORED
+
+
+@pytest.mark.parametrize("text", [
+    '{"UNIQ": "abc-1", "LINK": ""}',
+    '{"UNIQ":"abc-1"}',
+    '{\\"UNIQ\\": \\"abc-1\\"}',
+    '{"UNIQ" : "abc-1"}',
+])
+def test_uniq_is_found_in_every_json_spelling(text):
+    assert classify_webhook(note(text)) == (ROUTE_CALL, "abc-1:77")
+
+
+@pytest.mark.parametrize("text", [
+    "Customer asked about UNIQ offers",
+    '{"UNIQUE": "abc-1"}',
+    '{"UNIQ": ""}',
+])
+def test_uniq_without_a_value_is_ignored(text):
+    assert classify_webhook(note(text)).route == ROUTE_IGNORED
+
+
+def test_identity_without_element_id():
+    body = f"leads%5Bnote%5D%5B0%5D%5Bnote%5D%5Btext%5D={quote_plus(json.dumps({'UNIQ': 'abc-1'}))}".encode()
+
+    assert call_identity(body) == "abc-1:"
@@ -0,0 +1,88 @@
+from api.webhook.functions.checkpoint import STAGES, load_call
+from api.webhook.functions.gating import ANALYSE, TRANSCRIBE_ONLY
+from api.webhook.pipeline import build_pipeline, flush_crm_notes
+from models import Analyzes, CallProcessing, GatingPolicy, Leads, Manager, Phonet, PhonetLeads
+from scripts.fake_crm_server import STATUSES
+
+CALL_KEY = "4c1f3b0e-8f2a-4d6b-9a51-0e7f0d3c2b11"
+LEAD_ELEMENT_ID = 18223401
+
+
+def run_pipeline(webhook):
+    build_pipeline(webhook).apply()
+    record = load_call(CALL_KEY)
+    flush_crm_notes.apply(args=(record.url_domain,))
+    return load_call(CALL_KEY)
+
+
+def test_pipeline_persists_analyses_and_posts_note(db, webhook, fake_crm, fake_openai):
+    record = run_pipeline(webhook)
+
+    lead = db.query(Leads).one()
+    assert lead.element_id == LEAD_ELEMENT_ID
+    assert lead.lead_status == STATUSES[LEAD_ELEMENT_ID % len(STATUSES)]["name"]
+    assert lead.manager.crm_user_id == 7712301
+    phonet = db.query(Phonet).one()
+    assert str(phonet.unique_uuid) == CALL_KEY
+    assert phonet.duration == 241
+    assert db.query(PhonetLeads).filter_by(phonet_id=phonet.id, leads_id=lead.id).count() == 1
+
+    analysis = db.query(Analyzes).one()
+    assert analysis.lead_id == lead.id
+    assert analysis.audio_text == fake_openai.transcript
+    assert analysis.analysed_text == fake_openai.analysis
+    assert analysis.is_analysed
+
+    assert all(getattr(record, f"{stage}_at") is not None for stage in STAGES)
+    assert record.gating == ANALYSE
+    assert record.last_error is None
+    assert record.lead_id == lead.id
+    assert record.transcript == fake_openai.transcript
+    assert record.analysed_text == fake_openai.analysis
+
+    assert [(note["entity_id"], note["note_type"], note["params"]["text"]) for note in fake_crm.notes] == [
+        (LEAD_ELEMENT_ID, "common", fake_openai.analysis)
+    ]
+    assert fake_openai.requests == ["transcription", "completion"]
+
+
+def test_rerun_of_finished_call_does_no_work(db, webhook, fake_crm, fake_openai):
+    run_pipeline(webhook)
+    record = run_pipeline(webhook)
+
+    assert record.attempts == 2
+    assert db.query(Leads).count() == 1
+    assert db.query(Analyzes).count() == 1
+    assert len(fake_crm.notes) == 1
+    assert fake_openai.requests == ["transcription", "completion"]
+
+
+def test_transcribe_only_call_is_saved_unanalysed(db, webhook, fake_crm, fake_openai):
+    db.add(GatingPolicy(name="No analysis", transcribe_only_statuses="1", is_active=True))
+    db.commit()
+
+    record = run_pipeline(webhook)
+
+    analysis = db.query(Analyzes).one()
+    assert analysis.audio_text == fake_openai.transcript
+    assert analysis.analysed_text is None
+    assert not analysis.is_analysed
+    assert record.gating == TRANSCRIBE_ONLY
+    assert all(getattr(record, f"{stage}_at") is not None for stage in STAGES)
+    assert fake_crm.notes == []
+    assert fake_openai.requests == ["transcription"]
+
+
+def test_denied_download_is_recorded(db, webhook, fake_crm, fake_openai):
+    db.query(Manager).update({"is_permissions": False})
+    db.commit()
+
+    record = run_pipeline(webhook)
+
+    assert record.persisted_at is not None
+    assert record.downloaded_at is None
+    assert record.last_error.startswith("downloaded: PermissionError")
+    assert db.query(CallProcessing).count() == 1
+    assert db.query(Analyzes).count() == 0
+    assert fake_crm.notes == []
+    assert fake_openai.requests == []
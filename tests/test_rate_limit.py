@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limit import OPENAI_LIMIT_HEADROOM, OpenAILimiter, RateLimited
+
+LIMITS = {"chat": {"requests": 10 / OPENAI_LIMIT_HEADROOM, "tokens": 1000 / OPENAI_LIMIT_HEADROOM}}
+INFLIGHT_KEY = "ratelimit:openai:inflight"
+
+
+def tokens(redis, resource):
+    return float(redis.hget(f"ratelimit:openai:chat:{resource}", "tokens"))
+
+
+def test_bucket_hands_out_capacity_then_limits(fake_redis):
+    limiter = OpenAILimiter(LIMITS)
+    for _ in range(10):
+        limiter.acquire("chat", max_wait=0, requests=1)
+
+    with pytest.raises(RateLimited) as raised:
+        limiter.acquire("chat", max_wait=0, requests=1)
+    # One request refills in 60 / 10 seconds.
+    assert raised.value.retry_after == pytest.approx(6, abs=0.1)
+
+
+def test_bucket_takes_every_resource_or_none(fake_redis):
+    limiter = OpenAILimiter(LIMITS)
+    limiter.acquire("chat", max_wait=0, requests=1, tokens=900)
+
+    with pytest.raises(RateLimited):
+        limiter.acquire("chat", max_wait=0, requests=1, tokens=200)
+    assert tokens(fake_redis, "requests") == pytest.approx(9, abs=0.01)
+    assert tokens(fake_redis, "tokens") == pytest.approx(100, abs=0.1)
+
+
+def test_bucket_refills_over_time(fake_redis):
+    limiter = OpenAILimiter({"chat": {"requests": 600 / OPENAI_LIMIT_HEADROOM}})
+    for _ in range(600):
+        limiter.acquire("chat", max_wait=0, requests=1)
+
+    # 10 requests per second come back; waiting is absorbed when it fits in max_wait.
+    started = time.monotonic()
+    limiter.acquire("chat", max_wait=1, requests=1)
+    assert time.monotonic() - started < 0.5
+
+
+def test_settle_charges_and_refunds(fake_redis):
+    limiter = OpenAILimiter(LIMITS)
+    limiter.acquire("chat", max_wait=0, requests=1, tokens=500)
+
+    limiter.settle("chat", tokens=-300)
+    assert tokens(fake_redis, "tokens") == pytest.approx(800, abs=0.1)
+    limiter.settle("chat", tokens=900)
+    assert tokens(fake_redis, "tokens") < 0
+
+
+def test_disabled_bucket_never_limits(fake_redis):
+    limiter = OpenAILimiter({"audio": {"requests": 0, "audio_seconds": 0}})
+    for _ in range(100):
+        limiter.acquire("audio", max_wait=0, requests=1, audio_seconds=600)
+    assert not fake_redis.keys("ratelimit:openai:audio:*")
+
+
+def test_slot_leases_bound_concurrency(fake_redis):
+    limiter = OpenAILimiter(LIMITS, max_concurrency=2)
+
+    with limiter.slot("chat", requests=1), limiter.slot("chat", requests=1):
+        assert fake_redis.zcard(INFLIGHT_KEY) == 2
+        with pytest.raises(RateLimited) as raised:
+            with limiter.slot("chat", max_wait=0, requests=1):
+                pass
+        assert raised.value.kind == "concurrency"
+
+    assert fake_redis.zcard(INFLIGHT_KEY) == 0
+    with limiter.slot("chat", max_wait=0, requests=1):
+        pass
+
+
+def test_slot_is_released_when_the_call_fails(fake_redis):
+    limiter = OpenAILimiter(LIMITS, max_concurrency=1)
+
+    with pytest.raises(ValueError):
+        with limiter.slot("chat", requests=1):
+            raise ValueError
+    assert fake_redis.zcard(INFLIGHT_KEY) == 0
+
+
+def test_expired_lease_of_a_crashed_worker_is_reclaimed(fake_redis):
+    limiter = OpenAILimiter(LIMITS, max_concurrency=1)
+    fake_redis.zadd(INFLIGHT_KEY, {"crashed": time.time() - 1})
+
+    with limiter.slot("chat", max_wait=0, requests=1):
+        assert fake_redis.zrange(INFLIGHT_KEY, 0, -1) != [b"crashed"]
+
+
+def test_slot_async_bounds_concurrency(fake_redis):
+    limiter = OpenAILimiter(LIMITS, max_concurrency=1)
+
+    async def hold_two():
+        async with limiter.slot_async("chat", requests=1):
+            with pytest.raises(RateLimited):
+                async with limiter.slot_async("chat", max_wait=0, requests=1):
+                    pass
+
+    asyncio.run(hold_two())
+    assert fake_redis.zcard(INFLIGHT_KEY) == 0
+
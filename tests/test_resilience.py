@@ -0,0 +1,114 @@
+import pytest
+import requests
+
+from resilience import CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def breaker(fake_redis):
+    return CircuitBreaker("test", threshold=2, window=60, cooldown=30)
+
+
+def fail(breaker, error=None):
+    with pytest.raises(type(error or requests.ConnectionError())):
+        with breaker.guard():
+            raise error or requests.ConnectionError()
+
+
+def succeed(breaker):
+    with breaker.guard():
+        pass
+
+
+def cool_down(redis):
+    """What the cooldown expiring does to the breaker's keys."""
+    redis.delete("breaker:test:open")
+
+
+def test_opens_after_threshold_transient_failures(breaker):
+    fail(breaker)
+    succeed(breaker)
+    fail(breaker)
+    fail(breaker)
+
+    with pytest.raises(CircuitOpen) as raised:
+        succeed(breaker)
+    assert 0 < raised.value.retry_after <= 30
+
+
+def test_success_resets_the_failure_count(breaker):
+    fail(breaker)
+    succeed(breaker)
+    fail(breaker)
+
+    succeed(breaker)
+
+
+def test_non_transient_errors_are_not_counted(breaker):
+    response = requests.Response()
+    response.status_code = 404
+    for _ in range(3):
+        fail(breaker, requests.HTTPError("404 Not Found", response=response))
+    fail(breaker, ValueError("bad payload"))
+
+    succeed(breaker)
+
+
+def test_half_open_lets_a_single_probe_through(breaker, fake_redis):
+    fail(breaker)
+    fail(breaker)
+    cool_down(fake_redis)
+
+    assert breaker.before_call()
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+
+def test_successful_probe_closes_the_breaker(breaker, fake_redis):
+    fail(breaker)
+    fail(breaker)
+    cool_down(fake_redis)
+
+    succeed(breaker)
+
+    assert not fake_redis.keys("breaker:test:*")
+    succeed(breaker)
+    succeed(breaker)
+
+
+def test_any_answer_to_the_probe_closes_the_breaker(breaker, fake_redis):
+    fail(breaker)
+    fail(breaker)
+    cool_down(fake_redis)
+
+    response = requests.Response()
+    response.status_code = 400
+    fail(breaker, requests.HTTPError("400 Bad Request", response=response))
+
+    succeed(breaker)
+
+
+def test_failed_probe_opens_the_breaker_again(breaker, fake_redis):
+    fail(breaker)
+    fail(breaker)
+    cool_down(fake_redis)
+
+    # A single failure is enough while the breaker is tripped.
+    fail(breaker)
+
+    with pytest.raises(CircuitOpen):
+        succeed(breaker)
+    cool_down(fake_redis)
+    succeed(breaker)
+
+
+def test_breaker_fails_closed_without_redis(breaker, monkeypatch):
+    import resilience
+
+    class Unreachable:
+        def pipeline(self, **kwargs):
+            raise requests.ConnectionError("redis down")
+
+    monkeypatch.setattr(resilience, "redis_client", Unreachable())
+
+    assert breaker.before_call() is False